@@ -0,0 +1,105 @@
+"""Loan archival: moves old returned loans out of the hot `loans` table.
+
+    python -m app.archive                    # archive loans returned over LOAN_ARCHIVE_AFTER_DAYS ago
+    python -m app.archive --older-than 90    # use another age, in days
+    python -m app.archive --batch-size 5000 --max-batches 10
+
+Each batch copies up to batch_size loans, returned before the cutoff, into
+loans_archive and deletes them from loans, in one transaction. A crash loses
+at most the batch in flight, which the next run picks up again. Open loans
+are never archived, so the overdue and due-soon lists and the active-loan
+stats only ever scan live rows. Loan history, per-user loans and the exports
+read both tables (see crud._loans_source).
+
+On PostgreSQL loans_archive is partitioned by return_date, and the yearly
+partitions a batch needs are created on the way.
+"""
+import argparse
+from datetime import date, timedelta
+import os
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.orm import Session
+
+from app import models
+
+LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", "365"))
+LOAN_ARCHIVE_BATCH_SIZE = int(os.getenv("LOAN_ARCHIVE_BATCH_SIZE", "1000"))
+
+ARCHIVED_COLUMNS = ("loan_id", "return_date", "user_id", "book_id", "loan_due_date", "loan_fine")
+
+
+def _ensure_partitions(db: Session, years):
+    for year in sorted(years):
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {models.LoanArchive.__tablename__}_{year} "
+            f"PARTITION OF {models.LoanArchive.__tablename__} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+
+
+def archive_loans(
+    db: Session,
+    older_than_days: int = LOAN_ARCHIVE_AFTER_DAYS,
+    batch_size: int = LOAN_ARCHIVE_BATCH_SIZE,
+    max_batches: Optional[int] = None,
+    today: Optional[date] = None
+) -> dict:
+    """Move loans returned more than older_than_days ago into loans_archive, one committed batch at a time."""
+    cutoff = (today or date.today()) - timedelta(days=older_than_days)
+    loans = models.Loan
+    archived = batches = 0
+    status = "partial"
+    while max_batches is None or batches < max_batches:
+        batch = db.execute(
+            select(loans.loan_id, loans.return_date)
+            .where(loans.return_date < cutoff)
+            .order_by(loans.loan_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not batch:
+            status = "completed"
+            break
+
+        loan_ids = [row.loan_id for row in batch]
+        if db.get_bind().dialect.name == "postgresql":
+            _ensure_partitions(db, {row.return_date.year for row in batch})
+        db.execute(
+            insert(models.LoanArchive).from_select(
+                ARCHIVED_COLUMNS,
+                select(*(getattr(loans, column) for column in ARCHIVED_COLUMNS)).where(loans.loan_id.in_(loan_ids))
+            )
+        )
+        db.execute(delete(loans).where(loans.loan_id.in_(loan_ids)))
+        db.commit()
+
+        archived += len(loan_ids)
+        batches += 1
+
+    return {"cutoff": cutoff.isoformat(), "status": status, "archived": archived, "batches": batches}
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move old returned loans into loans_archive.")
+    parser.add_argument("--older-than", type=int, default=LOAN_ARCHIVE_AFTER_DAYS,
+                        help="archive loans returned more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=LOAN_ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=None,
+                        help="stop after this many batches; the next run continues")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = archive_loans(db, args.older_than, args.batch_size, args.max_batches)
+    finally:
+        db.close()
+    print(f"Loans returned before {summary['cutoff']}: {summary['status']}, "
+          f"archived {summary['archived']} in {summary['batches']} batches")
+
+
+if __name__ == "__main__":
+    main()
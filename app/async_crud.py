@@ -0,0 +1,117 @@
+"""Async counterparts of app.crud, used when DB_ASYNC is enabled.
+
+Each coroutine runs the matching app.crud function through
+AsyncSession.run_sync. The driver I/O is awaited on the event loop, and the
+query logic and its side effects (search index, stat counters) stay defined
+in one place. Side effects that block without awaiting (the catalog version
+file lock, loading the in-process search and due-date indexes) are kept out
+of run_sync and run in the threadpool instead.
+"""
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import catalog, crud, notifications, schemas, search
+
+
+async def _run(db: AsyncSession, fn, *args, **kwargs):
+    # crud only marks catalog writes on the session (catalog.mark_changed);
+    # the version is bumped here, also when fn raised after its commit.
+    info = db.sync_session.info
+    info[catalog.DEFER_BUMP] = False
+    try:
+        return await db.run_sync(fn, *args, **kwargs)
+    finally:
+        if info.pop(catalog.DEFER_BUMP, False):
+            await run_in_threadpool(catalog.bump_version)
+
+
+async def _load_due_index():
+    if notifications.needs_load():
+        await run_in_threadpool(notifications.load_index)
+
+
+async def create_book(db: AsyncSession, book_data: schemas.BookCreate):
+    return await _run(db, crud.create_book, book_data)
+
+
+async def get_books(
+        db: AsyncSession,
+        limit: int,
+        after_id: Optional[int] = None,
+        fields: Optional[List[str]] = None
+):
+    return await _run(db, crud.get_books, limit, after_id, fields)
+
+
+async def get_book_by_name(db: AsyncSession, book_name: str, limit: int = 20):
+    if search.needs_load(db.sync_session):
+        await run_in_threadpool(search.load_index)
+    return await _run(db, crud.get_book_by_name, book_name, limit)
+
+
+async def partial_update_book(db: AsyncSession, book_id: int, book_data: schemas.BookUpdate):
+    return await _run(db, crud.partial_update_book, book_id, book_data)
+
+
+async def delete_book(db: AsyncSession, book_id: int):
+    return await _run(db, crud.delete_book, book_id)
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await _run(db, crud.get_user_by_username, username)
+
+
+async def create_user(db: AsyncSession, user_data: schemas.UserCreate, hashed_pw: Optional[str] = None):
+    return await _run(db, crud.create_user, user_data, hashed_pw)
+
+
+async def update_password_hash(db: AsyncSession, user, hashed_pw: str):
+    return await _run(db, crud.update_password_hash, user, hashed_pw)
+
+
+async def create_loan(db: AsyncSession, loan_data: schemas.LoanCreate):
+    return await _run(db, crud.create_loan, loan_data)
+
+
+async def get_loan(db: AsyncSession, loan_id: int):
+    return await _run(db, crud.get_loan, loan_id)
+
+
+async def return_loan(db: AsyncSession, loan_id: int, return_data: schemas.LoanReturn):
+    return await _run(db, crud.return_loan, loan_id, return_data)
+
+
+async def create_loans_batch(db: AsyncSession, batch: schemas.LoanBatchCreate):
+    return await _run(db, crud.create_loans_batch, batch)
+
+
+async def return_loans_batch(db: AsyncSession, batch: schemas.LoanBatchReturn, owner_id: Optional[int] = None):
+    return await _run(db, crud.return_loans_batch, batch, owner_id)
+
+
+async def get_loans_by_user(db: AsyncSession, user_id: int):
+    return await _run(db, crud.get_loans_by_user, user_id)
+
+
+async def get_overdue_loans(db: AsyncSession):
+    await _load_due_index()
+    return await _run(db, crud.get_overdue_loans)
+
+
+async def get_loans_due_soon(db: AsyncSession, days_ahead: int = 3):
+    await _load_due_index()
+    return await _run(db, crud.get_loans_due_soon, days_ahead)
+
+
+async def get_loan_history(db: AsyncSession, limit: Optional[int] = None, **filters):
+    return await _run(db, crud.get_loan_history, limit, **filters)
+
+
+async def estimate_loan_history_count(db: AsyncSession, **filters):
+    return await _run(db, crud.estimate_loan_history_count, **filters)
+
+
+async def get_admin_dashboard_stats(db: AsyncSession):
+    return await _run(db, crud.get_admin_dashboard_stats)
@@ -0,0 +1,289 @@
+"""Async handlers for the high-traffic routes, served when DB_ASYNC is enabled.
+
+They mirror app/routes.py one for one. Routes that are not defined here
+(exports, PDF jobs, admin metrics) keep being served by the sync router.
+"""
+from datetime import timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import async_crud, crud, schemas, security
+from app.auth import create_access_token
+from app.database import get_async_db
+from app.dependencies import check_catalog_etag, get_current_user_async, pin_reads_to_primary
+from app.models import User
+from app.routes import (
+    BOOK_PAGE_SIZE,
+    LOAN_HISTORY_MAX_PAGE_SIZE,
+    LOAN_HISTORY_PAGE_SIZE,
+    book_page,
+    loan_history_filters,
+    loan_page,
+    parse_book_cursor,
+    parse_book_fields,
+    parse_loan_cursor,
+    stream_ndjson,
+)
+from app.serialization import wants_ndjson
+from app.schemas import LoanWithBookUser
+
+
+router = APIRouter()
+
+
+@router.post("/books/", response_model=schemas.BookConfig)
+async def created_book(book: schemas.BookCreate,
+                       db: AsyncSession = Depends(get_async_db),
+                       current_user: User = Depends(get_current_user_async)
+                       ):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only Administrator users can create books.")
+    return await async_crud.create_book(db, book)
+
+
+@router.patch("/books/{book_id}", response_model=schemas.BookConfig)
+async def update_book(
+        book_id: int,
+        book_data: schemas.BookUpdate,
+        db: AsyncSession = Depends(get_async_db),
+        current_user: User = Depends(get_current_user_async)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only Administrator users can alter books.")
+
+    return await async_crud.partial_update_book(db, book_id, book_data)
+
+
+@router.get("/books/", response_model=List[schemas.BookConfig], dependencies=[Depends(check_catalog_etag)])
+async def read_all_books(
+        request: Request,
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_db)
+):
+    columns = parse_book_fields(fields)
+    after_id = parse_book_cursor(cursor)
+    if wants_ndjson(request):
+        return stream_ndjson(request, response, crud.iter_books, after_id, columns, limit, catalog_read=True)
+
+    limit = limit or BOOK_PAGE_SIZE
+    books = await async_crud.get_books(db, limit + 1, after_id, columns)
+    return book_page(books, limit, response)
+
+
+@router.get("/books/{name}", response_model=List[schemas.BookConfig], dependencies=[Depends(check_catalog_etag)])
+async def read_book_by_name(
+        name: str,
+        limit: int = Query(20, ge=1, le=100),
+        db: AsyncSession = Depends(get_async_db)
+):
+    books = await async_crud.get_book_by_name(db, name, limit)
+    if not books:
+        raise HTTPException(status_code=404, detail="No books found")
+    return books
+
+
+@router.get("/users/{name}", response_model=schemas.UserConfig)
+async def get_user(name: str, db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_user_by_username(db, name)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return user
+
+
+@router.post("/register", response_model=schemas.UserConfig)
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing_user = await async_crud.get_user_by_username(db, user.username)
+    if existing_user:
+        raise HTTPException(
+            status_code=400,
+            detail="Username already taken."
+        )
+    hashed_pw = await security.hash_password_async(user.password)
+    return await async_crud.create_user(db, user, hashed_pw)
+
+
+@router.post("/token")
+async def login_for_access_token(
+        form_data: OAuth2PasswordRequestForm = Depends(),
+        db: AsyncSession = Depends(get_async_db)
+):
+    user = await async_crud.get_user_by_username(db, form_data.username)
+
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await security.verify_and_update_password(form_data.password, user.hashed_password)
+
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrent username or password",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    if new_hash:
+        await async_crud.update_password_hash(db, user, new_hash)
+
+    access_token = create_access_token(
+        data={"sub": user.username},
+        expires_delta=timedelta(minutes=30)
+    )
+
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.delete("/books/{book_id}")
+async def delete_book(
+        book_id: int,
+        db: AsyncSession = Depends(get_async_db),
+        current_user: User = Depends(get_current_user_async)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only Administrator users can delete books.")
+    return await async_crud.delete_book(db, book_id)
+
+
+@router.post("/loans/", response_model=schemas.LoanConfig)
+async def borrow_book(
+    loan: schemas.LoanCreate,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    if current_user.user_id != loan.user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="You can't borrow a book for another user.")
+    result = await async_crud.create_loan(db, loan)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+# Registered before /loans/{loan_id}/return so "batch" is never parsed as a loan id.
+@router.post("/loans/batch", response_model=List[schemas.LoanBatchItem])
+async def borrow_books_batch(
+    batch: schemas.LoanBatchCreate,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    if current_user.user_id != batch.user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="You can't borrow a book for another user.")
+    result = await async_crud.create_loans_batch(db, batch)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+@router.post("/loans/batch/return", response_model=List[schemas.LoanBatchItem])
+async def return_books_batch(
+    batch: schemas.LoanBatchReturn,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    owner_id = None if current_user.is_admin else current_user.user_id
+    result = await async_crud.return_loans_batch(db, batch, owner_id)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+@router.post("/loans/{loan_id}/return", response_model=schemas.LoanConfig)
+async def return_book(
+    loan_id: int,
+    return_data: schemas.LoanReturn,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    loan = await async_crud.get_loan(db, loan_id)
+
+    if not loan:
+        raise HTTPException(status_code=404, detail="Loan not found.")
+
+    if loan.user_id != current_user.user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="You can't return another user's loan.")
+
+    result = await async_crud.return_loan(db, loan_id, return_data)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+@router.get("/loans/me", response_model=List[LoanWithBookUser])
+async def get_my_loans(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    return await async_crud.get_loans_by_user(db, current_user.user_id)
+
+
+@router.get("/loans/overdue", response_model=List[LoanWithBookUser])
+async def get_overdue_loans(
+        db: AsyncSession = Depends(get_async_db),
+        current_user: User = Depends(get_current_user_async)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrator users only.")
+
+    return await async_crud.get_overdue_loans(db)
+
+
+@router.get("/notifications/due-soon", response_model=List[LoanWithBookUser])
+async def get_due_soon_loans(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrator users only.")
+
+    return await async_crud.get_loans_due_soon(db)
+
+
+@router.get("/loans/history", response_model=List[LoanWithBookUser])
+async def get_loan_history(
+    request: Request,
+    response: Response,
+    filters: dict = Depends(loan_history_filters),
+    limit: Optional[int] = Query(None, ge=1, le=LOAN_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    estimate_count: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admins only.")
+
+    after = parse_loan_cursor(cursor)
+    if wants_ndjson(request):
+        return stream_ndjson(request, response, crud.iter_loan_history, limit=limit, after=after, **filters)
+
+    limit = limit or LOAN_HISTORY_PAGE_SIZE
+    if estimate_count:
+        response.headers["X-Total-Count-Estimate"] = str(await async_crud.estimate_loan_history_count(db, **filters))
+    loans = await async_crud.get_loan_history(db, limit + 1, after=after, **filters)
+    return loan_page(loans, limit, response)
+
+
+@router.get("/admin/stats")
+async def get_dashboard_stats(
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only administrators can view dashboard stats.")
+
+    return await async_crud.get_admin_dashboard_stats(db)
+
+
+def include_routers(app, sync_router):
+    """Mount the async routes, plus every sync route they don't replace."""
+    app.include_router(router)
+    replaced = {(route.path, method) for route in router.routes for method in route.methods}
+    remaining = APIRouter()
+    remaining.routes = [
+        route for route in sync_router.routes
+        if not any((route.path, method) in replaced for method in route.methods)
+    ]
+    app.include_router(remaining)
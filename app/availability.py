@@ -0,0 +1,202 @@
+"""Book availability push behind /books/availability/poll and /books/availability/stream.
+
+Loan and book writes call notify_changed() (or publish()) after their
+commit. That is free unless some client of this worker watches one of the
+books; only then are the new counts read and the book's subscribers woken.
+Everyone waiting on a book shares one future, so a change costs the same
+for ten idle subscribers as for ten thousand. Waiting subscribers hold no
+thread and no database connection.
+
+Writes served by other worker processes are not published here. The
+watched books are therefore re-read in one query, at most every
+AVAILABILITY_REFRESH_SECONDS per worker, by whichever waiter wakes first.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from typing import AsyncIterator, Dict, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import models
+from app.metrics import Gauge
+from app.serialization import dumps
+
+AVAILABILITY_REFRESH_SECONDS = float(os.getenv("AVAILABILITY_REFRESH_SECONDS", "5"))
+AVAILABILITY_KEEPALIVE_SECONDS = float(os.getenv("AVAILABILITY_KEEPALIVE_SECONDS", "15"))
+AVAILABILITY_MAX_BOOKS = int(os.getenv("AVAILABILITY_MAX_BOOKS", "50"))
+# Book ids per refresh query.
+REFRESH_CHUNK_SIZE = 500
+
+subscriptions = Gauge("availability_subscriptions", "Open availability long-polls and event streams")
+
+_lock = threading.Lock()
+_watchers = Counter()  # book_id -> open subscriptions in this worker
+_available = {}        # book_id -> last known number_available_volumes, watched books only
+_futures = {}          # book_id -> future shared by everyone waiting on that book
+_refreshed_at = 0.0
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def publish(counts: Dict[int, int]):
+    """Record availability counts and wake the subscribers of every watched book that changed."""
+    woken = []
+    with _lock:
+        for book_id, available in counts.items():
+            if book_id not in _watchers or _available.get(book_id) == available:
+                continue
+            _available[book_id] = available
+            future = _futures.pop(book_id, None)
+            if future is not None:
+                woken.append(future)
+    # Writers run in threadpool threads; futures belong to the event loop.
+    for future in woken:
+        loop = future.get_loop()
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(_wake, future)
+
+
+def read_counts(db: Session, book_ids: Iterable[int]) -> Dict[int, int]:
+    """number_available_volumes of the given books that exist."""
+    book_ids = list(book_ids)
+    counts = {}
+    for start in range(0, len(book_ids), REFRESH_CHUNK_SIZE):
+        counts.update(db.execute(
+            select(models.Book.book_id, models.Book.number_available_volumes)
+            .where(models.Book.book_id.in_(book_ids[start:start + REFRESH_CHUNK_SIZE]))
+        ).all())
+    return counts
+
+
+def notify_changed(db: Session, book_ids: Iterable[int]):
+    """Publish the current counts of book_ids if this worker has subscribers for any; call after commit."""
+    if not _watchers:
+        return
+    with _lock:
+        watched = [book_id for book_id in set(book_ids) if book_id in _watchers]
+    if watched:
+        publish(read_counts(db, watched))
+
+
+def current_counts(book_ids: Iterable[int]) -> Dict[int, int]:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return read_counts(db, book_ids)
+    finally:
+        db.close()
+
+
+async def _maybe_refresh():
+    global _refreshed_at
+    with _lock:
+        if not _watchers or time.monotonic() - _refreshed_at < AVAILABILITY_REFRESH_SECONDS:
+            return
+        _refreshed_at = time.monotonic()
+        watched = list(_watchers)
+    counts = await run_in_threadpool(current_counts, watched)
+    # A deleted book has nothing left to borrow.
+    publish({book_id: counts.get(book_id, 0) for book_id in watched})
+
+
+class Subscription:
+    """Interest in a set of books; open it before reading their counts so no change is missed."""
+
+    def __init__(self, book_ids: Iterable[int]):
+        self.book_ids = tuple(dict.fromkeys(book_ids))
+
+    def open(self) -> "Subscription":
+        with _lock:
+            _watchers.update(self.book_ids)
+        subscriptions.inc()
+        return self
+
+    def close(self):
+        with _lock:
+            for book_id in self.book_ids:
+                _watchers[book_id] -= 1
+                if _watchers[book_id] <= 0:
+                    del _watchers[book_id]
+                    _available.pop(book_id, None)
+                    _futures.pop(book_id, None)
+        subscriptions.dec()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seed(self, counts: Dict[int, int]):
+        # Counts published since open() are newer than this read; keep them.
+        with _lock:
+            for book_id, available in counts.items():
+                _available.setdefault(book_id, available)
+
+    def snapshot(self) -> Dict[int, int]:
+        with _lock:
+            return {book_id: _available.get(book_id, 0) for book_id in self.book_ids}
+
+    async def changes(self, known: Dict[int, int], timeout: float) -> Dict[int, int]:
+        """Wait until a count differs from `known`; returns the differing counts, or {} after timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with _lock:
+                changed = {
+                    book_id: _available[book_id] for book_id in self.book_ids
+                    if book_id in _available and _available[book_id] != known.get(book_id)
+                }
+                if changed:
+                    return changed
+                futures = []
+                for book_id in self.book_ids:
+                    future = _futures.get(book_id)
+                    if future is None or future.done() or future.get_loop() is not loop:
+                        future = _futures[book_id] = loop.create_future()
+                    futures.append(future)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return {}
+            # asyncio.wait never cancels the shared futures on timeout.
+            done, _ = await asyncio.wait(futures, timeout=min(remaining, AVAILABILITY_REFRESH_SECONDS))
+            if not done:
+                await _maybe_refresh()
+
+
+def _event(book_id: int, available: int) -> str:
+    data = dumps({"book_id": book_id, "number_available_volumes": available}).decode()
+    return f"event: availability\ndata: {data}\n\n"
+
+
+async def sse_events(subscription: Subscription, lifetime: float) -> AsyncIterator[str]:
+    """Server-sent events for an opened and seeded subscription: the current counts, then every change.
+
+    Closes the subscription when the stream ends, after `lifetime` seconds or on disconnect.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + lifetime
+        known = {}
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            changed = await subscription.changes(known, min(remaining, AVAILABILITY_KEEPALIVE_SECONDS))
+            if changed:
+                known.update(changed)
+                yield "".join(_event(book_id, available) for book_id, available in changed.items())
+            else:
+                yield ": keepalive\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,122 @@
+"""Catalog version counter behind the ETags on GET /books/ and /books/{name}.
+
+Every write that changes what the catalog endpoints return (book create,
+update, delete and import, and the inventory changes made by borrowing and
+returning) bumps the version after its commit. The version lives in a small
+file, CATALOG_VERSION_FILE, so all worker processes on a host agree on it
+and a conditional GET can be answered from the file alone.
+
+The file holds "<epoch>:<counter>". The epoch is random and is chosen when
+the file is created, so ETags issued before the file was lost can never
+match again.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process.
+    fcntl = None
+
+from app.database import DATABASE_URL
+
+_default_file = os.path.join(
+    tempfile.gettempdir(),
+    f"catalog-{hashlib.sha1(DATABASE_URL.encode()).hexdigest()[:12]}.version"
+)
+CATALOG_VERSION_FILE = os.getenv("CATALOG_VERSION_FILE", _default_file)
+# Clients may store catalog pages but must revalidate them on every use.
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, no-cache")
+
+_lock = threading.Lock()
+# Session.info key set by app.async_crud; see mark_changed().
+DEFER_BUMP = "defer_catalog_bump"
+
+
+def _read() -> str:
+    try:
+        with open(CATALOG_VERSION_FILE) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def _write(version: str):
+    # Readers never see a partial write: the new file is renamed over the old one.
+    directory = os.path.dirname(os.path.abspath(CATALOG_VERSION_FILE))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".catalog-version-")
+    with os.fdopen(fd, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, CATALOG_VERSION_FILE)
+
+
+def _update(next_version):
+    with _lock, open(f"{CATALOG_VERSION_FILE}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        version = next_version(_read())
+        _write(version)
+        return version
+
+
+def _new_epoch(current: str) -> str:
+    return current or f"{uuid.uuid4().hex[:12]}:0"
+
+
+def _increment(current: str) -> str:
+    if not current:
+        return _new_epoch(current)
+    epoch, _, counter = current.partition(":")
+    return f"{epoch}:{int(counter or 0) + 1}"
+
+
+def current_version() -> str:
+    return _read() or _update(_new_epoch)
+
+
+def bump_version() -> str:
+    """Mark the catalog as changed; call after the write has committed."""
+    return _update(_increment)
+
+
+def mark_changed(db):
+    """Bump the version after a committed catalog write made through db.
+
+    Sessions driven by an AsyncSession (see app.async_crud) only record the
+    change; the caller bumps the version off the event loop once run_sync
+    returns, since the bump takes a file lock and writes a file.
+    """
+    if DEFER_BUMP in db.info:
+        db.info[DEFER_BUMP] = True
+    else:
+        bump_version()
+
+
+def changed_within(seconds: float) -> bool:
+    """Whether the catalog version was bumped in the last `seconds` seconds."""
+    try:
+        return time.time() - os.stat(CATALOG_VERSION_FILE).st_mtime < seconds
+    except FileNotFoundError:
+        return False
+
+
+def etag_for(path: str, query: str, variant: str = "") -> str:
+    """Strong ETag for one catalog URL and representation at the current catalog version."""
+    digest = hashlib.sha1(f"{current_version()}|{path}?{query}|{variant}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"}
@@ -1,32 +1,129 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app import models, schemas
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import bindparam, case, func, insert, literal_column, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from pydantic import ValidationError
+from app import availability, catalog, fines as fine_ledger, models, notifications, schemas, search
+from app.cache import LRUCache
+from app.metrics import cache_collector
 from app.models import User
-from app.security import hash_password, verify_password
+from app.security import hash_password
 from datetime import datetime, timedelta, date
 from fastapi import HTTPException
-from decimal import Decimal
-from typing import Optional
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from collections import Counter
+from typing import List, Optional
 import csv
 import io
+import json
+import os
+import time
+
+# "query" computes dashboard stats with one aggregate query; "counters" reads
+# counters maintained on every write and reconciled periodically.
+STATS_MODE = os.getenv("STATS_MODE", "query")
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", "3600"))
+STAT_NAMES = ("total_users", "total_books", "active_loans", "overdue_loans")
+
+stats_cache = LRUCache(maxsize=1, ttl=STATS_CACHE_TTL)
+cache_collector("stats_cache", stats_cache)
+
+
+def bump_stat_counters(db: Session, **deltas):
+    """Adjust maintained counters inside the caller's transaction."""
+    if STATS_MODE != "counters":
+        return
+    for name, delta in deltas.items():
+        if delta:
+            db.execute(
+                update(models.StatCounter)
+                .where(models.StatCounter.name == name)
+                .values(value=models.StatCounter.value + delta)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def _upsert(db: Session):
+    # INSERT ... ON CONFLICT needs the dialect's own insert construct.
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(models.Book)
+    return sqlite_insert(models.Book)
+
+
+def _existing_book_ids(db: Session, keys) -> dict:
+    """natural key -> book_id for the keys already in the catalog."""
+    key_columns = [getattr(models.Book, column) for column in BOOK_NATURAL_KEY]
+    return {
+        tuple(row[1:]): row[0]
+        for row in db.query(models.Book.book_id, *key_columns).filter(tuple_(*key_columns).in_(list(keys)))
+    }
 
 
 def create_book(db: Session, book_data: schemas.BookCreate):
     new_book = models.Book(**book_data.dict())
     db.add(new_book)
-    db.commit()
+    bump_stat_counters(db, total_books=1)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="This edition is already in the catalog.")
+    catalog.mark_changed(db)
     db.refresh(new_book)
+    search.index_book(db, new_book)
     return new_book
 
 
-def get_books(db: Session):
-    return db.query(models.Book).all()
+BOOK_FIELDS = tuple(schemas.BookConfig.model_fields)
+# Catalog rows are unique on this natural key (uq_books_natural_key); a
+# re-imported edition updates in place.
+BOOK_NATURAL_KEY = ("book_name", "book_author", "book_year", "book_language")
+
+
+# Rows streamed per fetch by the NDJSON list endpoints.
+STREAM_CHUNK_SIZE = 1000
+
+
+def _books_query(db: Session, after_id: Optional[int], fields: Optional[List[str]]):
+    # Column tuples rather than ORM objects: the list endpoints encode the
+    # rows directly, in BookConfig field order unless a projection is asked for.
+    keys = ["book_id"] + [f for f in fields if f != "book_id"] if fields else list(BOOK_FIELDS)
+    query = db.query(*(getattr(models.Book, key) for key in keys))
 
+    # Keyset pagination on the primary key: every page is an index range scan
+    # no matter how deep into the catalog the client is.
+    if after_id is not None:
+        query = query.filter(models.Book.book_id > after_id)
 
-def get_book_by_name(db: Session, book_name: str):
-    return db.query(models.Book).filter(models.Book.book_name.ilike(f"%{book_name}%")).all()
+    return keys, query.order_by(models.Book.book_id.asc())
+
+
+def get_books(
+        db: Session,
+        limit: int,
+        after_id: Optional[int] = None,
+        fields: Optional[List[str]] = None
+):
+    keys, query = _books_query(db, after_id, fields)
+    return [dict(zip(keys, row)) for row in query.limit(limit)]
+
+
+def iter_books(
+        db: Session,
+        after_id: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+        limit: Optional[int] = None
+):
+    keys, query = _books_query(db, after_id, fields)
+    if limit is not None:
+        query = query.limit(limit)
+    for row in query.yield_per(STREAM_CHUNK_SIZE):
+        yield dict(zip(keys, row))
+
+
+def get_book_by_name(db: Session, book_name: str, limit: int = 20):
+    return search.search_books(db, book_name, limit)
 
 
 def partial_update_book(
@@ -41,35 +138,168 @@ def partial_update_book(
     for key, value in book_data.dict(exclude_unset=True).items():
         setattr(book, key, value)
 
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="This edition is already in the catalog.")
+    catalog.mark_changed(db)
     db.refresh(book)
+    search.index_book(db, book)
+    availability.publish({book.book_id: book.number_available_volumes})
 
     return book
 
 
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+
+def parse_book_import(stream, fmt: str):
+    """Yield (row_number, record) pairs; record is a dict, or an error message."""
+    # Decoded line by line, so a bad byte is blamed on the row it is in and the
+    # rest of the file still imports. utf-8-sig drops a leading byte order mark.
+    bad_lines = set()
+
+    def decoded_lines():
+        for line_number, line in enumerate(stream, start=1):
+            try:
+                yield line.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                bad_lines.add(line_number)
+                yield line.decode("utf-8-sig", errors="replace")
+
+    lines = decoded_lines()
+    not_utf8 = "Row is not valid UTF-8"
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        reader.fieldnames  # reads the header
+        last_line = reader.line_num
+        for row_number, row in enumerate(reader, start=1):
+            # A quoted value may span several physical lines.
+            if bad_lines.intersection(range(last_line + 1, reader.line_num + 1)):
+                yield row_number, not_utf8
+            else:
+                yield row_number, {key: (value if value != "" else None) for key, value in row.items()}
+            last_line = reader.line_num
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        if row_number in bad_lines:
+            yield row_number, not_utf8
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield row_number, f"Invalid JSON: {exc}"
+            continue
+        yield row_number, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def _upsert_book_chunk(db: Session, chunk: dict) -> tuple:
+    # Only used to tell inserts from updates in the summary; the upsert
+    # itself is safe against concurrent or retried imports of the same rows.
+    existing = _existing_book_ids(db, chunk)
+
+    statement = _upsert(db)
+    set_ = {
+        column: statement.excluded[column]
+        for column in schemas.BookCreate.model_fields if column not in BOOK_NATURAL_KEY
+    }
+    # The feed counts the copies held; those out on loan stay unavailable.
+    # SQLAlchemy does not correlate subqueries with an INSERT's target table,
+    # so the conflicting row is named the way ON CONFLICT DO UPDATE sees it.
+    on_loan = (
+        select(func.count())
+        .select_from(models.Loan)
+        .where(models.Loan.book_id == literal_column("books.book_id"), models.Loan.return_date.is_(None))
+        .scalar_subquery()
+    )
+    available = statement.excluded.number_available_volumes - on_loan
+    set_["number_available_volumes"] = case((available < 0, 0), else_=available)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(BOOK_NATURAL_KEY), set_=set_
+    ).returning(models.Book.book_id, models.Book.book_name, models.Book.book_author)
+    # One executemany (batched multi-row VALUES) for the whole chunk.
+    rows = db.execute(statement, list(chunk.values())).all()
+
+    inserted = len(chunk) - sum(1 for key in chunk if key in existing)
+    bump_stat_counters(db, total_books=inserted)
+    db.commit()
+    catalog.mark_changed(db)
+
+    for row in rows:
+        search.index_book(db, row)
+    return inserted, len(chunk) - inserted
+
+
+def import_books(db: Session, records, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    summary = {"processed": 0, "inserted": 0, "updated": 0, "error_count": 0, "errors": []}
+
+    def record_error(row_number, messages):
+        summary["error_count"] += 1
+        if len(summary["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            summary["errors"].append({"row": row_number, "errors": messages})
+
+    def flush(chunk):
+        try:
+            inserted, updated = _upsert_book_chunk(db, {key: record for key, (_, record) in chunk.items()})
+        except SQLAlchemyError as exc:
+            db.rollback()
+            for row_number, _ in chunk.values():
+                record_error(row_number, [f"Database error: {exc.__class__.__name__}"])
+            return
+        summary["inserted"] += inserted
+        summary["updated"] += updated
+
+    chunk = {}
+    for row_number, raw in records:
+        summary["processed"] += 1
+        if isinstance(raw, str):
+            record_error(row_number, [raw])
+            continue
+        try:
+            record = schemas.BookCreate.model_validate(raw).model_dump()
+        except ValidationError as exc:
+            record_error(row_number, [f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()])
+            continue
+
+        # Later rows with the same natural key win within a chunk.
+        chunk[tuple(record[column] for column in BOOK_NATURAL_KEY)] = (row_number, record)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = {}
+
+    if chunk:
+        flush(chunk)
+    return summary
+
+
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def create_user(db: Session, user_data: schemas.UserCreate):
-    hashed_pw = hash_password(user_data.password)
+def create_user(db: Session, user_data: schemas.UserCreate, hashed_pw: Optional[str] = None):
+    if hashed_pw is None:
+        hashed_pw = hash_password(user_data.password)
     new_user = models.User(
         username=user_data.username,
         user_email=user_data.user_email,
         hashed_password=hashed_pw
     )
     db.add(new_user)
+    bump_stat_counters(db, total_users=1)
     db.commit()
     db.refresh(new_user)
     return new_user
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
-        return None
+def update_password_hash(db: Session, user: models.User, hashed_pw: str):
+    user.hashed_password = hashed_pw
+    db.commit()
+    db.refresh(user)
     return user
 
 
@@ -78,18 +308,31 @@ def delete_book(db: Session, book_id: int):
     if not book:
         raise HTTPException(status_code=404, detail="Book not found.")
     db.delete(book)
+    bump_stat_counters(db, total_books=-1)
     db.commit()
+    catalog.mark_changed(db)
+    search.remove_book(db, book_id)
     return {"message": "Book deleted successfully"}
 
 
 def create_loan(db: Session, loan_data: schemas.LoanCreate):
-    # Get the book
-    book = db.query(models.Book).filter(models.Book.book_id == loan_data.book_id).first()
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
+    # Check availability and take a copy in one conditional UPDATE, so
+    # concurrent borrowers can never oversell and nobody holds a lock
+    # across a read-modify-write round trip.
+    result = db.execute(
+        update(models.Book)
+        .where(
+            models.Book.book_id == loan_data.book_id,
+            models.Book.number_available_volumes > 0
+        )
+        .values(number_available_volumes=models.Book.number_available_volumes - 1)
+        .execution_options(synchronize_session=False)
+    )
 
-    # Check availability
-    if book.number_available_volumes <= 0:
+    if result.rowcount == 0:
+        db.rollback()
+        if not db.query(models.Book.book_id).filter(models.Book.book_id == loan_data.book_id).first():
+            raise HTTPException(status_code=404, detail="Book not found")
         raise HTTPException(status_code=400, detail="No available copies to borrow")
 
     # Set default due date if not provided
@@ -102,18 +345,24 @@ def create_loan(db: Session, loan_data: schemas.LoanCreate):
         loan_due_date=due_date
     )
 
-    # Update inventory
-    book.number_available_volumes -= 1
-
     db.add(loan)
+    bump_stat_counters(db, active_loans=1, overdue_loans=int(due_date < date.today()))
     db.commit()
+    catalog.mark_changed(db)
     db.refresh(loan)
+    notifications.track_loan(loan.loan_id, loan.user_id, loan.loan_due_date)
+    availability.notify_changed(db, [loan.book_id])
 
     return loan
 
 
+def get_loan(db: Session, loan_id: int):
+    return db.get(models.Loan, loan_id)
+
+
 def return_loan(db: Session, loan_id: int, return_data: schemas.LoanReturn):
-    loan = db.query(models.Loan).filter(models.Loan.loan_id == loan_id).first()
+    # Session.get reuses the loan when the route already loaded it for its permission check.
+    loan = db.get(models.Loan, loan_id)
     if not loan:
         raise HTTPException(status_code=404, detail="Loan not found")
 
@@ -121,156 +370,482 @@ def return_loan(db: Session, loan_id: int, return_data: schemas.LoanReturn):
         raise HTTPException(status_code=400, detail="Book already returned")
 
     return_date = return_data.return_date or date.today()
-    loan.return_date = return_date
+    values = {"return_date": return_date}
 
     # Late return?
     if return_date > loan.loan_due_date:
-        days_late = (return_date - loan.loan_due_date).days
-        loan.loan_fine = Decimal(days_late) * Decimal("1.50")
+        values["loan_fine"] = fine_ledger.fine_for(loan.loan_due_date, return_date)
+
+    # Only the request that flips return_date from NULL gets to restock the book.
+    result = db.execute(
+        update(models.Loan)
+        .where(models.Loan.loan_id == loan_id, models.Loan.return_date.is_(None))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Book already returned")
 
     # Update book inventory
-    book = db.query(models.Book).filter(models.Book.book_id == loan.book_id).first()
-    if book:
-        book.number_available_volumes += 1
+    db.execute(
+        update(models.Book)
+        .where(models.Book.book_id == loan.book_id)
+        .values(number_available_volumes=models.Book.number_available_volumes + 1)
+        .execution_options(synchronize_session=False)
+    )
+    # Only loans that were overdue at some point can have accrued fines to true up.
+    if loan.loan_due_date < date.today() or "loan_fine" in values:
+        fine_ledger.settle_returned_loans(
+            db, {loan_id: (loan.user_id, values.get("loan_fine"))}, return_date
+        )
+    bump_stat_counters(db, active_loans=-1, overdue_loans=-int(loan.loan_due_date < date.today()))
 
     db.commit()
+    catalog.mark_changed(db)
+    notifications.untrack_loan(loan_id)
     db.refresh(loan)
+    availability.notify_changed(db, [loan.book_id])
     return loan
 
 
-def get_loans_by_user(db: Session, user_id: int):
-    return (
-        db.query(models.Loan)
-        .filter(models.Loan.user_id == user_id)
-        .order_by(models.Loan.loan_due_date.desc())
-        .all()
+def create_loans_batch(db: Session, batch: schemas.LoanBatchCreate):
+    due_date = batch.loan_due_date or (datetime.utcnow().date() + timedelta(days=14))
+    unique_ids = list(dict.fromkeys(batch.book_ids))
+
+    # One conditional UPDATE takes a copy of every requested title that still has one.
+    taken = set(
+        db.execute(
+            update(models.Book)
+            .where(
+                models.Book.book_id.in_(unique_ids),
+                models.Book.number_available_volumes > 0
+            )
+            .values(number_available_volumes=models.Book.number_available_volumes - 1)
+            .returning(models.Book.book_id)
+            .execution_options(synchronize_session=False)
+        ).scalars()
     )
 
+    loans = {}
+    if taken:
+        created = db.execute(
+            insert(models.Loan).returning(models.Loan),
+            [
+                {"user_id": batch.user_id, "book_id": book_id, "loan_due_date": due_date}
+                for book_id in unique_ids if book_id in taken
+            ]
+        ).scalars()
+        loans = {loan.book_id: schemas.LoanConfig.model_validate(loan) for loan in created}
+
+    untaken = [book_id for book_id in unique_ids if book_id not in taken]
+    existing = set()
+    if untaken:
+        existing = set(db.execute(select(models.Book.book_id).where(models.Book.book_id.in_(untaken))).scalars())
+
+    bump_stat_counters(db, active_loans=len(loans), overdue_loans=len(loans) * int(due_date < date.today()))
+    db.commit()
+    if loans:
+        catalog.mark_changed(db)
+    for loan in loans.values():
+        notifications.track_loan(loan.loan_id, loan.user_id, loan.loan_due_date)
+    availability.notify_changed(db, taken)
+
+    results, seen = [], set()
+    for book_id in batch.book_ids:
+        if book_id in seen:
+            results.append({"book_id": book_id, "status": "error", "detail": "Duplicate book in batch"})
+        elif book_id in loans:
+            results.append({"book_id": book_id, "status": "ok", "loan": loans[book_id]})
+        elif book_id in existing:
+            results.append({"book_id": book_id, "status": "error", "detail": "No available copies to borrow"})
+        else:
+            results.append({"book_id": book_id, "status": "error", "detail": "Book not found"})
+        seen.add(book_id)
+    return results
+
+
+def return_loans_batch(db: Session, batch: schemas.LoanBatchReturn, owner_id: Optional[int] = None):
+    """Return a cart of loans in one transaction; owner_id limits it to that user's loans."""
+    return_date = batch.return_date or date.today()
+    unique_ids = list(dict.fromkeys(batch.loan_ids))
+    loans = {
+        row.loan_id: row
+        for row in db.execute(
+            select(
+                models.Loan.loan_id,
+                models.Loan.user_id,
+                models.Loan.book_id,
+                models.Loan.loan_due_date,
+                models.Loan.return_date
+            ).where(models.Loan.loan_id.in_(unique_ids))
+        )
+    }
+
+    errors = {}
+    for loan_id in unique_ids:
+        loan = loans.get(loan_id)
+        if loan is None:
+            errors[loan_id] = "Loan not found"
+        elif owner_id is not None and loan.user_id != owner_id:
+            errors[loan_id] = "You can't return another user's loan."
+        elif loan.return_date:
+            errors[loan_id] = "Book already returned"
+
+    eligible = [loan_id for loan_id in unique_ids if loan_id not in errors]
+    returned = set()
+    if eligible:
+        # The return_date IS NULL guard makes concurrent returns of the same loan count once.
+        returned = set(
+            db.execute(
+                update(models.Loan)
+                .where(models.Loan.loan_id.in_(eligible), models.Loan.return_date.is_(None))
+                .values(return_date=return_date)
+                .returning(models.Loan.loan_id)
+                .execution_options(synchronize_session=False)
+            ).scalars()
+        )
+    for loan_id in eligible:
+        if loan_id not in returned:
+            errors[loan_id] = "Book already returned"
 
-def get_overdue_loans(db: Session):
-    return (
-        db.query(models.Loan)
-        .filter(
-            models.Loan.return_date.is_(None),  # not returned
-            models.Loan.loan_due_date < date.today()  # past due
+    fines = {
+        loan_id: fine_ledger.fine_for(loans[loan_id].loan_due_date, return_date)
+        for loan_id in returned if return_date > loans[loan_id].loan_due_date
+    }
+    if fines:
+        db.execute(update(models.Loan), [{"loan_id": loan_id, "loan_fine": fine} for loan_id, fine in fines.items()])
+    fine_ledger.settle_returned_loans(db, {
+        loan_id: (loans[loan_id].user_id, fines.get(loan_id))
+        for loan_id in returned if loans[loan_id].loan_due_date < date.today() or loan_id in fines
+    }, return_date)
+
+    restock = Counter(loans[loan_id].book_id for loan_id in returned)
+    if restock:
+        books = models.Book.__table__
+        db.execute(
+            update(books)
+            .where(books.c.book_id == bindparam("restock_book_id"))
+            .values(number_available_volumes=books.c.number_available_volumes + bindparam("restock_count")),
+            [{"restock_book_id": book_id, "restock_count": count} for book_id, count in restock.items()]
         )
-        .order_by(models.Loan.loan_due_date.asc())
-        .all()
+
+    overdue = sum(1 for loan_id in returned if loans[loan_id].loan_due_date < date.today())
+    bump_stat_counters(db, active_loans=-len(returned), overdue_loans=-overdue)
+    db.commit()
+    if returned:
+        catalog.mark_changed(db)
+    for loan_id in returned:
+        notifications.untrack_loan(loan_id)
+    availability.notify_changed(db, restock)
+
+    results = []
+    for loan_id in batch.loan_ids:
+        if loan_id in returned:
+            loan = loans[loan_id]
+            results.append({"loan_id": loan_id, "status": "ok", "loan": {
+                "loan_id": loan_id,
+                "user_id": loan.user_id,
+                "book_id": loan.book_id,
+                "loan_due_date": loan.loan_due_date,
+                "return_date": return_date,
+                "loan_fine": fines.get(loan_id),
+            }})
+            returned.discard(loan_id)
+        else:
+            results.append({"loan_id": loan_id, "status": "error",
+                            "detail": errors.get(loan_id, "Duplicate loan in batch")})
+    return results
+
+
+def _query_loans_with_book_user(db: Session):
+    # LoanWithBookUser serializes both relationships; load them in the same
+    # SELECT instead of one lazy load per row.
+    return db.query(models.Loan).options(
+        joinedload(models.Loan.user),
+        joinedload(models.Loan.book)
     )
 
 
-def get_loans_due_soon(db: Session, days_ahead: int = 3):
-    from datetime import date, timedelta
+def get_loans_by_user(db: Session, user_id: int):
+    return get_loan_history(db, user_id=user_id)
 
-    today = date.today()
-    upcoming = today + timedelta(days=days_ahead)
 
-    return (
-        db.query(models.Loan)
+def _loans_in_index_order(db: Session, indexed: list):
+    # The due-date index supplies the ids and order; only those rows are
+    # fetched, by primary key. The return_date check drops loans another
+    # worker returned since this worker's index was last rebuilt.
+    if not indexed:
+        return []
+    loans = (
+        _query_loans_with_book_user(db)
         .filter(
-            models.Loan.return_date.is_(None),
-            models.Loan.loan_due_date <= upcoming,
-            models.Loan.loan_due_date >= today
+            models.Loan.loan_id.in_([loan_id for loan_id, _, _ in indexed]),
+            models.Loan.return_date.is_(None)
         )
-        .order_by(models.Loan.loan_due_date.asc())
         .all()
     )
+    position = {loan_id: i for i, (loan_id, _, _) in enumerate(indexed)}
+    return sorted(loans, key=lambda loan: position[loan.loan_id])
 
 
-def get_loan_history(
-    db: Session,
+def get_overdue_loans(db: Session):
+    return _loans_in_index_order(db, notifications.overdue_loans(db))
+
+
+def get_loans_due_soon(db: Session, days_ahead: int = 3):
+    return _loans_in_index_order(db, notifications.loans_due_soon(db, days_ahead))
+
+
+LOAN_FIELDS = tuple(schemas.LoanConfig.model_fields)
+USER_FIELDS = tuple(schemas.UserConfig.model_fields)
+
+
+LOAN_HISTORY_COUNT_CAP = int(os.getenv("LOAN_HISTORY_COUNT_CAP", "10000"))
+
+
+def _loans_source(
     user_id: Optional[int] = None,
-    returned: Optional[bool] = None
+    returned: Optional[bool] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    book_id: Optional[int] = None,
+    overdue: bool = False,
+    after: Optional[tuple] = None,
+    limit: Optional[int] = None
 ):
-    query = db.query(models.Loan)
+    """Live and archived loans as one subquery with LOAN_FIELDS columns.
+
+    The filters are applied inside each side of the UNION ALL so both tables
+    can use their indexes. Only returned loans are archived, so open-loan
+    reads skip the archive entirely. With a limit, each side is cut to the
+    first `limit` rows in history order (loan_due_date, loan_id descending)
+    after the keyset `after`, so a page never reads more than 2 * limit rows.
+    """
+    def side(table):
+        query = select(*(getattr(table, key) for key in LOAN_FIELDS))
+        if user_id is not None:
+            query = query.where(table.user_id == user_id)
+        if book_id is not None:
+            query = query.where(table.book_id == book_id)
+        if returned is not None:
+            query = query.where(table.return_date.isnot(None) if returned else table.return_date.is_(None))
+        if overdue:
+            query = query.where(table.return_date.is_(None), table.loan_due_date < date.today())
+        if start_date is not None:
+            query = query.where(table.loan_due_date >= start_date)
+        if end_date is not None:
+            query = query.where(table.loan_due_date <= end_date)
+        if after is not None:
+            query = query.where(tuple_(table.loan_due_date, table.loan_id) < tuple_(*after))
+        if limit is not None:
+            # Wrapped so the per-side ORDER BY/LIMIT is valid inside UNION ALL on every dialect.
+            ordered = query.order_by(table.loan_due_date.desc(), table.loan_id.desc()).limit(limit).subquery()
+            query = select(*(ordered.c[key] for key in LOAN_FIELDS))
+        return query
+
+    if returned is False or overdue:
+        return side(models.Loan).subquery("all_loans")
+    return union_all(side(models.Loan), side(models.LoanArchive)).subquery("all_loans")
+
+
+def _loan_history_query(db: Session, limit: Optional[int] = None, **filters):
+    # One flat row per loan with its user and book columns; rows are shaped
+    # like LoanWithBookUser by _loan_with_book_user.
+    loans = _loans_source(**filters, limit=limit)
+    query = (
+        db.query(
+            *(loans.c[key] for key in LOAN_FIELDS),
+            *(getattr(models.User, key) for key in USER_FIELDS),
+            *(getattr(models.Book, key) for key in BOOK_FIELDS)
+        )
+        .select_from(loans)
+        .join(models.User, models.User.user_id == loans.c.user_id)
+        .join(models.Book, models.Book.book_id == loans.c.book_id)
+        .order_by(loans.c.loan_due_date.desc(), loans.c.loan_id.desc())
+    )
+    return query.limit(limit) if limit is not None else query
 
-    if user_id is not None:
-        query = query.filter(models.Loan.user_id == user_id)
 
-    if returned is not None:
-        if returned:
-            query = query.filter(models.Loan.return_date.isnot(None))
-        else:
-            query = query.filter(models.Loan.return_date.is_(None))
+def _loan_with_book_user(row) -> dict:
+    user_start = len(LOAN_FIELDS)
+    book_start = user_start + len(USER_FIELDS)
+    loan = dict(zip(LOAN_FIELDS, row[:user_start]))
+    loan["user"] = dict(zip(USER_FIELDS, row[user_start:book_start]))
+    loan["book"] = dict(zip(BOOK_FIELDS, row[book_start:]))
+    return loan
 
-    return query.order_by(models.Loan.loan_due_date.desc()).all()
 
+def get_loan_history(db: Session, limit: Optional[int] = None, **filters):
+    """Loans newest due first; filters are those of _loans_source, `after` being a (loan_due_date, loan_id) keyset."""
+    return [_loan_with_book_user(row) for row in _loan_history_query(db, limit, **filters)]
+
+
+def iter_loan_history(db: Session, limit: Optional[int] = None, **filters):
+    for row in _loan_history_query(db, limit, **filters).yield_per(STREAM_CHUNK_SIZE):
+        yield _loan_with_book_user(row)
+
+
+def estimate_loan_history_count(db: Session, **filters) -> int:
+    """Approximate number of loans matching the history filters, without a full COUNT(*).
+
+    PostgreSQL answers from the planner's row estimate. Elsewhere the rows
+    are counted exactly up to LOAN_HISTORY_COUNT_CAP and the cap is returned
+    beyond that.
+    """
+    loans = _loans_source(**filters)
+    if db.get_bind().dialect.name == "postgresql":
+        compiled = select(loans.c.loan_id).compile(dialect=db.get_bind().dialect)
+        params = compiled.params
+        if compiled.positional:  # asyncpg takes $1-style positional parameters
+            params = tuple(params[name] for name in compiled.positiontup)
+        plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    capped = select(loans.c.loan_id).limit(LOAN_HISTORY_COUNT_CAP).subquery()
+    return db.execute(select(func.count()).select_from(capped)).scalar()
 
-def generate_user_loans_csv(db: Session, user_id: int) -> str:
-    loans = (
-        db.query(models.Loan)
-        .filter(models.Loan.user_id == user_id)
-        .all()
-    )
 
+CSV_CHUNK_SIZE = 1000
+
+
+def _stream_csv(query, header, chunk_size: int = CSV_CHUNK_SIZE):
+    # Rows are fetched chunk_size at a time (a server-side cursor on
+    # PostgreSQL) and written out as they arrive, so memory stays flat
+    # regardless of how many loans are exported.
     output = io.StringIO()
     writer = csv.writer(output)
+    writer.writerow(header)
 
-    # Header
-    writer.writerow(["Loan ID", "Book Title", "Due Date", "Return Date", "Fine"])
+    for count, row in enumerate(query.yield_per(chunk_size), start=1):
+        *columns, return_date, loan_fine = row
+        writer.writerow([*columns, return_date or "", str(loan_fine or "0.00")])
+        if count % chunk_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
 
-    # Rows
-    for loan in loans:
-        writer.writerow([
-            loan.loan_id,
-            loan.book.book_name,
-            loan.loan_due_date,
-            loan.return_date or "",
-            str(loan.loan_fine or "0.00")
-        ])
+    yield output.getvalue()
 
-    return output.getvalue()
 
+def _user_loan_rows_query(db: Session, user_id: int):
+    loans = _loans_source(user_id=user_id)
+    return (
+        db.query(
+            loans.c.loan_id,
+            models.Book.book_name,
+            loans.c.loan_due_date,
+            loans.c.return_date,
+            loans.c.loan_fine
+        )
+        .join(models.Book, loans.c.book_id == models.Book.book_id)
+        .order_by(loans.c.loan_id)
+    )
 
-def generate_user_loans_pdf(db: Session, user_id: int) -> bytes:
-    loans = (
-        db.query(models.Loan)
-        .filter(models.Loan.user_id == user_id)
-        .all()
+
+def generate_user_loans_csv(db: Session, user_id: int):
+    return _stream_csv(
+        _user_loan_rows_query(db, user_id),
+        ["Loan ID", "Book Title", "Due Date", "Return Date", "Fine"]
+    )
+
+
+def generate_all_loans_csv(
+    db: Session,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+):
+    loans = _loans_source(start_date=start_date, end_date=end_date)
+    query = (
+        db.query(
+            loans.c.loan_id,
+            models.User.user_id,
+            models.User.username,
+            models.Book.book_name,
+            loans.c.loan_due_date,
+            loans.c.return_date,
+            loans.c.loan_fine
+        )
+        .join(models.User, loans.c.user_id == models.User.user_id)
+        .join(models.Book, loans.c.book_id == models.Book.book_id)
+    )
+
+    return _stream_csv(
+        query.order_by(loans.c.loan_id),
+        ["Loan ID", "User ID", "Username", "Book Title", "Due Date", "Return Date", "Fine"]
     )
 
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-    y = height - 40
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.drawString(40, y, "Loan History")
-    y -= 30
-
-    pdf.setFont("Helvetica", 10)
-    for loan in loans:
-        book_name = loan.book.book_name
-        due = str(loan.loan_due_date)
-        returned = str(loan.return_date) if loan.return_date else "-"
-        fine = str(loan.loan_fine or "0.00")
-        line = f"{loan.loan_id}: {book_name} | Due: {due} | Returned: {returned} | Fine: ${fine}"
-        pdf.drawString(40, y, line)
-        y -= 18
-        if y < 50:
-            pdf.showPage()
-            y = height - 40
-            pdf.setFont("Helvetica", 10)
-
-    pdf.save()
-    buffer.seek(0)
-    return buffer.read()
+
+def get_user_loan_rows(db: Session, user_id: int):
+    return _user_loan_rows_query(db, user_id).all()
+
+
+def get_user_loans_version(db: Session, user_id: int) -> tuple:
+    # Changes whenever the user borrows (count, max id) or returns (returned
+    # count); archiving moves rows between the tables without changing it.
+    loans = _loans_source(user_id=user_id)
+    return tuple(
+        db.query(
+            func.count(loans.c.loan_id),
+            func.max(loans.c.loan_id),
+            func.count(loans.c.return_date)
+        )
+        .one()
+    )
+
+
+def compute_dashboard_stats(db: Session) -> dict:
+    # One statement and a single pass over open loans; users and books are
+    # counted by uncorrelated scalar subqueries.
+    row = db.execute(
+        select(
+            select(func.count(models.User.user_id)).scalar_subquery().label("total_users"),
+            select(func.count(models.Book.book_id)).scalar_subquery().label("total_books"),
+            func.count(models.Loan.loan_id).label("active_loans"),
+            func.count(case((models.Loan.loan_due_date < date.today(), models.Loan.loan_id))).label("overdue_loans")
+        ).where(models.Loan.return_date.is_(None))
+    ).one()
+    return dict(row._mapping)
+
+
+def reconcile_stat_counters(db: Session) -> dict:
+    """Rewrite the maintained counters from the source tables (fixes overdue drift)."""
+    stats = compute_dashboard_stats(db)
+    counters = {**stats, "reconciled_at": int(time.time())}
+    try:
+        for name, value in counters.items():
+            db.merge(models.StatCounter(name=name, value=value))
+        db.commit()
+    except IntegrityError:
+        # Another worker reconciled at the same moment; its values are just as fresh.
+        db.rollback()
+    return stats
 
 
 def get_admin_dashboard_stats(db: Session):
-    total_users = db.query(func.count(models.User.user_id)).scalar()
-    total_books = db.query(func.count(models.Book.book_id)).scalar()
-    active_loans = db.query(func.count(models.Loan.loan_id)).filter(models.Loan.return_date == None).scalar()
-    overdue_loans = db.query(func.count(models.Loan.loan_id)).filter(
-        models.Loan.return_date == None,
-        models.Loan.loan_due_date < date.today()
-    ).scalar()
+    stats = stats_cache.get("dashboard")
+    if stats is not None:
+        return stats
+
+    if STATS_MODE == "counters":
+        counters = dict(db.query(models.StatCounter.name, models.StatCounter.value).all())
+        reconciled_at = counters.get("reconciled_at")
+        # Loans turn overdue as days pass without any write, so reconcile at
+        # least once per day and every STATS_RECONCILE_SECONDS.
+        if (
+            reconciled_at is None
+            or any(name not in counters for name in STAT_NAMES)
+            or time.time() - reconciled_at > STATS_RECONCILE_SECONDS
+            or date.fromtimestamp(reconciled_at) != date.today()
+        ):
+            stats = reconcile_stat_counters(db)
+        else:
+            stats = {name: counters[name] for name in STAT_NAMES}
+    else:
+        stats = compute_dashboard_stats(db)
 
-    return {
-        "total_users": total_users,
-        "total_books": total_books,
-        "active_loans": active_loans,
-        "overdue_loans": overdue_loans
-    }
+    stats_cache.set("dashboard", stats)
+    return stats
 
 
@@ -1,24 +1,242 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import itertools
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from app.instrumentation import instrument_engine
+from app.metrics import REGISTRY, Counter, Family, Histogram
 
+logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
+
+def session_scope(db, name: str):
+    started = time.perf_counter()
     try:
         yield db
     finally:
         db.close()
+        held = time.perf_counter() - started
+        if held > DB_SESSION_WARN_SECONDS:
+            logger.warning("Database session from %s was held for %.2fs", name, held)
+
+
+def get_db():
+    yield from session_scope(SessionLocal(), "get_db")
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
 
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Serve the hot routes from app/async_routes.py on an async engine.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_SESSION_WARN_SECONDS = float(os.getenv("DB_SESSION_WARN_SECONDS", "5"))
+
+# Comma-separated read-only replicas, used round-robin by read_session().
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+# How far replicas may trail the primary; reads inside this window after a
+# write that must be visible are sent to the primary instead.
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+checkout_wait_seconds = Family(
+    Histogram, "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("pool",)
+)
+hold_seconds = Family(Histogram, "db_pool_hold_seconds", "Time a connection stayed checked out", ("pool",))
+timeouts_total = Family(Counter, "db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT", ("pool",))
+_pool_families = (checkout_wait_seconds, hold_seconds, timeouts_total)
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.checkout_wait = checkout_wait_seconds.labels(name)
+        self.hold = hold_seconds.labels(name)
+        self.timeouts = timeouts_total.labels(name)
+
+
+pool_metrics = {}
+
+
+def _instrumented_pool_class(poolclass, metrics: PoolMetrics):
+    class InstrumentedPool(poolclass):
+        # Pool has no "before checkout" event, so the wait is timed around connect().
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            except PoolTimeoutError:
+                metrics.timeouts.inc()
+                raise
+            finally:
+                metrics.checkout_wait.observe(time.perf_counter() - started)
+
+    InstrumentedPool.__name__ = f"Instrumented{poolclass.__name__}"
+    return InstrumentedPool
+
+
+def _pool_options(url: str, poolclass, metrics: PoolMetrics) -> dict:
+    url = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # In-memory SQLite keeps one connection per thread; sizing knobs don't apply.
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        poolclass=_instrumented_pool_class(poolclass, metrics),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+
+def _instrument_checkouts(sync_engine, metrics: PoolMetrics):
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            metrics.hold.observe(time.perf_counter() - checked_out_at)
 
-engine = create_engine(DATABASE_URL)
+
+def _create_instrumented_engine(name: str, url: str, factory, poolclass):
+    metrics = pool_metrics[name] = PoolMetrics(name)
+    new_engine = factory(url, **_pool_options(url, poolclass, metrics))
+    sync_engine = getattr(new_engine, "sync_engine", new_engine)
+    _instrument_checkouts(sync_engine, metrics)
+    instrument_engine(sync_engine)
+    return new_engine
+
+
+engine = _create_instrumented_engine("primary", DATABASE_URL, create_engine, QueuePool)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+read_engines = []
+_read_engine_cycle = None
+_read_engine_lock = threading.Lock()
+
+
+def configure_read_replicas(urls):
+    """(Re)create the replica engines; an empty list sends every read to the primary."""
+    global read_engines, _read_engine_cycle
+    previous = read_engines
+    for name in [name for name in pool_metrics if name.startswith("replica_")]:
+        del pool_metrics[name]
+        for family in _pool_families:
+            family.remove(name)
+    read_engines = [
+        _create_instrumented_engine(f"replica_{i}", url, create_engine, QueuePool)
+        for i, url in enumerate(urls)
+    ]
+    _read_engine_cycle = itertools.cycle(read_engines) if read_engines else None
+    for old in previous:
+        old.dispose()
+
+
+def read_session(primary: bool = False):
+    """A session on the next replica in turn, or on the primary."""
+    if primary or _read_engine_cycle is None:
+        return SessionLocal()
+    with _read_engine_lock:
+        bind = next(_read_engine_cycle)
+    return SessionLocal(bind=bind)
+
+
+configure_read_replicas(DATABASE_READ_URLS)
+
+async_engine = None
+AsyncSessionLocal = None
+
+
+def async_database_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(
+        hide_password=False
+    )
+
+
+def get_async_sessionmaker():
+    # Created on first use so the async drivers are only needed in async mode.
+    global async_engine, AsyncSessionLocal
+    if AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = _create_instrumented_engine(
+            "async", async_database_url(DATABASE_URL), create_async_engine, AsyncAdaptedQueuePool
+        )
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return AsyncSessionLocal
+
+
+def _engines() -> dict:
+    engines = {"primary": engine}
+    engines.update((f"replica_{i}", replica) for i, replica in enumerate(read_engines))
+    if async_engine is not None:
+        engines["async"] = async_engine.sync_engine
+    return engines
+
+
+def _pool_collector():
+    gauges = {
+        "db_pool_size": ("Connections the pool keeps open", "size"),
+        "db_pool_checked_out": ("Connections currently checked out", "checkedout"),
+        "db_pool_overflow": ("Connections open beyond the pool size", "overflow"),
+    }
+    for metric, (description, method) in gauges.items():
+        samples = [
+            ("", {"pool": name}, getattr(current.pool, method)())
+            for name, current in _engines().items() if hasattr(current.pool, method)
+        ]
+        yield metric, "gauge", description, samples
+
+
+REGISTRY.register_collector(_pool_collector)
+
+
+def get_pool_stats() -> dict:
+    engines = _engines()
+
+    stats = {}
+    for name, current in engines.items():
+        pool = current.pool
+        metrics = pool_metrics[name]
+        stats[name] = {
+            "pool_class": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "timeouts": metrics.timeouts.value,
+            "checkout_wait_seconds": metrics.checkout_wait.snapshot(),
+            "hold_seconds": metrics.hold.snapshot(),
+        }
+    return stats
@@ -1,8 +1,19 @@
+import os
+import time
+from functools import partial
+from typing import Optional
+
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from app import catalog
+from app.cache import LRUCache
+from app.metrics import cache_collector
+from app import database
+from app.database import get_db, get_async_db
 from app.crud import get_user_by_username
 from app.auth import SECRET_KEY, ALGORITHM
 from app.models import User
@@ -10,28 +21,180 @@ from app.models import User
 
 oauth2_scheme = HTTPBearer()
 
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
 
-def get_current_user(
-        token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"}
-    )
+# Detached User snapshots keyed by token subject (username).
+principal_cache = LRUCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+cache_collector("principal_cache", principal_cache)
+
+
+def _snapshot(user: User) -> User:
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    return snapshot
 
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    usernames = {target.username, *inspect(target).attrs.username.history.deleted}
+    for username in usernames:
+        principal_cache.pop(username)
+
+
+def decode_token_subject(token: HTTPAuthorizationCredentials) -> str:
     try:
         payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        username = None
+
+    if username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return username
+
+
+def load_principal(db: Session, username: str) -> Optional[User]:
+    cached = principal_cache.get(username)
+    if cached is not None:
+        # Attach a per-session copy without a SELECT; the snapshot stays untouched.
+        return db.merge(cached, load=False)
 
     user = get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
+    if user is not None:
+        principal_cache.set(username, _snapshot(user))
+    return user
 
+
+def _authenticated(user: Optional[User]) -> User:
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
     return user
 
+
+def get_current_user(
+        token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+        db: Session = Depends(get_db)
+) -> User:
+    return _authenticated(load_principal(db, decode_token_subject(token)))
+
+
+async def get_current_user_async(
+        token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+) -> User:
+    return _authenticated(await db.run_sync(load_principal, decode_token_subject(token)))
+
+
+def check_catalog_etag(request: Request, response: Response):
+    """Answer If-None-Match for catalog reads from the catalog version alone.
+
+    Raises a 304 before the route queries anything; otherwise sets the ETag
+    and Cache-Control headers on the response.
+    """
+    # JSON, NDJSON and gzipped NDJSON bodies differ, so the ETag covers the negotiation headers.
+    variant = f"{request.headers.get('accept', '')}|{request.headers.get('accept-encoding', '')}"
+    etag = catalog.etag_for(request.url.path, request.url.query, variant)
+    headers = catalog.cache_headers(etag)
+    if catalog.etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+
+# Read-your-writes: after a borrow or return the caller's reads go to the
+# primary for DB_REPLICA_MAX_LAG_SECONDS. The cookie carries the pin across
+# worker processes; the in-process map covers clients that drop cookies.
+PRIMARY_PIN_COOKIE = "read_primary_until"
+_primary_pins = {}
+
+
+def pin_reads_to_primary(response: Response, username: Optional[str] = None):
+    if not database.read_engines:
+        return
+    lag = database.DB_REPLICA_MAX_LAG_SECONDS
+    until = time.time() + lag
+    response.set_cookie(PRIMARY_PIN_COOKIE, f"{until:.3f}", max_age=max(1, int(lag + 1)), httponly=True, samesite="lax")
+    if username is not None:
+        if len(_primary_pins) > PRINCIPAL_CACHE_SIZE:
+            now = time.time()
+            for name in [name for name, expires in _primary_pins.items() if expires <= now]:
+                _primary_pins.pop(name, None)
+        _primary_pins[username] = until
+
+
+def _reads_pinned(request: Request) -> bool:
+    now = time.time()
+    try:
+        # Capped so a forged cookie can't pin a client for longer than the window.
+        cookie_until = min(float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)), now + database.DB_REPLICA_MAX_LAG_SECONDS)
+    except ValueError:
+        cookie_until = 0
+    if cookie_until > now:
+        return True
+
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not _primary_pins:
+        return False
+    try:
+        username = jwt.decode(credentials, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return False
+    return _primary_pins.get(username, 0) > now
+
+
+def _read_from_primary(request: Request, catalog_read: bool = False) -> bool:
+    if not database.read_engines or _reads_pinned(request):
+        return True
+    # Catalog ETags follow the version bumped on the primary; until replicas
+    # catch up, a replica read could be cached under the new ETag.
+    return catalog_read and catalog.changed_within(database.DB_REPLICA_MAX_LAG_SECONDS)
+
+
+def read_session_factory(request: Request, catalog_read: bool = False):
+    """Opens sessions for a read-only request: on a replica unless the caller just wrote."""
+    return partial(database.read_session, primary=_read_from_primary(request, catalog_read))
+
+
+# Served from the primary, read routes reuse the request's get_db session,
+# which get_current_user shares; only a replica read opens a second one.
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    if _read_from_primary(request):
+        yield db
+    else:
+        yield from database.session_scope(database.read_session(), "get_read_db")
+
+
+def get_catalog_read_db(request: Request, db: Session = Depends(get_db)):
+    if _read_from_primary(request, catalog_read=True):
+        yield db
+    else:
+        yield from database.session_scope(database.read_session(), "get_catalog_read_db")
+
+
+def get_current_reader(
+        token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+        db: Session = Depends(get_read_db)
+) -> User:
+    """get_current_user for read-only routes: the principal is loaded on the read session."""
+    username = decode_token_subject(token)
+    user = load_principal(db, username)
+    if user is None and db.get_bind() is not database.engine:
+        # Registered after the replica's last catch-up: load it on the primary,
+        # which caches the principal, then attach the cached copy.
+        primary = database.SessionLocal()
+        try:
+            load_principal(primary, username)
+        finally:
+            primary.close()
+        user = load_principal(db, username)
+    return _authenticated(user)
@@ -0,0 +1,255 @@
+"""Fine accrual: a nightly batch job plus the per-user fine ledger.
+
+    python -m app.fines                      # accrue fines as of today
+    python -m app.fines --date 2024-05-01    # accrue as of a given day
+    python -m app.fines --batch-size 5000 --max-batches 10
+
+Each run walks open overdue loans in loan_id order, one batch per
+transaction, and charges every loan the difference between what it owes as
+of the run date and what the ledger already holds for it. Progress is
+checkpointed in fine_accrual_runs, so re-running a day is a no-op and an
+interrupted run resumes after the last committed batch. A missed night is
+caught up by the next run, since the charge is computed from the total owed.
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+import os
+from typing import Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+
+FINE_PER_DAY = Decimal("1.50")
+FINE_ACCRUAL_BATCH_SIZE = int(os.getenv("FINE_ACCRUAL_BATCH_SIZE", "1000"))
+
+ACCRUAL = "accrual"
+SETTLEMENT = "settlement"
+
+
+def fine_for(due_date: date, as_of: date) -> Decimal:
+    days_late = (as_of - due_date).days
+    return Decimal(days_late) * FINE_PER_DAY if days_late > 0 else Decimal("0")
+
+
+def _add_to_balances(db: Session, deltas: dict):
+    """Add per-user amounts to user_fine_balances inside the caller's transaction."""
+    deltas = {user_id: amount for user_id, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    balances = models.UserFineBalance.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = upsert(balances).values([
+            {"user_id": user_id, "balance": amount, "updated_at": now}
+            for user_id, amount in sorted(deltas.items())
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[balances.c.user_id],
+            set_={"balance": balances.c.balance + stmt.excluded.balance, "updated_at": now}
+        ))
+        return
+
+    for user_id, amount in sorted(deltas.items()):
+        result = db.execute(
+            update(balances)
+            .where(balances.c.user_id == user_id)
+            .values(balance=balances.c.balance + amount, updated_at=now)
+        )
+        if result.rowcount == 0:
+            db.execute(insert(balances).values(user_id=user_id, balance=amount, updated_at=now))
+
+
+def _accrued_by_loan(db: Session, loan_ids) -> dict:
+    entries = models.FineLedgerEntry
+    return dict(
+        db.execute(
+            select(entries.loan_id, func.sum(entries.amount))
+            .where(entries.loan_id.in_(loan_ids))
+            .group_by(entries.loan_id)
+        ).all()
+    )
+
+
+def settle_returned_loans(db: Session, returns: dict, return_date: date):
+    """True up the ledger for returned loans inside the caller's transaction.
+
+    returns maps loan_id to (user_id, final fine). The settlement entry makes
+    the ledger total for each loan equal its final fine, which differs from
+    what was accrued when the loan comes back before the next run or with a
+    backdated return_date.
+    """
+    if not returns:
+        return
+    accrued = _accrued_by_loan(db, list(returns))
+    entries, deltas = [], defaultdict(Decimal)
+    for loan_id, (user_id, fine) in returns.items():
+        amount = (fine or Decimal("0")) - accrued.get(loan_id, Decimal("0"))
+        if amount:
+            entries.append({
+                "user_id": user_id,
+                "loan_id": loan_id,
+                "accrual_date": return_date,
+                "entry_type": SETTLEMENT,
+                "amount": amount,
+            })
+            deltas[user_id] += amount
+    if entries:
+        db.execute(insert(models.FineLedgerEntry), entries)
+        _add_to_balances(db, deltas)
+
+
+def _start_run(db: Session, run_date: date) -> Optional[models.FineAccrualRun]:
+    """The run's checkpoint, created if needed; None if another job created it first."""
+    run = db.get(models.FineAccrualRun, run_date)
+    if run is not None:
+        return run
+    db.add(models.FineAccrualRun(run_date=run_date, last_loan_id=0, started_at=datetime.utcnow()))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return db.get(models.FineAccrualRun, run_date)
+
+
+def accrue_fines(
+    db: Session,
+    run_date: Optional[date] = None,
+    batch_size: int = FINE_ACCRUAL_BATCH_SIZE,
+    max_batches: Optional[int] = None
+) -> dict:
+    """Accrue fines for open overdue loans as of run_date, one committed batch at a time.
+
+    A job that loses a race with another job for the same day stops with
+    status "in_progress" and leaves the day to the other job.
+    """
+    run_date = run_date or date.today()
+    run = _start_run(db, run_date)
+    summary = {
+        "run_date": run_date.isoformat(),
+        "resumed_from": run.last_loan_id if run else 0,
+        "loans_charged": 0,
+        "amount": Decimal("0"),
+    }
+    if run is None:
+        return {**summary, "status": "in_progress", "last_loan_id": 0}
+    if run.completed_at is not None:
+        return {**summary, "status": "already_completed", "last_loan_id": run.last_loan_id}
+
+    loans = models.Loan
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # Rows being returned right now are skipped rather than waited on: the
+        # return settles them, and if it rolls back tomorrow's run catches up.
+        batch = db.execute(
+            select(loans.loan_id, loans.user_id, loans.loan_due_date)
+            .where(
+                loans.return_date.is_(None),
+                loans.loan_due_date < run_date,
+                loans.loan_id > run.last_loan_id
+            )
+            .order_by(loans.loan_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not batch:
+            run.completed_at = datetime.utcnow()
+            db.commit()
+            break
+
+        accrued = _accrued_by_loan(db, [row.loan_id for row in batch])
+        entries, deltas = [], defaultdict(Decimal)
+        for row in batch:
+            amount = fine_for(row.loan_due_date, run_date) - accrued.get(row.loan_id, Decimal("0"))
+            if amount > 0:
+                entries.append({
+                    "user_id": row.user_id,
+                    "loan_id": row.loan_id,
+                    "accrual_date": run_date,
+                    "entry_type": ACCRUAL,
+                    "amount": amount,
+                })
+                deltas[row.user_id] += amount
+
+        try:
+            if entries:
+                # A second job racing on the same day fails on
+                # uq_fine_ledger_loan_date_type instead of charging twice.
+                db.execute(insert(models.FineLedgerEntry), entries)
+                _add_to_balances(db, deltas)
+            run.last_loan_id = batch[-1].loan_id
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return {**summary, "status": "in_progress", "last_loan_id": run.last_loan_id}
+
+        batches += 1
+        summary["loans_charged"] += len(entries)
+        summary["amount"] += sum(deltas.values(), Decimal("0"))
+
+    status = "completed" if run.completed_at is not None else "partial"
+    return {**summary, "status": status, "last_loan_id": run.last_loan_id}
+
+
+def get_user_fines(db: Session, user_id: int, limit: int = 20) -> dict:
+    balance = db.get(models.UserFineBalance, user_id)
+    entries = (
+        db.query(models.FineLedgerEntry)
+        .filter(models.FineLedgerEntry.user_id == user_id)
+        .order_by(models.FineLedgerEntry.entry_id.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "user_id": user_id,
+        "balance": balance.balance if balance else Decimal("0.00"),
+        "updated_at": balance.updated_at if balance else None,
+        "entries": entries,
+    }
+
+
+def get_fine_liability(db: Session) -> dict:
+    balances = models.UserFineBalance
+    total, users = db.execute(
+        select(func.coalesce(func.sum(balances.balance), 0), func.count())
+        .where(balances.balance != 0)
+    ).one()
+    return {"total_liability": Decimal(total), "users_with_balance": users}
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Accrue fines for open overdue loans.")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="accrue as of this day (YYYY-MM-DD); defaults to today")
+    parser.add_argument("--batch-size", type=int, default=FINE_ACCRUAL_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=None,
+                        help="stop after this many batches; the next run resumes")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = accrue_fines(db, args.date, args.batch_size, args.max_batches)
+    finally:
+        db.close()
+    print(
+        f"{summary['run_date']}: {summary['status']}, charged {summary['loans_charged']} loans "
+        f"{summary['amount']:.2f} (resumed from loan {summary['resumed_from']}, "
+        f"checkpoint at loan {summary['last_loan_id']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
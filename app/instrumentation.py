@@ -0,0 +1,141 @@
+"""Per-request metrics: latency, status, in-flight requests and SQL work.
+
+RequestMetricsMiddleware opens a RequestStats for every HTTP request in a
+context variable. The engine hooks installed by instrument_engine add each
+statement's count and duration to it, including statements run from the
+threadpool or through AsyncSession.run_sync, because both inherit the
+request's context. Everything is exported through app.metrics.
+
+Set SLOW_REQUEST_SECONDS to log requests slower than that, together with
+their slowest SQL statements.
+"""
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.metrics import Counter, Family, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+# Statements kept per request for the slow-request log.
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+SLOW_REQUEST_LOGGED_STATEMENTS = 5
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+requests_total = Family(Counter, "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+request_seconds = Family(Histogram, "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+request_queries = Family(
+    Histogram, "http_request_db_queries", "SQL statements issued per HTTP request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+request_db_seconds = Family(Histogram, "http_request_db_seconds", "Time spent in SQL per HTTP request", ("method", "route"))
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+db_queries_total = Counter("db_queries_total", "SQL statements executed, inside requests or not")
+db_query_seconds = Histogram("db_query_seconds", "Duration of individual SQL statements")
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, keep_statements: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    db_queries_total.inc()
+    db_query_seconds.observe(elapsed)
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    """Attribute SQL statements run on engine (a sync Engine) to the current request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(keep_statements=SLOW_REQUEST_SECONDS > 0)
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec()
+            _current.reset(token)
+            self._record(scope, status, elapsed, stats)
+
+    @staticmethod
+    def _record(scope, status: int, elapsed: float, stats: RequestStats):
+        method = scope["method"]
+        route = scope.get("route")
+        # Unmatched paths share one label so scanners can't explode cardinality.
+        route = getattr(route, "path", None) or "unmatched"
+
+        requests_total.labels(method, route, str(status)).inc()
+        request_seconds.labels(method, route).observe(elapsed)
+        request_queries.labels(method, route).observe(stats.queries)
+        request_db_seconds.labels(method, route).observe(stats.db_seconds)
+
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            slowest = sorted(stats.statements, key=lambda entry: entry[0], reverse=True)
+            logger.warning(
+                "Slow request %s %s (%s): %.3fs, %d queries, %.3fs in SQL%s",
+                method, scope.get("path"), route, elapsed, stats.queries, stats.db_seconds,
+                "".join(
+                    f"\n  [{duration * 1000:.1f}ms] {' '.join(statement.split())}"
+                    for duration, statement in slowest[:SLOW_REQUEST_LOGGED_STATEMENTS]
+                )
+            )
@@ -0,0 +1,197 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms register themselves in REGISTRY when they
+are created, and render_prometheus() renders everything for GET /metrics.
+Values are per worker process; Prometheus sums them across scrape targets.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector):
+        """collector() returns (name, type, description, samples) tuples, samples being (suffix, labels, value)."""
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def collect(self):
+        with self._lock:
+            metrics, collectors = list(self._metrics.values()), list(self._collectors)
+        for metric in metrics:
+            yield metric.name, metric.type, metric.description, metric.samples()
+        for collector in collectors:
+            yield from collector()
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(registry: Registry = REGISTRY) -> str:
+    lines = []
+    for name, metric_type, description, samples in registry.collect():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: dict = None, register: bool = True):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+        if register:
+            REGISTRY.register(self)
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [("", self.labels, self.value)]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: int = 1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS, labels: dict = None,
+                 register: bool = True):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = labels or {}
+        self.count = 0
+        self.sum = 0.0
+        self._bucket_counts = [0] * len(self.buckets)
+        self._lock = threading.Lock()
+        if register:
+            REGISTRY.register(self)
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._bucket_counts[i] += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "buckets": dict(zip(self.buckets, self._bucket_counts)),
+            }
+
+    def samples(self):
+        snapshot = self.snapshot()
+        samples = [
+            ("_bucket", {**self.labels, "le": _format_value(bound)}, count)
+            for bound, count in snapshot["buckets"].items()
+        ]
+        samples.append(("_bucket", {**self.labels, "le": "+Inf"}, snapshot["count"]))
+        samples.append(("_sum", self.labels, snapshot["sum"]))
+        samples.append(("_count", self.labels, snapshot["count"]))
+        return samples
+
+
+class Family:
+    """A metric with labels; labels(...) returns the child for one label set."""
+
+    def __init__(self, metric_class, name: str, description: str, labelnames, **options):
+        self.metric_class = metric_class
+        self.type = metric_class.type
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.options = options
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self.metric_class(
+                        self.name, self.description, labels=dict(zip(self.labelnames, values)),
+                        register=False, **self.options
+                    )
+                    self._children[values] = child
+        return child
+
+    def remove(self, *values):
+        """Drop the child for one label set, e.g. a pool that no longer exists."""
+        with self._lock:
+            self._children.pop(values, None)
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.values())
+        return [sample for child in children for sample in child.samples()]
+
+
+def cache_collector(name: str, cache):
+    """Expose an app.cache.LRUCache's stats as gauges/counters named <name>_*."""
+    def collect():
+        stats = cache.stats()
+        yield f"{name}_hits_total", "counter", f"{name} lookups that hit", [("", {}, stats["hits"])]
+        yield f"{name}_misses_total", "counter", f"{name} lookups that missed", [("", {}, stats["misses"])]
+        yield f"{name}_entries", "gauge", f"Entries currently held in {name}", [("", {}, stats["size"])]
+    return REGISTRY.register_collector(collect)
@@ -0,0 +1,389 @@
+"""Versioned schema migrations. Replaces Base.metadata.create_all.
+
+    python -m app.migrations           # upgrade to the latest version
+    python -m app.migrations --status  # list applied and pending versions
+
+Every migration runs in its own transaction and is recorded in
+schema_migrations. Migrations must be idempotent (checkfirst), because
+databases created by create_all before this module existed already hold
+some of the objects they create.
+"""
+import argparse
+import os
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, LargeBinary, MetaData, Numeric, String, Table, Text,
+    UniqueConstraint, func, select, text
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+# Whether main.py's lifespan hook upgrades the schema before serving. Turn it
+# off when deploys run `python -m app.migrations` once, so that workers boot
+# without touching the schema.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return register
+
+
+# Migrations spell out the tables and indexes as they were at their version
+# instead of reading app.models, which only describes the latest schema.
+# Tables a migration merely points a foreign key at are declared as stubs.
+
+def _users_stub(metadata: MetaData) -> Table:
+    return Table("users", metadata, Column("user_id", Integer, primary_key=True))
+
+
+def _books_stub(metadata: MetaData) -> Table:
+    return Table("books", metadata, Column("book_id", Integer, primary_key=True))
+
+
+def _loans_stub(metadata: MetaData) -> Table:
+    return Table(
+        "loans", metadata,
+        Column("loan_id", Integer, primary_key=True),
+        Column("book_id", Integer),
+        Column("user_id", Integer),
+        Column("loan_due_date", Date),
+        Column("return_date", Date),
+    )
+
+
+def _create(connection: Connection, *objects):
+    for schema_object in objects:
+        schema_object.create(connection, checkfirst=True)
+
+
+@migration(1, "Initial schema: users, books, loans, stat_counters")
+def _initial_schema(connection: Connection):
+    metadata = MetaData()
+    users = Table(
+        "users", metadata,
+        Column("user_id", Integer, primary_key=True, index=True),
+        Column("username", String, nullable=False),
+        Column("user_email", String, nullable=False, unique=True),
+        Column("hashed_password", String, nullable=False),
+        Column("is_admin", Boolean),
+    )
+    books = Table(
+        "books", metadata,
+        Column("book_id", Integer, primary_key=True, index=True),
+        Column("book_name", String, nullable=False, index=True),
+        Column("book_genre", String, nullable=False),
+        Column("book_year", Integer, nullable=False),
+        Column("book_author", Text, nullable=False),
+        Column("book_language", String, nullable=False),
+        Column("book_description", Text, nullable=True),
+        Column("number_available_volumes", Integer, nullable=False),
+    )
+    loans = Table(
+        "loans", metadata,
+        Column("loan_id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False),
+        Column("book_id", Integer, ForeignKey("books.book_id"), nullable=False),
+        Column("loan_due_date", Date, nullable=False),
+        Column("return_date", Date, nullable=True),
+        Column("loan_fine", Numeric, nullable=True),
+    )
+    stat_counters = Table(
+        "stat_counters", metadata,
+        Column("name", String, primary_key=True),
+        Column("value", Integer, nullable=False),
+    )
+    metadata.create_all(connection, tables=[users, books, loans, stat_counters])
+
+
+@migration(2, "Indexes for principal lookups, loan queries and title search")
+def _query_indexes(connection: Connection):
+    metadata = MetaData()
+    users = Table("users", metadata, Column("username", String))
+    books = Table("books", metadata, Column("book_name", String), Column("book_author", Text))
+    loans = _loans_stub(metadata)
+
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        _create(
+            connection,
+            Index("ix_books_book_name_trgm", books.c.book_name,
+                  postgresql_using="gin", postgresql_ops={"book_name": "gin_trgm_ops"}),
+            Index("ix_books_book_author_trgm", books.c.book_author,
+                  postgresql_using="gin", postgresql_ops={"book_author": "gin_trgm_ops"}),
+        )
+    _create(
+        connection,
+        # Fails on databases that already hold duplicate usernames; dedupe those first.
+        Index("uq_users_username", users.c.username, unique=True),
+        Index("ix_loans_book_id", loans.c.book_id),
+        Index(
+            "ix_loans_open_due_date", loans.c.loan_due_date,
+            postgresql_where=loans.c.return_date.is_(None),
+            sqlite_where=loans.c.return_date.is_(None)
+        ),
+        Index("ix_loans_user_id_due_date", loans.c.user_id, loans.c.loan_due_date),
+    )
+
+
+@migration(3, "Fine ledger, per-user fine balances and accrual run state")
+def _fine_ledger(connection: Connection):
+    metadata = MetaData()
+    _users_stub(metadata)
+    fine_ledger = Table(
+        "fine_ledger", metadata,
+        Column("entry_id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False, index=True),
+        Column("loan_id", Integer, nullable=False, index=True),
+        Column("accrual_date", Date, nullable=False),
+        Column("entry_type", String, nullable=False),
+        Column("amount", Numeric(12, 2), nullable=False),
+        UniqueConstraint("loan_id", "accrual_date", "entry_type", name="uq_fine_ledger_loan_date_type"),
+    )
+    user_fine_balances = Table(
+        "user_fine_balances", metadata,
+        Column("user_id", Integer, ForeignKey("users.user_id"), primary_key=True),
+        Column("balance", Numeric(12, 2), nullable=False),
+        Column("updated_at", DateTime, nullable=True),
+    )
+    fine_accrual_runs = Table(
+        "fine_accrual_runs", metadata,
+        Column("run_date", Date, primary_key=True),
+        Column("last_loan_id", Integer, nullable=False),
+        Column("started_at", DateTime, nullable=False),
+        Column("completed_at", DateTime, nullable=True),
+    )
+    metadata.create_all(connection, tables=[fine_ledger, user_fine_balances, fine_accrual_runs])
+
+
+@migration(4, "Notification outbox for due-soon and overdue events")
+def _notification_outbox(connection: Connection):
+    metadata = MetaData()
+    _users_stub(metadata)
+    outbox = Table(
+        "notification_outbox", metadata,
+        Column("notification_id", Integer, primary_key=True),
+        Column("loan_id", Integer, nullable=False),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False),
+        Column("event_type", String, nullable=False),
+        Column("due_date", Date, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Column("dispatched_at", DateTime, nullable=True),
+        UniqueConstraint("loan_id", "event_type", name="uq_notification_outbox_loan_event"),
+    )
+    Index(
+        "ix_notification_outbox_pending", outbox.c.notification_id,
+        postgresql_where=outbox.c.dispatched_at.is_(None),
+        sqlite_where=outbox.c.dispatched_at.is_(None)
+    )
+    metadata.create_all(connection, tables=[outbox])
+
+
+@migration(5, "Archive table for returned loans, partitioned by return date on PostgreSQL")
+def _loans_archive(connection: Connection):
+    metadata = MetaData()
+    _users_stub(metadata)
+    _books_stub(metadata)
+    loans_archive = Table(
+        "loans_archive", metadata,
+        Column("loan_id", Integer, primary_key=True, autoincrement=False),
+        Column("return_date", Date, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False),
+        Column("book_id", Integer, ForeignKey("books.book_id"), nullable=False),
+        Column("loan_due_date", Date, nullable=False),
+        Column("loan_fine", Numeric, nullable=True),
+        Index("ix_loans_archive_user_id_due_date", "user_id", "loan_due_date"),
+        postgresql_partition_by="RANGE (return_date)",
+    )
+    metadata.create_all(connection, tables=[loans_archive])
+
+
+@migration(6, "Keyset and book indexes for paginated loan history")
+def _loan_history_indexes(connection: Connection):
+    metadata = MetaData()
+    loans = _loans_stub(metadata)
+    loans_archive = Table(
+        "loans_archive", metadata,
+        Column("loan_id", Integer),
+        Column("book_id", Integer),
+        Column("loan_due_date", Date),
+    )
+    _create(
+        connection,
+        Index("ix_loans_due_date_loan_id", loans.c.loan_due_date, loans.c.loan_id),
+        Index("ix_loans_archive_book_id", loans_archive.c.book_id),
+        Index("ix_loans_archive_due_date_loan_id", loans_archive.c.loan_due_date, loans_archive.c.loan_id),
+    )
+
+
+@migration(7, "Unique natural key on books for upserting imports")
+def _book_natural_key(connection: Connection):
+    metadata = MetaData()
+    books = Table(
+        "books", metadata,
+        Column("book_name", String),
+        Column("book_author", Text),
+        Column("book_year", Integer),
+        Column("book_language", String),
+    )
+    # Merging duplicate editions means choosing between their descriptions and
+    # repointing their loans, so it is left to the operator; say what to merge.
+    key = [books.c.book_name, books.c.book_author, books.c.book_year, books.c.book_language]
+    duplicates = connection.execute(
+        select(*key, func.count()).group_by(*key).having(func.count() > 1).limit(10)
+    ).all()
+    if duplicates:
+        listed = "\n".join(f"  {tuple(row[:-1])!r}: {row[-1]} rows" for row in duplicates)
+        raise RuntimeError(
+            "Migration 7 makes (book_name, book_author, book_year, book_language) unique in books, "
+            f"but some editions are stored more than once:\n{listed}\n"
+            "Merge each of them into one row (repointing its loans) and run the migrations again."
+        )
+    _create(connection, Index("uq_books_natural_key", books.c.book_name, books.c.book_author, books.c.book_year,
+                              books.c.book_language, unique=True))
+
+
+@migration(8, "Never reuse loan ids on SQLite (AUTOINCREMENT)")
+def _loan_ids_autoincrement(connection: Connection):
+    if connection.dialect.name != "sqlite":
+        # PostgreSQL's serial sequence never hands out an id twice.
+        return
+    table_sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'loans'")
+    ).scalar()
+    if "AUTOINCREMENT" in (table_sql or "").upper():
+        return
+    # SQLite cannot add AUTOINCREMENT in place: rebuild the table.
+    connection.execute(text("ALTER TABLE loans RENAME TO loans_before_autoincrement"))
+    for index in ("ix_loans_user_id_due_date", "ix_loans_open_due_date", "ix_loans_book_id",
+                  "ix_loans_due_date_loan_id"):
+        connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+    metadata = MetaData()
+    _users_stub(metadata)
+    _books_stub(metadata)
+    loans = Table(
+        "loans", metadata,
+        Column("loan_id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False),
+        Column("book_id", Integer, ForeignKey("books.book_id"), nullable=False),
+        Column("loan_due_date", Date, nullable=False),
+        Column("return_date", Date, nullable=True),
+        Column("loan_fine", Numeric, nullable=True),
+        Index("ix_loans_user_id_due_date", "user_id", "loan_due_date"),
+        Index("ix_loans_open_due_date", "loan_due_date", sqlite_where=text("return_date IS NULL")),
+        Index("ix_loans_book_id", "book_id"),
+        Index("ix_loans_due_date_loan_id", "loan_due_date", "loan_id"),
+        sqlite_autoincrement=True,
+    )
+    metadata.create_all(connection, tables=[loans])
+    columns = "loan_id, user_id, book_id, loan_due_date, return_date, loan_fine"
+    connection.execute(text(f"INSERT INTO loans ({columns}) SELECT {columns} FROM loans_before_autoincrement"))
+    connection.execute(text("DROP TABLE loans_before_autoincrement"))
+
+    # Start after every id already handed out, including archived and deleted loans.
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'loans'"))
+    connection.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'loans', MAX(seq) FROM ("
+        "SELECT COALESCE(MAX(loan_id), 0) AS seq FROM loans "
+        "UNION ALL SELECT COALESCE(MAX(loan_id), 0) FROM loans_archive "
+        "UNION ALL SELECT COALESCE(MAX(loan_id), 0) FROM fine_ledger "
+        "UNION ALL SELECT COALESCE(MAX(loan_id), 0) FROM notification_outbox)"
+    ))
+
+
+@migration(9, "PDF export jobs shared across workers")
+def _pdf_export_jobs(connection: Connection):
+    metadata = MetaData()
+    _users_stub(metadata)
+    pdf_export_jobs = Table(
+        "pdf_export_jobs", metadata,
+        Column("job_id", String, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.user_id"), nullable=False),
+        Column("status", String, nullable=False),
+        Column("created_at", DateTime, nullable=False, index=True),
+        Column("finished_at", DateTime, nullable=True),
+        Column("pdf", LargeBinary, nullable=True),
+    )
+    metadata.create_all(connection, tables=[pdf_export_jobs])
+
+
+def applied_versions(engine: Engine) -> set:
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _lock_schema(connection: Connection):
+    """Serialize concurrent upgrades from several workers until the transaction ends."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(727100)"))
+    elif connection.dialect.name == "sqlite":
+        # pysqlite leaves DDL outside of any transaction unless one is opened
+        # explicitly; IMMEDIATE also takes the write lock up front, so a
+        # rebuild (migration 8) commits or rolls back as a whole.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def upgrade(engine: Engine) -> list:
+    """Apply pending migrations in order; returns the versions applied."""
+    applied = applied_versions(engine)
+    newly_applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                _lock_schema(connection)
+                # Re-checked under the lock: `applied` may be stale by now.
+                if connection.execute(
+                    select(schema_migrations.c.version).where(schema_migrations.c.version == version)
+                ).first():
+                    continue
+                fn(connection)
+                connection.execute(schema_migrations.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another process recorded this version first.
+            continue
+        newly_applied.append(version)
+    return newly_applied
+
+
+def main():
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Apply database schema migrations.")
+    parser.add_argument("--status", action="store_true", help="show migration status without applying anything")
+    args = parser.parse_args()
+
+    if args.status:
+        applied = applied_versions(engine)
+        for version, description, _ in MIGRATIONS:
+            print(f"{'applied' if version in applied else 'pending':<8} {version:>4}  {description}")
+        return
+
+    versions = upgrade(engine)
+    print(f"Applied migrations: {', '.join(map(str, versions))}" if versions else "Database is up to date.")
+
+
+if __name__ == "__main__":
+    main()
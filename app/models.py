@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Numeric, Integer, String, Text, ForeignKey, Float, Date, Boolean
+from sqlalchemy import Column, Numeric, Integer, String, Text, ForeignKey, Float, Date, DateTime, Boolean, DDL, Index, LargeBinary, UniqueConstraint, event
 from datetime import datetime
 from app.database import Base
 from sqlalchemy.orm import relationship
@@ -16,6 +16,11 @@ class User(Base):
 
     loans = relationship("Loan", back_populates="user")
 
+    # Every authenticated request resolves its principal by username.
+    __table_args__ = (
+        Index("uq_users_username", "username", unique=True),
+    )
+
 
 # Book model
 class Book(Base):
@@ -32,6 +37,27 @@ class Book(Base):
 
     loans = relationship("Loan", back_populates="book")
 
+    __table_args__ = (
+        # One row per edition; imports upsert on this key.
+        Index("uq_books_natural_key", "book_name", "book_author", "book_year", "book_language", unique=True),
+        # Trigram indexes back title/author search on PostgreSQL (see app/search.py).
+        Index(
+            "ix_books_book_name_trgm", "book_name",
+            postgresql_using="gin", postgresql_ops={"book_name": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_books_book_author_trgm", "book_author",
+            postgresql_using="gin", postgresql_ops={"book_author": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
+
+event.listen(
+    Book.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
 
 # Loan model (the association model)
 class Loan(Base):
@@ -46,3 +72,121 @@ class Loan(Base):
 
     user = relationship("User", back_populates="loans")
     book = relationship("Book", back_populates="loans")
+
+    __table_args__ = (
+        # get_loans_by_user / per-user exports: filter on user, ordered by due date.
+        Index("ix_loans_user_id_due_date", "user_id", "loan_due_date"),
+        # get_overdue_loans / get_loans_due_soon / stats: open loans only, by due date.
+        Index(
+            "ix_loans_open_due_date", "loan_due_date",
+            postgresql_where=return_date.is_(None),
+            sqlite_where=return_date.is_(None)
+        ),
+        Index("ix_loans_book_id", "book_id"),
+        # Loan history pages: keyset on (loan_due_date, loan_id), newest due first.
+        Index("ix_loans_due_date_loan_id", "loan_due_date", "loan_id"),
+        # Archived loans leave `loans`; SQLite must still never hand their ids out
+        # again, as fine_ledger, the outbox and the PDF cache refer to loans by id.
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Returned loans moved out of `loans` by app/archive.py. On PostgreSQL the
+# table is range-partitioned by return_date, one partition per year.
+class LoanArchive(Base):
+    __tablename__ = "loans_archive"
+
+    loan_id = Column(Integer, primary_key=True, autoincrement=False)
+    # Part of the key because a partitioned table's key must include the partition column.
+    return_date = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("books.book_id"), nullable=False)
+    loan_due_date = Column(Date, nullable=False)
+    loan_fine = Column(Numeric, nullable=True)
+
+    __table_args__ = (
+        Index("ix_loans_archive_user_id_due_date", "user_id", "loan_due_date"),
+        Index("ix_loans_archive_book_id", "book_id"),
+        Index("ix_loans_archive_due_date_loan_id", "loan_due_date", "loan_id"),
+        {"postgresql_partition_by": "RANGE (return_date)"},
+    )
+
+
+# Maintained dashboard counters, used when STATS_MODE=counters
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+# Fine ledger: one row per accrual or return settlement. loan_id carries no
+# foreign key so ledger rows stay an append-only record of what was charged.
+class FineLedgerEntry(Base):
+    __tablename__ = "fine_ledger"
+
+    entry_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    loan_id = Column(Integer, nullable=False, index=True)
+    accrual_date = Column(Date, nullable=False)
+    entry_type = Column(String, nullable=False)
+    amount = Column(Numeric(12, 2), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("loan_id", "accrual_date", "entry_type", name="uq_fine_ledger_loan_date_type"),
+    )
+
+
+# Running fine balance per user, maintained alongside every ledger write
+class UserFineBalance(Base):
+    __tablename__ = "user_fine_balances"
+
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    balance = Column(Numeric(12, 2), nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+
+# Progress of the nightly accrual job, so an interrupted run resumes where it stopped
+class FineAccrualRun(Base):
+    __tablename__ = "fine_accrual_runs"
+
+    run_date = Column(Date, primary_key=True)
+    last_loan_id = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=False)
+    completed_at = Column(DateTime, nullable=True)
+
+
+# Due-soon / overdue events waiting to be delivered; dispatched_at is set by the sender
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    notification_id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    event_type = Column(String, nullable=False)
+    due_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    dispatched_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("loan_id", "event_type", name="uq_notification_outbox_loan_event"),
+        # The sender polls undelivered rows in insertion order.
+        Index(
+            "ix_notification_outbox_pending", "notification_id",
+            postgresql_where=dispatched_at.is_(None),
+            sqlite_where=dispatched_at.is_(None)
+        ),
+    )
+
+
+# Background PDF exports, shared by every worker: the one rendering a job
+# writes its status and document here, and any worker can answer a poll.
+class PdfExportJob(Base):
+    __tablename__ = "pdf_export_jobs"
+
+    job_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    pdf = Column(LargeBinary, nullable=True)
@@ -0,0 +1,254 @@
+"""Due-date index for open loans and the due-soon / overdue notification outbox.
+
+The index is an in-process sorted list of (loan_due_date, loan_id) over open
+loans. It is loaded lazily, kept current by crud on borrow and return, and
+rebuilt every DUE_INDEX_REFRESH_SECONDS so writes made by other worker
+processes are picked up. /loans/overdue and /notifications/due-soon read
+loan ids from it and fetch only those rows by primary key.
+
+With NOTIFY_SCHEDULER=1 every worker runs a background thread that turns the
+index into notification_outbox rows. The (loan_id, event_type) unique key
+keeps concurrent workers and restarts from emitting an event twice.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+logger = logging.getLogger(__name__)
+
+DUE_INDEX_REFRESH_SECONDS = float(os.getenv("DUE_INDEX_REFRESH_SECONDS", "60"))
+NOTIFY_SCHEDULER = os.getenv("NOTIFY_SCHEDULER", "0").lower() in ("1", "true", "yes")
+NOTIFY_INTERVAL_SECONDS = float(os.getenv("NOTIFY_INTERVAL_SECONDS", "300"))
+NOTIFY_DAYS_AHEAD = int(os.getenv("NOTIFY_DAYS_AHEAD", "3"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+
+DUE_SOON = "due_soon"
+OVERDUE = "overdue"
+
+
+class DueDateIndex:
+    """Open loans sorted by due date. Not thread-safe; callers hold _lock."""
+
+    def __init__(self):
+        self._entries = []
+        self._loans = {}
+
+    def __len__(self):
+        return len(self._loans)
+
+    def add(self, loan_id: int, user_id: int, due_date: date):
+        self.remove(loan_id)
+        bisect.insort(self._entries, (due_date, loan_id))
+        self._loans[loan_id] = (user_id, due_date)
+
+    def remove(self, loan_id: int):
+        entry = self._loans.pop(loan_id, None)
+        if entry is None:
+            return
+        key = (entry[1], loan_id)
+        position = bisect.bisect_left(self._entries, key)
+        if position < len(self._entries) and self._entries[position] == key:
+            del self._entries[position]
+
+    def between(self, start: Optional[date], end: Optional[date]) -> List[tuple]:
+        """(loan_id, user_id, due_date) for start <= due_date < end, earliest first."""
+        low = 0 if start is None else bisect.bisect_left(self._entries, (start,))
+        high = len(self._entries) if end is None else bisect.bisect_left(self._entries, (end,))
+        return [(loan_id, self._loans[loan_id][0], due_date) for due_date, loan_id in self._entries[low:high]]
+
+
+_lock = threading.Lock()
+_index = DueDateIndex()
+_loaded_at = None
+# One dict per load in progress, recording writes the loader's snapshot may
+# have missed; they are replayed onto the new index before it is swapped in.
+_recorders = []
+
+
+def track_loan(loan_id: int, user_id: int, due_date: date):
+    with _lock:
+        _index.add(loan_id, user_id, due_date)
+        for pending in _recorders:
+            pending[loan_id] = (user_id, due_date)
+
+
+def untrack_loan(loan_id: int):
+    with _lock:
+        _index.remove(loan_id)
+        for pending in _recorders:
+            pending[loan_id] = None
+
+
+def _ensure_index_loaded(db: Session):
+    global _index, _loaded_at
+    with _lock:
+        if _loaded_at is not None and time.monotonic() - _loaded_at < DUE_INDEX_REFRESH_SECONDS:
+            return
+        pending = {}
+        _recorders.append(pending)
+
+    # The query runs without the lock, so reads keep being served from the old
+    # index meanwhile. app.async_crud runs this in a thread (load_index).
+    try:
+        fresh = DueDateIndex()
+        rows = db.execute(
+            select(models.Loan.loan_id, models.Loan.user_id, models.Loan.loan_due_date)
+            .where(models.Loan.return_date.is_(None))
+            .execution_options(yield_per=5000)
+        )
+        for loan_id, user_id, due_date in rows:
+            fresh.add(loan_id, user_id, due_date)
+    finally:
+        with _lock:
+            _recorders.remove(pending)
+
+    with _lock:
+        for loan_id, entry in pending.items():
+            if entry is None:
+                fresh.remove(loan_id)
+            else:
+                fresh.add(loan_id, *entry)
+        _index = fresh
+        _loaded_at = time.monotonic()
+
+
+def needs_load() -> bool:
+    """Whether the next overdue or due-soon read would first (re)load the index."""
+    with _lock:
+        return _loaded_at is None or time.monotonic() - _loaded_at >= DUE_INDEX_REFRESH_SECONDS
+
+
+def load_index():
+    """(Re)load the index on a session of its own; for callers that must not block (app.async_crud)."""
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        _ensure_index_loaded(db)
+    finally:
+        db.close()
+
+
+def invalidate_index():
+    """Force the next read to rebuild the index from the database."""
+    global _loaded_at
+    with _lock:
+        _loaded_at = None
+
+
+def overdue_loans(db: Session, today: Optional[date] = None) -> List[tuple]:
+    _ensure_index_loaded(db)
+    with _lock:
+        return _index.between(None, today or date.today())
+
+
+def loans_due_soon(db: Session, days_ahead: int = NOTIFY_DAYS_AHEAD, today: Optional[date] = None) -> List[tuple]:
+    today = today or date.today()
+    _ensure_index_loaded(db)
+    with _lock:
+        return _index.between(today, today + timedelta(days=days_ahead + 1))
+
+
+# (loan_id, event_type) pairs this process already wrote to the outbox.
+_emitted = set()
+
+
+def _insert_ignoring_duplicates(db: Session, rows: List[dict]):
+    outbox = models.NotificationOutbox.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        existing = set(
+            db.execute(
+                select(outbox.c.loan_id, outbox.c.event_type)
+                .where(outbox.c.loan_id.in_({row["loan_id"] for row in rows}))
+            ).all()
+        )
+        rows = [row for row in rows if (row["loan_id"], row["event_type"]) not in existing]
+        if rows:
+            db.execute(insert(outbox), rows)
+        return
+    db.execute(dialect_insert(outbox).on_conflict_do_nothing(index_elements=["loan_id", "event_type"]), rows)
+
+
+def emit_due_notifications(db: Session, today: Optional[date] = None, days_ahead: int = NOTIFY_DAYS_AHEAD) -> int:
+    """Write outbox rows for loans that became due-soon or overdue; returns how many were new here."""
+    global _emitted
+    today = today or date.today()
+    candidates = [(loan, OVERDUE) for loan in overdue_loans(db, today)]
+    candidates += [(loan, DUE_SOON) for loan in loans_due_soon(db, days_ahead, today)]
+
+    open_ids = {loan[0] for loan, _ in candidates}
+    _emitted = {key for key in _emitted if key[0] in open_ids}
+    new = [(loan, event_type) for loan, event_type in candidates if (loan[0], event_type) not in _emitted]
+
+    emitted = 0
+    now = datetime.utcnow()
+    for start in range(0, len(new), NOTIFY_BATCH_SIZE):
+        chunk = new[start:start + NOTIFY_BATCH_SIZE]
+        # The index may lag returns made by other workers until its next rebuild.
+        still_open = set(
+            db.execute(
+                select(models.Loan.loan_id)
+                .where(
+                    models.Loan.loan_id.in_({loan[0] for loan, _ in chunk}),
+                    models.Loan.return_date.is_(None)
+                )
+            ).scalars()
+        )
+        rows = [
+            {"loan_id": loan_id, "user_id": user_id, "event_type": event_type,
+             "due_date": due_date, "created_at": now}
+            for (loan_id, user_id, due_date), event_type in chunk if loan_id in still_open
+        ]
+        if rows:
+            _insert_ignoring_duplicates(db, rows)
+        db.commit()
+        _emitted.update((loan[0], event_type) for loan, event_type in chunk)
+        emitted += len(rows)
+    return emitted
+
+
+class NotificationScheduler:
+    def __init__(self, interval: float = NOTIFY_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="notification-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        from app.database import SessionLocal
+
+        while True:
+            db = SessionLocal()
+            try:
+                emitted = emit_due_notifications(db)
+                if emitted:
+                    logger.info("Queued %d due-date notifications", emitted)
+            except Exception:
+                logger.exception("Due-date notification run failed")
+            finally:
+                db.close()
+            if self._stop.wait(self.interval):
+                return
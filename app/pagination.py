@@ -0,0 +1,21 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return values
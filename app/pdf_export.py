@@ -0,0 +1,173 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.cache import LRUCache
+from app.metrics import Counter, cache_collector
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# Renders allowed to wait for a pool worker before new ones get a 503.
+PDF_QUEUE = int(os.getenv("PDF_QUEUE", "16"))
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "128"))
+# Export jobs (and their documents) are deleted this long after they were started.
+PDF_JOB_TTL_SECONDS = int(os.getenv("PDF_JOB_TTL_SECONDS", "3600"))
+
+# Rendered documents keyed by (user_id, loan-set version).
+pdf_cache = LRUCache(maxsize=PDF_CACHE_SIZE)
+cache_collector("pdf_cache", pdf_cache)
+rejected_total = Counter("pdf_render_rejected_total", "PDF renders rejected because the render queue was full")
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PDF_WORKERS + PDF_QUEUE)
+# Job results are written here rather than in the render future's done
+# callback, which runs on the process pool's management thread and swallows
+# whatever it raises.
+_job_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-jobs")
+
+
+def render_loans_pdf(rows) -> bytes:
+    """Render (loan_id, book_name, due, returned, fine) rows. Runs in a worker process."""
+    # Imported here so web workers never load ReportLab; only the render pool does.
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+
+    y = height - 40
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawString(40, y, "Loan History")
+    y -= 30
+
+    pdf.setFont("Helvetica", 10)
+    for loan_id, book_name, loan_due_date, return_date, loan_fine in rows:
+        due = str(loan_due_date)
+        returned = str(return_date) if return_date else "-"
+        fine = str(loan_fine or "0.00")
+        line = f"{loan_id}: {book_name} | Due: {due} | Returned: {returned} | Fine: ${fine}"
+        pdf.drawString(40, y, line)
+        y -= 18
+        if y < 50:
+            pdf.showPage()
+            y = height - 40
+            pdf.setFont("Helvetica", 10)
+
+    pdf.save()
+    buffer.seek(0)
+    return buffer.read()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent runs server threads that must not be copied.
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+
+def submit_render(db: Session, user_id: int) -> Future:
+    """Render the user's loan history in the process pool, reusing a cached copy
+    while the user's loans are unchanged. Blocking; call it from a worker thread.
+
+    Raises a 503 with Retry-After when PDF_WORKERS + PDF_QUEUE renders are
+    already in flight.
+    """
+    key = (user_id, crud.get_user_loans_version(db, user_id))
+    cached = pdf_cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    if not _slots.acquire(blocking=False):
+        rejected_total.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="PDF export is busy, please retry.",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        rows = [tuple(row) for row in crud.get_user_loan_rows(db, user_id)]
+        future = _get_pool().submit(render_loans_pdf, rows)
+    except BaseException:
+        _slots.release()
+        raise
+
+    def store(done: Future):
+        _slots.release()
+        if not done.cancelled() and done.exception() is None:
+            pdf_cache.set(key, done.result())
+
+    future.add_done_callback(store)
+    return future
+
+
+def _record_job(job_id: str, **values):
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.query(models.PdfExportJob).filter(models.PdfExportJob.job_id == job_id).update(
+            {**values, "finished_at": datetime.utcnow()}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _finish_job(job_id: str, future: Future):
+    failed = future.cancelled() or future.exception() is not None
+    try:
+        _record_job(job_id, status="failed" if failed else "done", pdf=None if failed else future.result())
+    except Exception:
+        logger.exception("Could not store the result of PDF export job %s", job_id)
+        if not failed:
+            # Without this, clients would poll a job that stays "pending".
+            try:
+                _record_job(job_id, status="failed", pdf=None)
+            except Exception:
+                logger.exception("Could not mark PDF export job %s as failed", job_id)
+
+
+def create_job(db: Session, user_id: int) -> str:
+    """Start a background export; its state lives in pdf_export_jobs, so any worker can report it."""
+    jobs = models.PdfExportJob
+    db.query(jobs).filter(
+        jobs.created_at < datetime.utcnow() - timedelta(seconds=PDF_JOB_TTL_SECONDS)
+    ).delete(synchronize_session=False)
+
+    future = submit_render(db, user_id)
+    job_id = uuid.uuid4().hex
+    db.add(jobs(job_id=job_id, user_id=user_id, status="pending", created_at=datetime.utcnow()))
+    db.commit()
+    # Runs right away for a cached document; otherwise once the pool is done.
+    future.add_done_callback(lambda done: _job_writer.submit(_finish_job, job_id, done))
+    return job_id
+
+
+def get_job(db: Session, job_id: str, user_id: int) -> Optional[models.PdfExportJob]:
+    return (
+        db.query(models.PdfExportJob)
+        .filter(models.PdfExportJob.job_id == job_id, models.PdfExportJob.user_id == user_id)
+        .populate_existing()
+        .first()
+    )
@@ -1,21 +1,45 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, File, status, HTTPException, Query, Request, Response, UploadFile
 from sqlalchemy.orm import Session
-from app import schemas, crud, models
+from app import availability, schemas, crud, fines, pdf_export, security
 from typing import List, Optional
-from app.database import get_db
+from app.database import get_db, get_pool_stats, SessionLocal
 from fastapi.security import OAuth2PasswordRequestForm
 from app.auth import create_access_token
-from app.crud import authenticate_user, generate_user_loans_csv, generate_user_loans_pdf
-from datetime import timedelta
-from app.dependencies import get_current_user
+from app.crud import generate_user_loans_csv, generate_all_loans_csv
+from datetime import date, timedelta
+from app.dependencies import (
+    check_catalog_etag,
+    get_catalog_read_db,
+    get_current_reader,
+    get_current_user,
+    get_read_db,
+    pin_reads_to_primary,
+    principal_cache,
+    read_session_factory,
+)
 from app.models import User
 from app.schemas import LoanWithBookUser
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+from app.metrics import render_prometheus
+from app.pagination import encode_cursor, decode_cursor
+from app.serialization import FastJSONResponse, accepts_gzip, ndjson_response, wants_ndjson
 
 
 router = APIRouter()
 
 
+def stream_with_session(generator, *args, session_factory=SessionLocal, **kwargs):
+    # Dependencies with yield are torn down before a streamed body is sent,
+    # so streamed exports open and own their session for the whole response.
+    db = session_factory()
+    try:
+        yield from generator(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
 @router.post("/books/", response_model=schemas.BookConfig)
 def created_book(book: schemas.BookCreate,
                  db: Session = Depends(get_db),
@@ -39,14 +63,164 @@ def update_book(
     return crud.partial_update_book(db, book_id, book_data)
 
 
-@router.get("/books/", response_model=List[schemas.BookConfig])
-def read_all_books(db: Session = Depends(get_db)):
-    return crud.get_books(db)
+BOOK_PAGE_SIZE = 100
+
+
+def parse_book_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    after_id = decode_cursor(cursor).get("book_id")
+    if not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return after_id
+
+
+def parse_book_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    columns = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in columns if field not in crud.BOOK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def book_page(books, limit: int, response: Response):
+    # Callers fetch limit + 1 rows so we know whether another page exists.
+    headers = dict(response.headers)
+    if len(books) > limit:
+        books = books[:limit]
+        headers["X-Next-Cursor"] = encode_cursor({"book_id": books[-1]["book_id"]})
+
+    # Rows are already shaped like BookConfig (or its projection), so they
+    # are encoded directly instead of being validated model by model.
+    return FastJSONResponse(books, headers=headers)
+
+
+def stream_ndjson(request: Request, response: Response, generator, *args, catalog_read: bool = False, **kwargs):
+    return ndjson_response(
+        stream_with_session(generator, *args, session_factory=read_session_factory(request, catalog_read), **kwargs),
+        gzip=accepts_gzip(request),
+        headers=dict(response.headers)
+    )
+
+
+@router.get("/books/", response_model=List[schemas.BookConfig], dependencies=[Depends(check_catalog_etag)])
+def read_all_books(
+        request: Request,
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        db: Session = Depends(get_catalog_read_db)
+):
+    columns = parse_book_fields(fields)
+    after_id = parse_book_cursor(cursor)
+    # Accept: application/x-ndjson streams every book after the cursor
+    # unless a limit is given; JSON pages default to 100 books.
+    if wants_ndjson(request):
+        return stream_ndjson(request, response, crud.iter_books, after_id, columns, limit, catalog_read=True)
+
+    limit = limit or BOOK_PAGE_SIZE
+    books = crud.get_books(db, limit + 1, after_id, columns)
+    return book_page(books, limit, response)
+
+
+@router.post("/admin/books/import", response_model=schemas.BookImportResult)
+def import_books(
+        file: UploadFile = File(...),
+        format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only Administrator users can import books.")
+
+    if format is None:
+        name = (file.filename or "").lower()
+        if name.endswith(".csv") or file.content_type == "text/csv":
+            format = "csv"
+        elif name.endswith((".ndjson", ".jsonl")) or file.content_type in ("application/x-ndjson", "application/jsonl"):
+            format = "ndjson"
+        else:
+            raise HTTPException(status_code=400, detail="Unknown import format; pass format=csv or format=ndjson.")
+
+    # The upload is spooled to disk by Starlette and parsed row by row.
+    return crud.import_books(db, crud.parse_book_import(file.file, format))
+
+
+def parse_known_availability(known: Optional[str]) -> Optional[dict]:
+    # "book_id:available,..." as last seen by the client.
+    if known is None:
+        return None
+    try:
+        return {int(book_id): int(available) for book_id, available in (
+            pair.split(":") for pair in known.split(",") if pair
+        )}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="known must look like 12:0,15:3")
+
+
+async def open_availability(book_ids: List[int]) -> availability.Subscription:
+    if len(set(book_ids)) > availability.AVAILABILITY_MAX_BOOKS:
+        raise HTTPException(status_code=400, detail=f"At most {availability.AVAILABILITY_MAX_BOOKS} books per subscription.")
+    # Subscribe before reading so a change between the read and the wait still wakes us.
+    subscription = availability.Subscription(book_ids).open()
+    try:
+        counts = await run_in_threadpool(availability.current_counts, subscription.book_ids)
+        missing = [book_id for book_id in subscription.book_ids if book_id not in counts]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Books not found: {', '.join(map(str, missing))}")
+    except BaseException:
+        subscription.close()
+        raise
+    subscription.seed(counts)
+    return subscription
+
+
+# Registered before /books/{name}; these paths have three segments, so the
+# async router's /books/{name} never captures them either.
+@router.get("/books/availability/poll", response_model=List[schemas.BookAvailability])
+async def poll_book_availability(
+        book_id: List[int] = Query(...),
+        known: Optional[str] = None,
+        timeout: float = Query(30, ge=0, le=60)
+):
+    # Without `known` the current counts are returned at once; with it the
+    # request waits up to `timeout` seconds for any of them to differ.
+    known_counts = parse_known_availability(known)
+    subscription = await open_availability(book_id)
+    try:
+        if known_counts is not None:
+            await subscription.changes(known_counts, timeout)
+        counts = subscription.snapshot()
+    finally:
+        subscription.close()
+    return [{"book_id": book, "number_available_volumes": available} for book, available in counts.items()]
+
+
+@router.get("/books/availability/stream")
+async def stream_book_availability(
+        book_id: List[int] = Query(...),
+        timeout: float = Query(300, gt=0, le=3600)
+):
+    # Server-sent events: the current counts, then one event per change,
+    # until `timeout` seconds have passed and the client reconnects.
+    subscription = await open_availability(book_id)
+    return StreamingResponse(
+        availability.sse_events(subscription, timeout),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
-@router.get("/books/{name}", response_model=List[schemas.BookConfig])
-def read_book_by_name(name: str, db: Session = Depends(get_db)):
-    books = crud.get_book_by_name(db, name)
+@router.get("/books/{name}", response_model=List[schemas.BookConfig], dependencies=[Depends(check_catalog_etag)])
+def read_book_by_name(
+        name: str,
+        limit: int = Query(20, ge=1, le=100),
+        db: Session = Depends(get_catalog_read_db)
+):
+    books = crud.get_book_by_name(db, name, limit)
     if not books:
         raise HTTPException(status_code=404, detail="No books found")
     return books
@@ -61,29 +235,40 @@ def get_user(name: str, db: Session = Depends(get_db)):
 
 
 @router.post("/register", response_model=schemas.UserConfig)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_user = crud.get_user_by_username(db, user.username)
+async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    existing_user = await run_in_threadpool(crud.get_user_by_username, db, user.username)
     if existing_user:
         raise HTTPException(
             status_code=400,
             detail="Username already taken."
         )
-    return crud.create_user(db, user)
+    # bcrypt runs on the dedicated password pool, not on a request thread.
+    hashed_pw = await security.hash_password_async(user.password)
+    return await run_in_threadpool(crud.create_user, db, user, hashed_pw)
 
 
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
         db: Session = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await run_in_threadpool(crud.get_user_by_username, db, form_data.username)
 
-    if not user:
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await security.verify_and_update_password(form_data.password, user.hashed_password)
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrent username or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
+
+    # The stored hash used a different bcrypt cost; upgrade it transparently.
+    if new_hash:
+        await run_in_threadpool(crud.update_password_hash, db, user, new_hash)
+
     access_token_expires = timedelta(minutes=30)
 
     access_token = create_access_token(
@@ -108,22 +293,54 @@ def delete_book(
 @router.post("/loans/", response_model=schemas.LoanConfig)
 def borrow_book(
     loan: schemas.LoanCreate,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     if current_user.user_id != loan.user_id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="You can't borrow a book for another user.")
-    return crud.create_loan(db, loan)
+    result = crud.create_loan(db, loan)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+# Registered before /loans/{loan_id}/return so "batch" is never parsed as a loan id.
+@router.post("/loans/batch", response_model=List[schemas.LoanBatchItem])
+def borrow_books_batch(
+    batch: schemas.LoanBatchCreate,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_id != batch.user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="You can't borrow a book for another user.")
+    result = crud.create_loans_batch(db, batch)
+    pin_reads_to_primary(response, current_user.username)
+    return result
+
+
+@router.post("/loans/batch/return", response_model=List[schemas.LoanBatchItem])
+def return_books_batch(
+    batch: schemas.LoanBatchReturn,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    owner_id = None if current_user.is_admin else current_user.user_id
+    result = crud.return_loans_batch(db, batch, owner_id)
+    pin_reads_to_primary(response, current_user.username)
+    return result
 
 
 @router.post("/loans/{loan_id}/return", response_model=schemas.LoanConfig)
 def return_book(
     loan_id: int,
     return_data: schemas.LoanReturn,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    loan = db.query(models.Loan).filter(models.Loan.loan_id == loan_id).first()
+    loan = crud.get_loan(db, loan_id)
 
     if not loan:
         raise HTTPException(status_code=404, detail="Loan not found.")
@@ -131,21 +348,23 @@ def return_book(
     if loan.user_id != current_user.user_id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="You can't return another user's loan.")
 
-    return crud.return_loan(db, loan_id, return_data)
+    result = crud.return_loan(db, loan_id, return_data)
+    pin_reads_to_primary(response, current_user.username)
+    return result
 
 
 @router.get("/loans/me", response_model=List[LoanWithBookUser])
 def get_my_loans(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader)
 ):
     return crud.get_loans_by_user(db, current_user.user_id)
 
 
 @router.get("/loans/overdue", response_model=List[LoanWithBookUser])
 def get_overdue_loans(
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        db: Session = Depends(get_read_db),
+        current_user: User = Depends(get_current_reader)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Administrator users only.")
@@ -155,8 +374,8 @@ def get_overdue_loans(
 
 @router.get("/notifications/due-soon", response_model=List[LoanWithBookUser])
 def get_due_soon_loans(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Administrator users only.")
@@ -164,53 +383,236 @@ def get_due_soon_loans(
     return crud.get_loans_due_soon(db)
 
 
-@router.get("/loans/history", response_model=List[LoanWithBookUser])
-def get_loan_history(
+LOAN_HISTORY_PAGE_SIZE = 100
+LOAN_HISTORY_MAX_PAGE_SIZE = 1000
+
+
+def loan_history_filters(
     user_id: Optional[int] = None,
+    book_id: Optional[int] = None,
     returned: Optional[bool] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    overdue: bool = False,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> dict:
+    return {
+        "user_id": user_id,
+        "book_id": book_id,
+        "returned": returned,
+        "overdue": overdue,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+
+
+def parse_loan_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if not cursor:
+        return None
+    values = decode_cursor(cursor)
+    loan_id = values.get("loan_id")
+    try:
+        due_date = date.fromisoformat(values.get("loan_due_date"))
+    except (TypeError, ValueError):
+        due_date = None
+    if due_date is None or not isinstance(loan_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return due_date, loan_id
+
+
+def loan_page(loans, limit: int, response: Response):
+    # Callers fetch limit + 1 rows so we know whether another page exists.
+    headers = dict(response.headers)
+    if len(loans) > limit:
+        loans = loans[:limit]
+        last = loans[-1]
+        headers["X-Next-Cursor"] = encode_cursor({
+            "loan_due_date": last["loan_due_date"].isoformat(), "loan_id": last["loan_id"]
+        })
+    return FastJSONResponse(loans, headers=headers)
+
+
+@router.get("/loans/history", response_model=List[LoanWithBookUser])
+def get_loan_history(
+    request: Request,
+    response: Response,
+    filters: dict = Depends(loan_history_filters),
+    limit: Optional[int] = Query(None, ge=1, le=LOAN_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    estimate_count: bool = False,
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_reader)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admins only.")
 
-    return crud.get_loan_history(db, user_id, returned)
+    after = parse_loan_cursor(cursor)
+    # Accept: application/x-ndjson streams every matching loan after the
+    # cursor unless a limit is given; JSON pages default to 100 loans.
+    if wants_ndjson(request):
+        return stream_ndjson(request, response, crud.iter_loan_history, limit=limit, after=after, **filters)
+
+    limit = limit or LOAN_HISTORY_PAGE_SIZE
+    if estimate_count:
+        response.headers["X-Total-Count-Estimate"] = str(crud.estimate_loan_history_count(db, **filters))
+    loans = crud.get_loan_history(db, limit + 1, after=after, **filters)
+    return loan_page(loans, limit, response)
 
 
 @router.get("/loans/me/export")
 def export_loans_csv(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: User = Depends(get_current_user)
 ):
-    csv_data = generate_user_loans_csv(db, current_user.user_id)
-
     return StreamingResponse(
-        iter([csv_data]),
+        stream_with_session(generate_user_loans_csv, current_user.user_id,
+                            session_factory=read_session_factory(request)),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=loan_history.csv"}
     )
 
 
 @router.get("/loans/me/export/pdf")
-def export_loans_pdf(
+async def export_loans_pdf(
+    current_user: User = Depends(get_current_reader),
+    db: Session = Depends(get_read_db)
+):
+    # Rendering runs in the PDF process pool; awaiting it keeps request
+    # threads free for the other endpoints.
+    future = await run_in_threadpool(pdf_export.submit_render, db, current_user.user_id)
+    pdf_bytes = await asyncio.wrap_future(future)
+
+    return StreamingResponse(
+        iter([pdf_bytes]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": "attachment; filename=loan_history.pdf"}
+    )
+
+
+@router.post("/loans/me/export/pdf/jobs", response_model=schemas.PdfExportJob, status_code=202)
+def create_pdf_export_job(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = pdf_export.get_job(db, pdf_export.create_job(db, current_user.user_id), current_user.user_id)
+    return {"job_id": job.job_id, "status": job.status}
+
+
+@router.get("/loans/me/export/pdf/jobs/{job_id}", response_model=schemas.PdfExportJob)
+def get_pdf_export_job(
+    job_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    pdf_bytes = generate_user_loans_pdf(db, current_user.user_id)
+    job = pdf_export.get_job(db, job_id, current_user.user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found.")
+    return {"job_id": job.job_id, "status": job.status}
+
+
+@router.get("/loans/me/export/pdf/jobs/{job_id}/download")
+def download_pdf_export_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = pdf_export.get_job(db, job_id, current_user.user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found.")
+
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail="Export job failed.")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Export job is not finished yet.")
 
     return StreamingResponse(
-        iter([pdf_bytes]),
+        iter([job.pdf]),
         media_type="application/pdf",
         headers={"Content-Disposition": "attachment; filename=loan_history.pdf"}
     )
 
 
+@router.get("/admin/auth/metrics")
+def get_auth_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrator users only.")
+
+    return {
+        "password_hashing": security.get_password_metrics(),
+        "principal_cache": principal_cache.stats()
+    }
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Unauthenticated like any Prometheus target; keep it off the public listener.
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/admin/pool")
+def get_database_pool_stats(
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrator users only.")
+
+    return get_pool_stats()
+
+
+@router.get("/admin/loans/export")
+def export_all_loans_csv(
+    request: Request,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrator users only.")
+
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date.")
+
+    return StreamingResponse(
+        stream_with_session(generate_all_loans_csv, start_date, end_date,
+                            session_factory=read_session_factory(request)),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=all_loans.csv"}
+    )
+
+
 @router.get("/admin/stats")
 def get_dashboard_stats(
     current_user: User = Depends(get_current_user),
+    # The primary: in counters mode a stale read reconciles, which writes.
     db: Session = Depends(get_db)
 ):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Only administrators can view dashboard stats.")
 
     return crud.get_admin_dashboard_stats(db)
+
+
+@router.get("/users/{user_id}/fines", response_model=schemas.UserFines)
+def get_user_fines(
+    user_id: int,
+    limit: int = Query(20, ge=0, le=100),
+    current_user: User = Depends(get_current_reader),
+    db: Session = Depends(get_read_db)
+):
+    if current_user.user_id != user_id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="You can only view your own fines.")
+
+    return fines.get_user_fines(db, user_id, limit)
+
+
+@router.get("/admin/fines/liability", response_model=schemas.FineLiability)
+def get_fine_liability(
+    current_user: User = Depends(get_current_reader),
+    db: Session = Depends(get_read_db)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Only administrators can view fine liability.")
+
+    return fines.get_fine_liability(db)
+
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from datetime import date
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import date, datetime
+from typing import List, Optional
 from decimal import Decimal
 
 
@@ -54,6 +54,11 @@ class BookConfig(BookBase):
     }
 
 
+class BookAvailability(BaseModel):
+    book_id: int
+    number_available_volumes: int
+
+
 class LoanBase(BaseModel):
     user_id: int
     book_id: int
@@ -78,29 +83,71 @@ class LoanConfig(LoanBase):
     }
 
 
-class LoanWithBookUser(LoanConfig):
-    user: UserConfig
-    book: BookConfig
-
+LOAN_BATCH_MAX_ITEMS = 100
 
 
+class LoanBatchCreate(BaseModel):
+    user_id: int
+    book_ids: List[int] = Field(..., min_length=1, max_length=LOAN_BATCH_MAX_ITEMS)
+    loan_due_date: Optional[date] = None
 
 
+class LoanBatchReturn(BaseModel):
+    loan_ids: List[int] = Field(..., min_length=1, max_length=LOAN_BATCH_MAX_ITEMS)
+    return_date: Optional[date] = None
 
 
+class LoanBatchItem(BaseModel):
+    book_id: Optional[int] = None
+    loan_id: Optional[int] = None
+    status: str
+    detail: Optional[str] = None
+    loan: Optional[LoanConfig] = None
 
 
+class LoanWithBookUser(LoanConfig):
+    user: UserConfig
+    book: BookConfig
 
 
+class PdfExportJob(BaseModel):
+    job_id: str
+    status: str
 
 
+class BookImportError(BaseModel):
+    row: int
+    errors: List[str]
 
 
+class BookImportResult(BaseModel):
+    processed: int
+    inserted: int
+    updated: int
+    error_count: int
+    errors: List[BookImportError]
 
 
+class FineLedgerEntry(BaseModel):
+    entry_id: int
+    loan_id: int
+    accrual_date: date
+    entry_type: str
+    amount: Decimal
 
+    model_config = {
+        "from_attributes": True
+    }
 
 
+class UserFines(BaseModel):
+    user_id: int
+    balance: Decimal
+    updated_at: Optional[datetime] = None
+    entries: List[FineLedgerEntry]
 
 
+class FineLiability(BaseModel):
+    total_liability: Decimal
+    users_with_balance: int
 
@@ -0,0 +1,226 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import List
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Same default cut-off pg_trgm uses for its % operator.
+MIN_SIMILARITY = 0.3
+# Author matches rank below title matches of the same quality.
+AUTHOR_WEIGHT = 0.8
+
+SEARCH_FIELDS = ("book_name", "book_author")
+
+# The in-process index is rebuilt this often so books written by other worker
+# processes show up, and renamed ones are ranked by their current title.
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "60"))
+
+
+def trigrams(text: str) -> set:
+    """Split text into word trigrams, padded the same way pg_trgm pads them."""
+    grams = set()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """In-process inverted trigram index over book titles and authors.
+
+    Used when the database has no trigram support (SQLite, tests). Lookups
+    only touch the posting lists of the query's trigrams, so their cost does
+    not grow with the size of the catalog.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {field: defaultdict(set) for field in SEARCH_FIELDS}
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, book_id: int, book_name: str, book_author: str):
+        document = {
+            "book_name": (book_name.lower(), trigrams(book_name)),
+            "book_author": (book_author.lower(), trigrams(book_author)),
+        }
+        with self._lock:
+            self._discard(book_id)
+            self._documents[book_id] = document
+            for field, (_, grams) in document.items():
+                for gram in grams:
+                    self._postings[field][gram].add(book_id)
+
+    def remove(self, book_id: int):
+        with self._lock:
+            self._discard(book_id)
+
+    def _discard(self, book_id: int):
+        document = self._documents.pop(book_id, None)
+        if document is None:
+            return
+        for field, (_, grams) in document.items():
+            postings = self._postings[field]
+            for gram in grams:
+                postings[gram].discard(book_id)
+                if not postings[gram]:
+                    del postings[gram]
+
+    def _substring_candidates(self, field: str, needle: str) -> set:
+        # A document containing the needle contains every trigram inside its
+        # words; needles too short for one leave every document a candidate.
+        grams = {word[i:i + 3] for word in re.findall(r"\w+", needle) for i in range(len(word) - 2)}
+        if not grams:
+            return set(self._documents)
+        postings = self._postings[field]
+        return set.intersection(*(postings.get(gram, set()) for gram in grams))
+
+    def search(self, term: str, limit: int) -> List[int]:
+        """Books whose title or author contains term or is similar to it; substring matches first.
+
+        The same rule as the PostgreSQL query in search_books.
+        """
+        needle = term.lower()
+        if not needle.strip():
+            return []
+        query_grams = trigrams(term)
+
+        with self._lock:
+            scores = {}
+            for field in SEARCH_FIELDS:
+                weight = 1.0 if field == "book_name" else AUTHOR_WEIGHT
+                hits = Counter()
+                for gram in query_grams:
+                    hits.update(self._postings[field].get(gram, ()))
+                for book_id, count in hits.items():
+                    score = weight * count / len(query_grams)
+                    scores[book_id] = max(scores.get(book_id, 0.0), score)
+
+            exact = {
+                book_id
+                for field in SEARCH_FIELDS
+                for book_id in self._substring_candidates(field, needle)
+                if needle in self._documents[book_id][field][0]
+            }
+            similar = {book_id for book_id, score in scores.items() if score >= MIN_SIMILARITY}
+            ranked = [(book_id not in exact, -scores.get(book_id, 0.0), book_id) for book_id in exact | similar]
+
+        ranked.sort()
+        return [book_id for _, _, book_id in ranked[:limit]]
+
+
+_lock = threading.Lock()
+_index = TrigramIndex()
+_loaded_at = None
+# One dict per load in progress, recording writes the loader's snapshot may
+# have missed; they are replayed onto the new index before it is swapped in.
+_recorders = []
+
+
+def _uses_pg_trgm(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _is_stale() -> bool:
+    return _loaded_at is None or time.monotonic() - _loaded_at >= SEARCH_INDEX_REFRESH_SECONDS
+
+
+def _ensure_index_loaded(db: Session):
+    global _index, _loaded_at
+    with _lock:
+        if not _is_stale():
+            return
+        pending = {}
+        _recorders.append(pending)
+
+    # The query runs without the lock, so searches keep being served from the
+    # old index meanwhile. app.async_crud loads it in a thread (load_index).
+    try:
+        fresh = TrigramIndex()
+        rows = (
+            db.query(models.Book.book_id, models.Book.book_name, models.Book.book_author)
+            .yield_per(5000)
+        )
+        for book_id, book_name, book_author in rows:
+            fresh.add(book_id, book_name, book_author)
+    finally:
+        with _lock:
+            _recorders.remove(pending)
+
+    with _lock:
+        for book_id, entry in pending.items():
+            if entry is None:
+                fresh.remove(book_id)
+            else:
+                fresh.add(book_id, *entry)
+        _index = fresh
+        _loaded_at = time.monotonic()
+
+
+def needs_load(db: Session) -> bool:
+    """Whether the next search through db would first (re)load the in-process index."""
+    if _uses_pg_trgm(db):
+        return False
+    with _lock:
+        return _is_stale()
+
+
+def load_index():
+    """(Re)load the in-process index on a session of its own; for callers that must not block (app.async_crud)."""
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        _ensure_index_loaded(db)
+    finally:
+        db.close()
+
+
+def index_book(db: Session, book: models.Book):
+    if _uses_pg_trgm(db):
+        return
+    with _lock:
+        _index.add(book.book_id, book.book_name, book.book_author)
+        for pending in _recorders:
+            pending[book.book_id] = (book.book_name, book.book_author)
+
+
+def remove_book(db: Session, book_id: int):
+    if _uses_pg_trgm(db):
+        return
+    with _lock:
+        _index.remove(book_id)
+        for pending in _recorders:
+            pending[book_id] = None
+
+
+def search_books(db: Session, term: str, limit: int):
+    if _uses_pg_trgm(db):
+        # Served by the GIN trigram indexes declared on models.Book.
+        name, author = models.Book.book_name, models.Book.book_author
+        exact = or_(name.icontains(term, autoescape=True), author.icontains(term, autoescape=True))
+        score = func.greatest(func.similarity(name, term), func.similarity(author, term) * AUTHOR_WEIGHT)
+        return (
+            db.query(models.Book)
+            .filter(or_(exact, name.op("%")(term), author.op("%")(term)))
+            .order_by(exact.desc(), score.desc(), models.Book.book_id)
+            .limit(limit)
+            .all()
+        )
+
+    _ensure_index_loaded(db)
+    book_ids = _index.search(term, limit)
+    if not book_ids:
+        return []
+
+    books = db.query(models.Book).filter(models.Book.book_id.in_(book_ids)).all()
+    position = {book_id: i for i, book_id in enumerate(book_ids)}
+    return sorted(books, key=lambda book: position[book.book_id])
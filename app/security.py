@@ -1,6 +1,38 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.metrics import Counter, Histogram
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+# min/max pinned to the configured cost so hashes made with any other cost
+# are flagged by verify_and_update and rehashed on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+hash_seconds = Histogram("password_hash_seconds", "Time spent computing bcrypt hashes")
+verify_seconds = Histogram("password_verify_seconds", "Time spent verifying bcrypt hashes")
+queue_seconds = Histogram("password_queue_seconds", "Time password jobs waited for a hashing worker")
+rejected_total = Counter("password_rejected_total", "Password jobs rejected because the hashing queue was full")
+
+# bcrypt releases the GIL, so a small dedicated thread pool gives real
+# parallelism while keeping password work off the request threadpool.
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
 
 
 def hash_password(password: str) -> str:
@@ -11,3 +43,51 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     result = pwd_context.verify(plain_password, hashed_password)
     return result
 
+
+def _run_timed(histogram: Histogram, queued_at: float, fn, *args):
+    started = time.perf_counter()
+    queue_seconds.observe(started - queued_at)
+    try:
+        return fn(*args)
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def _submit(histogram: Histogram, fn, *args) -> Future:
+    if not _slots.acquire(blocking=False):
+        rejected_total.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry.",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        future = _executor.submit(_run_timed, histogram, time.perf_counter(), fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.wrap_future(_submit(hash_seconds, pwd_context.hash, password))
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await asyncio.wrap_future(
+        _submit(verify_seconds, pwd_context.verify_and_update, plain_password, hashed_password)
+    )
+
+
+def get_password_metrics() -> dict:
+    return {
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "queue_limit": PASSWORD_HASH_QUEUE,
+        "rejected": rejected_total.value,
+        "hash_seconds": hash_seconds.snapshot(),
+        "verify_seconds": verify_seconds.snapshot(),
+        "queue_seconds": queue_seconds.snapshot(),
+    }
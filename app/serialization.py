@@ -0,0 +1,72 @@
+"""Fast JSON encoding for large list responses.
+
+Rows are plain dicts built from column tuples and encoded with orjson,
+skipping per-object pydantic validation. The output matches what the
+pydantic response models produce: ISO dates, and Decimals as strings.
+"""
+import zlib
+from decimal import Decimal
+from typing import Iterable, Iterator
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows encoded per chunk handed to the server when streaming.
+NDJSON_CHUNK_ROWS = 500
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def _ndjson_chunks(rows: Iterable[dict]) -> Iterator[bytes]:
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= NDJSON_CHUNK_ROWS:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def _gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def ndjson_response(rows: Iterable[dict], gzip: bool = False, headers: dict = None) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON, one object per line."""
+    headers = dict(headers or {})
+    chunks = _ndjson_chunks(rows)
+    if gzip:
+        chunks = _gzipped(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=NDJSON_MEDIA_TYPE, headers=headers)
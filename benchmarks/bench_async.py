@@ -0,0 +1,103 @@
+"""Compare requests per second of the sync and async (DB_ASYNC) stacks.
+
+Seeds a catalog, then starts main:app under uvicorn once per mode and drives
+it with many concurrent clients over a read-heavy mix (catalog pages,
+title search, the caller's loans).
+
+    python benchmarks/bench_async.py --concurrency 200 --duration 15
+
+It uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_async.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from app import migrations, models
+from app.database import SessionLocal, engine
+from benchmarks.common import Server, format_summary, summarize
+
+WORDS = ["python", "history", "garden", "ocean", "systems", "poetry", "river", "design", "stars", "cooking"]
+
+
+def seed(books: int):
+    migrations.upgrade(engine)
+    # Unique per run, so reruns against one DATABASE_URL add new editions.
+    run = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    db.execute(models.Book.__table__.insert(), [
+        {
+            "book_name": f"{random.choice(WORDS).title()} {random.choice(WORDS)} {i} {run}",
+            "book_genre": "Bench",
+            "book_year": 2000 + i % 25,
+            "book_author": f"Author {i % 500}",
+            "book_language": "English",
+            "book_description": "x" * 200,
+            "number_available_volumes": 5,
+        }
+        for i in range(books)
+    ])
+    db.commit()
+    db.close()
+
+
+async def drive(url: str, concurrency: int, duration: float):
+    async with httpx.AsyncClient(base_url=url, timeout=30.0,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        credentials = {"username": "bench_async", "password": "benchpass"}
+        await client.post("/register", json={**credentials, "user_email": "bench_async@example.com"})
+        token = (await client.post("/token", data=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        requests = [
+            ("/books/?limit=50", None),
+            (lambda: f"/books/{random.choice(WORDS)}", None),
+            ("/loans/me", headers),
+        ]
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                path, request_headers = random.choice(requests)
+                path = path() if callable(path) else path
+                started = time.perf_counter()
+                response = await client.get(path, headers=request_headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 500:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - started, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed(args.books)
+    for mode, flag in (("sync", "false"), ("async", "true")):
+        with Server({"DB_ASYNC": flag}) as server:
+            latencies, elapsed, errors = asyncio.run(drive(server.url, args.concurrency, args.duration))
+        print(format_summary(f"{mode} (c={args.concurrency})", summarize(latencies, elapsed)) + f" errors={errors}")
+
+
+if __name__ == "__main__":
+    main()
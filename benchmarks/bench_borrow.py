@@ -0,0 +1,129 @@
+"""Concurrent borrow/return benchmark for crud.create_loan and crud.return_loan.
+
+Many threads borrow copies of one popular book until it runs out, then return
+them all. It reports throughput and latency percentiles for each phase and
+checks that no copy was ever oversold.
+
+    python benchmarks/bench_borrow.py --clients 100 --copies 500
+
+It uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_borrow.db")
+
+from fastapi import HTTPException
+from app import crud, migrations, models, schemas
+from app.database import SessionLocal, engine
+from benchmarks.common import format_summary, summarize
+
+
+def report(name, latencies, elapsed):
+    print(format_summary(name, summarize(latencies, elapsed)))
+
+
+def run_clients(clients, worker):
+    latencies = []
+    lock = threading.Lock()
+
+    def run():
+        mine = worker()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--copies", type=int, default=500)
+    args = parser.parse_args()
+
+    migrations.upgrade(engine)
+
+    # Unique per run, so reruns against one DATABASE_URL add a new user and edition.
+    run = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    user = models.User(username=f"bench_borrower_{run}", user_email=f"bench_{run}@example.com", hashed_password="-")
+    book = models.Book(
+        book_name=f"Bench Bestseller {run}", book_genre="Bench", book_year=2024, book_author="Bench",
+        book_language="English", number_available_volumes=args.copies
+    )
+    db.add_all([user, book])
+    db.commit()
+    user_id, book_id = user.user_id, book.book_id
+    db.close()
+
+    loan_ids = []
+    loan_ids_lock = threading.Lock()
+    rejected = []
+
+    def borrower():
+        latencies = []
+        session = SessionLocal()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    loan = crud.create_loan(session, schemas.LoanCreate(user_id=user_id, book_id=book_id))
+                except HTTPException as exc:
+                    latencies.append(time.perf_counter() - started)
+                    rejected.append(exc.status_code)
+                    return latencies
+                latencies.append(time.perf_counter() - started)
+                with loan_ids_lock:
+                    loan_ids.append(loan.loan_id)
+        finally:
+            session.close()
+
+    latencies, elapsed = run_clients(args.clients, borrower)
+    report("borrow", latencies, elapsed)
+
+    pending = list(loan_ids)
+
+    def returner():
+        latencies = []
+        session = SessionLocal()
+        try:
+            while True:
+                with loan_ids_lock:
+                    if not pending:
+                        return latencies
+                    loan_id = pending.pop()
+                started = time.perf_counter()
+                crud.return_loan(session, loan_id, schemas.LoanReturn())
+                latencies.append(time.perf_counter() - started)
+        finally:
+            session.close()
+
+    latencies, elapsed = run_clients(args.clients, returner)
+    report("return", latencies, elapsed)
+
+    db = SessionLocal()
+    available = db.query(models.Book.number_available_volumes).filter(models.Book.book_id == book_id).scalar()
+    loans = db.query(models.Loan).filter(models.Loan.book_id == book_id).count()
+    db.close()
+
+    assert len(loan_ids) == args.copies, f"{len(loan_ids)} loans for {args.copies} copies: oversold"
+    assert loans == args.copies, f"{loans} loan rows for {args.copies} copies"
+    assert set(rejected) == {400}, f"unexpected rejections: {set(rejected)}"
+    assert available == args.copies, f"{available} copies on the shelf after returns, expected {args.copies}"
+    print(f"ok: {args.copies} copies, {len(loan_ids)} loans, {len(rejected)} rejected borrows, none oversold")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Throughput of the bulk catalog import against one-by-one create_book.
+
+    python benchmarks/bench_import.py --rows 200000
+
+It uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_import.db")
+
+from app import crud, migrations, schemas
+from app.database import SessionLocal, engine
+
+
+# Titles are unique per run, so reruns against one DATABASE_URL insert fresh editions.
+RUN = uuid.uuid4().hex[:8]
+
+
+def feed(rows: int, offset: int = 0) -> bytes:
+    lines = (
+        json.dumps({
+            "book_name": f"Imported Title {RUN} {offset + i}",
+            "book_genre": "Bench",
+            "book_year": 1950 + i % 70,
+            "book_author": f"Author {i % 1000}",
+            "book_language": "English",
+            "book_description": "A synthetic acquisition record.",
+            "number_available_volumes": 1 + i % 5,
+        })
+        for i in range(rows)
+    )
+    return "\n".join(lines).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--baseline-rows", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=crud.IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    migrations.upgrade(engine)
+    db = SessionLocal()
+
+    started = time.perf_counter()
+    for i in range(args.baseline_rows):
+        crud.create_book(db, schemas.BookCreate(
+            book_name=f"Single Title {RUN} {i}", book_genre="Bench", book_year=2000, book_author="Author",
+            book_language="English", number_available_volumes=1
+        ))
+    elapsed = time.perf_counter() - started
+    print(f"create_book one by one: {args.baseline_rows} rows in {elapsed:.2f}s ({args.baseline_rows / elapsed:,.0f} rows/s)")
+
+    for label in ("bulk insert", "bulk upsert"):
+        records = crud.parse_book_import(io.BytesIO(feed(args.rows)), "ndjson")
+        started = time.perf_counter()
+        summary = crud.import_books(db, records, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label}: {summary['processed']} rows in {elapsed:.2f}s ({summary['processed'] / elapsed:,.0f} rows/s), "
+            f"inserted={summary['inserted']} updated={summary['updated']} errors={summary['error_count']}"
+        )
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
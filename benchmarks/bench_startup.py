@@ -0,0 +1,85 @@
+"""Measure worker cold start: importing main and time to the first request.
+
+Each sample starts a fresh interpreter. Two numbers are reported:
+- import: how long `import main` takes.
+- first request: from spawning uvicorn until GET /books/?limit=1 is answered.
+
+First-request time is measured both with the lifespan migration check
+(MIGRATE_ON_STARTUP=1) and without it, as when deploys run
+`python -m app.migrations` once instead.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --top 15   # also list the slowest imports
+
+It uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_startup.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from benchmarks.common import ROOT, Server
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def import_seconds() -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """(cumulative microseconds, module) for the slowest imports under `import main`."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        timings.append((int(cumulative), module.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def first_request_seconds(migrate: bool) -> float:
+    env = {"MIGRATE_ON_STARTUP": "1" if migrate else "0"}
+    with Server(env, ready_path="/books/?limit=1") as server:
+        return server.ready_at - server.started_at
+
+
+def report(name: str, samples: list):
+    print(f"{name:<28} median={statistics.median(samples) * 1000:8.1f}ms "
+          f"min={min(samples) * 1000:8.1f}ms max={max(samples) * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports")
+    args = parser.parse_args()
+
+    from app import migrations
+    from app.database import engine
+    # Create the schema up front so every sample starts from a current database.
+    migrations.upgrade(engine)
+
+    report("import main", [import_seconds() for _ in range(args.runs)])
+    report("first request (migrate)", [first_request_seconds(True) for _ in range(args.runs)])
+    report("first request (no migrate)", [first_request_seconds(False) for _ in range(args.runs)])
+
+    if args.top:
+        print("\nSlowest imports (cumulative):")
+        for microseconds, module in slowest_imports(args.top):
+            print(f"{microseconds / 1000:8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
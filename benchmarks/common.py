@@ -0,0 +1,80 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, elapsed) -> dict:
+    return {
+        "ops": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def format_summary(name, summary) -> str:
+    return (
+        f"{name:<24} ops={summary['ops']:<7} "
+        f"throughput={summary['throughput']:8.1f}/s "
+        f"p50={summary['p50_ms']:7.2f}ms "
+        f"p95={summary['p95_ms']:7.2f}ms "
+        f"p99={summary['p99_ms']:7.2f}ms"
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """Run main:app under uvicorn in a subprocess with extra environment."""
+
+    def __init__(self, env: dict, workers: int = 1, ready_path: str = "/openapi.json"):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **env}
+        self.workers = workers
+        self.ready_path = ready_path
+        self.process = None
+        self.started_at = None
+        self.ready_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port),
+             "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=ROOT, env=self.env
+        )
+        self.wait_ready()
+        return self
+
+    def wait_ready(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(f"{self.url}{self.ready_path}", timeout=1.0).status_code < 500:
+                    self.ready_at = time.perf_counter()
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"server on {self.url} did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=30)
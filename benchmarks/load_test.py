@@ -0,0 +1,277 @@
+"""Load test main:app over a realistic endpoint mix against seeded data.
+
+Seeds a dedicated local database through benchmarks/seed.py (reused on
+later runs with the same volumes), starts main:app under uvicorn, and drives
+it with concurrent clients. The mix covers login, catalog browsing and
+search, borrow/return, the caller's loans, CSV export, and admin
+stats/overdue/history. It reports throughput and p50/p95/p99 per route.
+
+    python benchmarks/load_test.py                          # compare with the "default" baseline
+    python benchmarks/load_test.py --save-baseline          # record it
+    python benchmarks/load_test.py --users 10000 --books 100000 --loans 1000000 --baseline large
+    python benchmarks/load_test.py --env DB_ASYNC=1 --workers 4
+
+Baselines are JSON files in benchmarks/baselines/. A run exits with status 1
+if any route's p95 rises, or its throughput falls, by more than
+--max-regression compared with the baseline. Baselines are only comparable
+on the machine that recorded them.
+
+The configured DATABASE_URL is never used; pass --database-url to test
+against another database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.pagination import encode_cursor
+from benchmarks.common import Server, format_summary, summarize
+from benchmarks import seed as seeder
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Scenario weights: mostly catalog reads, a steady stream of circulation and
+# a trickle of exports and admin pages.
+MIX = {
+    "browse": 30,
+    "search": 20,
+    "my_loans": 10,
+    "borrow_return": 15,
+    "login": 8,
+    "export_csv": 5,
+    "admin_stats": 5,
+    "admin_overdue": 2,
+    "admin_history": 5,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+        except httpx.HTTPError:
+            response, failed = None, True
+        if self.recording:
+            self.latencies[route].append(time.perf_counter() - started)
+            self.errors[route] += failed
+        return response
+
+
+class Context:
+    """Tokens and id ranges shared by all simulated clients."""
+
+    def __init__(self, users: int, books: int):
+        self.users = users
+        self.books = books
+        self.sessions = []
+        self.admin_headers = None
+
+    def random_user(self) -> str:
+        return f"bench_user_{random.randint(1, self.users - 1)}"
+
+
+async def login(client, recorder, username):
+    response = await recorder.request(client, "POST /token", "POST", "/token",
+                                      data={"username": username, "password": seeder.SEED_PASSWORD})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def browse(client, recorder, ctx, session):
+    after = random.randint(0, max(ctx.books - 50, 0))
+    cursor = encode_cursor({"book_id": after}) if after else None
+    await recorder.request(client, "GET /books/", "GET", "/books/",
+                           params={"limit": 50, **({"cursor": cursor} if cursor else {})})
+
+
+async def search(client, recorder, ctx, session):
+    await recorder.request(client, "GET /books/{name}", "GET", f"/books/{random.choice(seeder.WORDS)}")
+
+
+async def my_loans(client, recorder, ctx, session):
+    await recorder.request(client, "GET /loans/me", "GET", "/loans/me", headers=session["headers"])
+
+
+async def borrow_return(client, recorder, ctx, session):
+    response = await recorder.request(client, "POST /loans/", "POST", "/loans/", headers=session["headers"], json={
+        "user_id": session["user_id"], "book_id": random.randint(1, ctx.books)
+    })
+    if response is not None and response.status_code == 200:
+        await recorder.request(client, "POST /loans/{id}/return", "POST",
+                               f"/loans/{response.json()['loan_id']}/return", headers=session["headers"], json={})
+
+
+async def login_scenario(client, recorder, ctx, session):
+    await login(client, recorder, ctx.random_user())
+
+
+async def export_csv(client, recorder, ctx, session):
+    await recorder.request(client, "GET /loans/me/export", "GET", "/loans/me/export", headers=session["headers"])
+
+
+async def admin_stats(client, recorder, ctx, session):
+    await recorder.request(client, "GET /admin/stats", "GET", "/admin/stats", headers=ctx.admin_headers)
+
+
+async def admin_overdue(client, recorder, ctx, session):
+    await recorder.request(client, "GET /loans/overdue", "GET", "/loans/overdue", headers=ctx.admin_headers)
+
+
+async def admin_history(client, recorder, ctx, session):
+    await recorder.request(client, "GET /loans/history", "GET", "/loans/history", headers=ctx.admin_headers,
+                           params={"user_id": random.randint(1, ctx.users)})
+
+
+SCENARIOS = {
+    "browse": browse,
+    "search": search,
+    "my_loans": my_loans,
+    "borrow_return": borrow_return,
+    "login": login_scenario,
+    "export_csv": export_csv,
+    "admin_stats": admin_stats,
+    "admin_overdue": admin_overdue,
+    "admin_history": admin_history,
+}
+
+
+async def drive(url: str, ctx: Context, clients: int, duration: float, warmup: float) -> tuple:
+    recorder = Recorder()
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+
+    async with httpx.AsyncClient(base_url=url, timeout=60.0,
+                                 limits=httpx.Limits(max_connections=clients)) as client:
+        ctx.admin_headers = await login(client, recorder, seeder.ADMIN_USERNAME)
+        for _ in range(clients):
+            username = ctx.random_user()
+            headers = await login(client, recorder, username)
+            user = (await client.get(f"/users/{username}")).json()
+            ctx.sessions.append({"headers": headers, "user_id": user["user_id"]})
+
+        async def client_loop(session, deadline):
+            while time.perf_counter() < deadline:
+                scenario = random.choices(names, weights)[0]
+                await SCENARIOS[scenario](client, recorder, ctx, session)
+
+        # Warm-up lets lazily built in-process indexes and caches load
+        # before anything is recorded.
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(client_loop(session, deadline) for session in ctx.sessions))
+
+        recorder.recording = True
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(client_loop(session, deadline) for session in ctx.sessions))
+        elapsed = time.perf_counter() - started
+
+    return recorder, elapsed
+
+
+def build_report(recorder: Recorder, elapsed: float, profile: dict) -> dict:
+    routes = {
+        route: {**summarize(latencies, elapsed), "errors": recorder.errors[route]}
+        for route, latencies in sorted(recorder.latencies.items())
+    }
+    everything = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    return {
+        "profile": profile,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "routes": routes,
+        "total": {**summarize(everything, elapsed), "errors": sum(recorder.errors.values())},
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Print per-route deltas against the baseline; returns the regressed routes."""
+    regressions = []
+    for route, current in report["routes"].items():
+        previous = baseline["routes"].get(route)
+        if previous is None:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        throughput_change = current["throughput"] / previous["throughput"] - 1 if previous["throughput"] else 0.0
+        regressed = p95_change > max_regression or throughput_change < -max_regression
+        print(f"{route:<28} p95 {p95_change:+7.1%}  throughput {throughput_change:+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(route)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--loans", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", default=None,
+                        help="defaults to a SQLite file under benchmarks/data named after the volumes")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the server, e.g. DB_ASYNC=1")
+    parser.add_argument("--baseline", default="default", help="baseline name under benchmarks/baselines")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    database_url = args.database_url or seeder.default_database_url(args.users, args.books, args.loans, args.seed)
+    os.environ["DATABASE_URL"] = database_url
+    from app.database import engine
+
+    if not seeder.is_seeded(engine):
+        result = seeder.seed(engine, args.users, args.books, args.loans, args.seed)
+        print(f"Seeded {args.users} users, {args.books} books, {args.loans} loans in {result['seconds']:.1f}s")
+
+    server_env = {"DATABASE_URL": database_url, **dict(item.split("=", 1) for item in args.env)}
+    ctx = Context(args.users, args.books)
+    with Server(server_env, workers=args.workers) as server:
+        recorder, elapsed = asyncio.run(drive(server.url, ctx, args.clients, args.duration, args.warmup))
+
+    profile = {key: getattr(args, key) for key in ("users", "books", "loans", "seed", "clients", "duration", "workers", "env")}
+    report = build_report(recorder, elapsed, profile)
+    for route, summary in report["routes"].items():
+        print(format_summary(route, summary) + f" errors={summary['errors']}")
+    print(format_summary("TOTAL", report["total"]) + f" errors={report['total']['errors']}")
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+        return
+
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --save-baseline to record one.")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["profile"] != profile:
+        print("Warning: baseline was recorded with a different profile:", baseline["profile"])
+    if compare(report, baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Seed a database with synthetic users, books and loans for benchmarking.
+
+    python benchmarks/seed.py --users 10000 --books 100000 --loans 1000000
+    python benchmarks/seed.py --database-url postgresql://localhost/library_bench
+
+The data is deterministic for a given --seed. Every seeded user can log in
+with SEED_PASSWORD. bench_user_0 is an administrator, and the others are
+named bench_user_<n>. About a third of the loans are open, with due dates
+spread around today so the overdue and due-soon lists are populated. The
+returned loans carry the fine return_loan would have charged.
+
+Rows are bulk-inserted in chunks rather than through crud, so millions of
+loans load in minutes. The schema comes from app.migrations.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+SEED_PASSWORD = "benchpass"
+ADMIN_USERNAME = "bench_user_0"
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+WORDS = [
+    "python", "history", "garden", "ocean", "systems", "poetry", "river", "design", "stars", "cooking",
+    "winter", "empire", "machine", "forest", "letters", "silent", "city", "music", "light", "atlas",
+]
+GENRES = ["Fiction", "History", "Science", "Poetry", "Tech", "Travel", "Cooking", "Art"]
+LANGUAGES = ["English", "Portuguese", "Spanish", "French", "German"]
+
+
+def default_database_url(users: int, books: int, loans: int, seed: int) -> str:
+    os.makedirs(DEFAULT_DATA_DIR, exist_ok=True)
+    return f"sqlite:///{DEFAULT_DATA_DIR}/bench_{users}u_{books}b_{loans}l_s{seed}.db"
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _users(count, hashed_password):
+    for i in range(count):
+        yield {
+            "username": f"bench_user_{i}",
+            "user_email": f"bench_user_{i}@example.com",
+            "hashed_password": hashed_password,
+            "is_admin": i == 0,
+        }
+
+
+def _books(count, rng):
+    for i in range(count):
+        yield {
+            "book_name": f"{rng.choice(WORDS).title()} of the {rng.choice(WORDS)} {i}",
+            "book_genre": rng.choice(GENRES),
+            "book_year": rng.randint(1900, 2025),
+            "book_author": f"{rng.choice(WORDS).title()} Author {i % 5000}",
+            "book_language": rng.choice(LANGUAGES),
+            "book_description": "A synthetic catalog record. " * rng.randint(1, 8),
+            "number_available_volumes": rng.randint(1, 20),
+        }
+
+
+def _loans(count, users, books, rng, fine_for):
+    today = date.today()
+    for _ in range(count):
+        due_date = today + timedelta(days=rng.randint(-120, 21))
+        row = {
+            "user_id": rng.randint(1, users),
+            "book_id": rng.randint(1, books),
+            "loan_due_date": due_date,
+            "return_date": None,
+            "loan_fine": None,
+        }
+        if rng.random() < 0.67 and due_date - timedelta(days=14) < today:
+            return_date = min(today, due_date + timedelta(days=rng.randint(-14, 10)))
+            row["return_date"] = return_date
+            if return_date > due_date:
+                row["loan_fine"] = fine_for(due_date, return_date)
+        yield row
+
+
+def is_seeded(engine) -> bool:
+    from sqlalchemy import inspect, select
+    from app import models
+
+    if not inspect(engine).has_table(models.User.__tablename__):
+        return False
+    with engine.connect() as connection:
+        return connection.execute(
+            select(models.User.user_id).where(models.User.username == ADMIN_USERNAME)
+        ).first() is not None
+
+
+def seed(engine, users: int, books: int, loans: int, seed: int = 0, chunk_size: int = 10000) -> dict:
+    """Create the schema and bulk-load a fresh database; returns row counts and timing."""
+    from app import crud, fines, migrations, models
+    from app.database import SessionLocal
+    from app.security import hash_password
+
+    if is_seeded(engine):
+        raise RuntimeError("database already holds seeded data; point at an empty database")
+    migrations.upgrade(engine)
+
+    rng = random.Random(seed)
+    # One bcrypt hash shared by every user keeps seeding fast and logins realistic.
+    hashed_password = hash_password(SEED_PASSWORD)
+    started = time.perf_counter()
+    for table, rows in (
+        (models.User.__table__, _users(users, hashed_password)),
+        (models.Book.__table__, _books(books, rng)),
+        (models.Loan.__table__, _loans(loans, users, books, rng, fines.fine_for)),
+    ):
+        for chunk in _chunks(rows, chunk_size):
+            with engine.begin() as connection:
+                connection.execute(table.insert(), chunk)
+
+    db = SessionLocal()
+    try:
+        crud.reconcile_stat_counters(db)
+    finally:
+        db.close()
+    return {"users": users, "books": books, "loans": loans, "seconds": time.perf_counter() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--loans", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--database-url", default=None,
+                        help="defaults to a SQLite file under benchmarks/data named after the volumes")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or default_database_url(args.users, args.books, args.loans, args.seed)
+    from app.database import engine
+
+    result = seed(engine, args.users, args.books, args.loans, args.seed, args.chunk_size)
+    print(f"Seeded {result['users']} users, {result['books']} books, {result['loans']} loans "
+          f"in {result['seconds']:.1f}s into {os.environ['DATABASE_URL']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app import models
-from app.database import Base, engine
+from app import migrations, notifications
+from app.database import engine, DB_ASYNC
+from app.instrumentation import RequestMetricsMiddleware
 from app.routes import router
 
-models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema work runs at startup, not import, so importing main stays cheap.
+    if migrations.MIGRATE_ON_STARTUP:
+        migrations.upgrade(engine)
+    scheduler = notifications.NotificationScheduler().start() if notifications.NOTIFY_SCHEDULER else None
+    yield
+    if scheduler is not None:
+        scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
 
-app.include_router(router)
+if DB_ASYNC:
+    from app.async_routes import include_routers
+    include_routers(app, router)
+else:
+    app.include_router(router)
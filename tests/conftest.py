@@ -0,0 +1,75 @@
+import sys
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from app import migrations
+from app.database import engine
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    # Module-level TestClients never run the app's lifespan, so migrate once here.
+    migrations.upgrade(engine)
+
+
+@pytest.fixture(scope="session")
+def api():
+    from main import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def unique():
+    """unique("prefix") -> "prefix_<8 hex>", so reruns against the same database never collide."""
+    return lambda prefix: f"{prefix}_{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def make_user(api, unique):
+    """Register and log in a fresh user; admin=True promotes it first."""
+    def make(prefix="user", admin=False, password="testpass"):
+        from app import database as db, models
+
+        username = unique(prefix)
+        api.post("/register", json={
+            "username": username,
+            "user_email": f"{username}@example.com",
+            "password": password
+        })
+        session = db.SessionLocal()
+        user = session.query(models.User).filter_by(username=username).first()
+        user.is_admin = admin
+        session.commit()
+        user_id = user.user_id
+        session.close()
+
+        token = api.post("/token", data={"username": username, "password": password}).json()["access_token"]
+        return SimpleNamespace(username=username, user_id=user_id, headers={"Authorization": f"Bearer {token}"})
+    return make
+
+
+@pytest.fixture
+def make_book(api, make_user, unique):
+    """Create a book named "<name>_<8 hex>" through the API as a throwaway admin."""
+    admin = {}
+
+    def make(name="Test Book", **fields):
+        if "headers" not in admin:
+            admin["headers"] = make_user("book_admin", admin=True).headers
+        response = api.post("/books/", json={
+            "book_name": unique(name),
+            "book_genre": "Tech",
+            "book_year": 2024,
+            "book_author": "Test Author",
+            "book_language": "English",
+            "number_available_volumes": 1,
+            **fields
+        }, headers=admin["headers"])
+        assert response.status_code == 200
+        return response.json()
+    return make
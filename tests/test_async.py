@@ -0,0 +1,101 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+pytest.importorskip("aiosqlite" if os.getenv("DATABASE_URL", "").startswith("sqlite") else "asyncpg")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import main  # noqa: F401  (creates the schema)
+from app.async_routes import include_routers
+from app.routes import router
+
+async_app = FastAPI()
+include_routers(async_app, router)
+client = TestClient(async_app)
+
+
+def test_async_routes_borrow_flow(make_user, unique):
+    user = make_user("async_user", admin=True)
+    headers, user_id = user.headers, user.user_id
+    book_name = unique("Async Handbook")
+
+    book = client.post("/books/", json={
+        "book_name": book_name,
+        "book_genre": "Tech",
+        "book_year": 2024,
+        "book_author": "Async Author",
+        "book_language": "English",
+        "number_available_volumes": 1
+    }, headers=headers).json()
+
+    assert any(b["book_id"] == book["book_id"] for b in client.get(f"/books/{book_name}").json())
+
+    loan = client.post("/loans/", json={"user_id": user_id, "book_id": book["book_id"]}, headers=headers)
+    assert loan.status_code == 200
+    again = client.post("/loans/", json={"user_id": user_id, "book_id": book["book_id"]}, headers=headers)
+    assert again.status_code == 400
+
+    my_loans = client.get("/loans/me", headers=headers).json()
+    assert my_loans[0]["book"]["book_name"] == book_name
+
+    returned = client.post(f"/loans/{loan.json()['loan_id']}/return", json={}, headers=headers)
+    assert returned.status_code == 200
+    assert client.get("/admin/stats", headers=headers).status_code == 200
+
+    # Routes without an async twin still come from the sync router.
+    assert client.get("/loans/me/export", headers=headers).status_code == 200
+
+
+def test_async_writes_pin_reads_to_primary(monkeypatch, make_user, make_book):
+    from app import database, dependencies
+
+    borrower = make_user("async_pinned")
+    book = make_book("Async Pinned Book")
+    # Any replica will do: the pin is set before anything is read from it.
+    database.configure_read_replicas([os.environ["DATABASE_URL"]])
+    monkeypatch.setattr(dependencies, "_primary_pins", {})
+    try:
+        loan = client.post("/loans/", json={"user_id": borrower.user_id, "book_id": book["book_id"]},
+                           headers=borrower.headers)
+        assert dependencies.PRIMARY_PIN_COOKIE in loan.cookies
+        assert borrower.username in dependencies._primary_pins
+
+        dependencies._primary_pins.clear()
+        returned = client.post(f"/loans/{loan.json()['loan_id']}/return", json={}, headers=borrower.headers)
+        assert dependencies.PRIMARY_PIN_COOKIE in returned.cookies
+        assert borrower.username in dependencies._primary_pins
+    finally:
+        database.configure_read_replicas([])
+        client.cookies.clear()
+
+
+def test_async_catalog_bump_runs_off_the_event_loop(monkeypatch, make_user, unique):
+    import asyncio
+    from app import catalog
+
+    admin = make_user("async_bump", admin=True)
+    on_loop = []
+    bump_version = catalog.bump_version
+
+    def recording_bump():
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return bump_version()
+
+    monkeypatch.setattr(catalog, "bump_version", recording_bump)
+    created = client.post("/books/", json={
+        "book_name": unique("Async Bump Book"),
+        "book_genre": "Tech",
+        "book_year": 2024,
+        "book_author": "Async Author",
+        "book_language": "English",
+        "number_available_volumes": 1
+    }, headers=admin.headers)
+    assert created.status_code == 200
+    assert on_loop == [False]
@@ -0,0 +1,63 @@
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+from main import app
+from app import security
+
+client = TestClient(app)
+
+
+def test_login_rehashes_outdated_bcrypt_cost(unique):
+    from app import database as db, models
+
+    username = unique("rehash_user")
+    weak_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("rehashpass")
+    session = db.SessionLocal()
+    session.add(models.User(username=username, user_email=f"{username}@example.com", hashed_password=weak_hash))
+    session.commit()
+    session.close()
+
+    response = client.post("/token", data={"username": username, "password": "rehashpass"})
+    assert response.status_code == 200
+
+    session = db.SessionLocal()
+    stored = session.query(models.User).filter_by(username=username).first().hashed_password
+    session.close()
+    assert stored != weak_hash
+    assert security.pwd_context.verify("rehashpass", stored)
+    assert not security.pwd_context.needs_update(stored)
+
+
+def test_login_rejected_when_hash_pool_saturated(monkeypatch, make_user):
+    user = make_user("saturated_user")
+    monkeypatch.setattr(security, "_slots", threading.BoundedSemaphore(1))
+    security._slots.acquire()
+
+    response = client.post("/token", data={"username": user.username, "password": "testpass"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert security.get_password_metrics()["rejected"] >= 1
+
+
+def test_principal_cache_hits_and_invalidation(make_user):
+    from app import database as db, models
+    from app.dependencies import principal_cache
+
+    user = make_user("cached_user")
+
+    assert client.get("/loans/overdue", headers=user.headers).status_code == 403
+    hits = principal_cache.hits
+    assert client.get("/loans/overdue", headers=user.headers).status_code == 403
+    assert principal_cache.hits == hits + 1
+
+    # Promoting the user must drop the cached principal.
+    session = db.SessionLocal()
+    session.query(models.User).filter_by(username=user.username).first().is_admin = True
+    session.commit()
+    session.close()
+
+    assert client.get("/loans/overdue", headers=user.headers).status_code == 200
@@ -0,0 +1,252 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def test_read_all_books_cursor_pagination(make_book):
+    created = [make_book(f"Paged Book {i}")["book_id"] for i in range(3)]
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/books/", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        seen.extend(book["book_id"] for book in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen))
+    assert all(book_id in seen for book_id in created)
+
+
+def test_read_all_books_field_projection():
+    response = client.get("/books/", params={"fields": "book_name,book_author"})
+    assert response.status_code == 200
+    for book in response.json():
+        assert set(book) == {"book_id", "book_name", "book_author"}
+
+
+def test_read_all_books_rejects_bad_input():
+    assert client.get("/books/", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/books/", params={"fields": "book_name,password"}).status_code == 400
+
+
+def test_trigram_index_ranks_and_updates():
+    from app.search import TrigramIndex
+
+    index = TrigramIndex()
+    index.add(1, "Fluent Python", "Luciano Ramalho")
+    index.add(2, "Python Tricks", "Dan Bader")
+    index.add(3, "Dune", "Frank Herbert")
+
+    assert index.search("python", 10)[:2] == [1, 2]
+    assert index.search("pyhton", 10) != []
+    assert index.search("herbert", 10) == [3]
+    assert index.search("python", 1) == [1]
+
+    # Substring matches count even when too short or too partial to be similar.
+    index.add(4, "The Lord of the Rings", "J. R. R. Tolkien")
+    assert index.search("or", 10)[0] == 4
+    assert index.search("ord of th", 10) == [4]
+    assert index.search("tolk", 10)[0] == 4
+
+    index.remove(1)
+    index.add(2, "Dune Messiah", "Frank Herbert")
+    assert index.search("python", 10) == []
+    assert sorted(index.search("dune", 10)) == [2, 3]
+
+
+def test_read_book_by_name_search(make_user, make_book):
+    headers = make_user("admin_search", admin=True).headers
+    book = make_book("Searchable Zebra Handbook", book_author="Quentin Searcher")
+
+    assert book["book_id"] in [b["book_id"] for b in client.get("/books/zebra hand").json()]
+    assert book["book_id"] in [b["book_id"] for b in client.get("/books/Quentin").json()]
+
+    client.patch(f"/books/{book['book_id']}", json={"book_name": "Renamed Okapi Handbook"}, headers=headers)
+    assert book["book_id"] in [b["book_id"] for b in client.get("/books/okapi").json()]
+
+    client.delete(f"/books/{book['book_id']}", headers=headers)
+    assert client.get("/books/okapi").status_code == 404
+
+
+def test_bulk_import_books_csv_and_ndjson(make_user, unique):
+    headers = make_user("admin_import", admin=True).headers
+    walrus, narwhal = unique("Imported Walrus Atlas"), unique("Imported Narwhal Guide")
+    csv_body = (
+        "book_name,book_genre,book_year,book_author,book_language,book_description,number_available_volumes\n"
+        f"{walrus},Travel,2020,Ima Porter,English,,3\n"
+        "Imported Broken Row,Travel,not-a-year,Ima Porter,English,,3\n"
+        f"{narwhal},Travel,2021,Ima Porter,English,\"Multi\nline\",4\n"
+    )
+    response = client.post(
+        "/admin/books/import",
+        files={"file": ("feed.csv", csv_body, "text/csv")},
+        headers=headers
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["processed"], result["inserted"], result["updated"]) == (3, 2, 0)
+    assert [error["row"] for error in result["errors"]] == [2]
+
+    ndjson_body = (
+        f'{{"book_name": "{walrus}", "book_genre": "Travel", "book_year": 2020, '
+        '"book_author": "Ima Porter", "book_language": "English", "number_available_volumes": 9}\n'
+        '{not json}\n'
+    )
+    response = client.post(
+        "/admin/books/import",
+        files={"file": ("feed.ndjson", ndjson_body, "application/x-ndjson")},
+        headers=headers
+    )
+    result = response.json()
+    assert (result["processed"], result["inserted"], result["updated"], result["error_count"]) == (2, 0, 1, 1)
+
+    books = client.get(f"/books/{walrus}").json()
+    assert [book["number_available_volumes"] for book in books if book["book_name"] == walrus] == [9]
+    assert any(book["book_name"] == narwhal for book in client.get(f"/books/{narwhal}").json())
+
+    # POST /books/ never merges into an existing edition; another language is another edition.
+    edition = {
+        "book_name": walrus, "book_genre": "Travel", "book_year": 2020, "book_author": "Ima Porter",
+        "book_language": "English", "number_available_volumes": 2
+    }
+    response = client.post("/books/", json=edition, headers=headers)
+    assert response.status_code == 409
+    response = client.post("/books/", json={**edition, "book_language": "Spanish"}, headers=headers)
+    assert response.status_code == 200
+    spanish_id = response.json()["book_id"]
+    assert spanish_id != books[0]["book_id"]
+    # Nor can an edit turn one edition into another that exists.
+    response = client.patch(f"/books/{spanish_id}", json={"book_language": "English"}, headers=headers)
+    assert response.status_code == 409
+    books = client.get(f"/books/{walrus}").json()
+    assert sorted((book["book_language"], book["number_available_volumes"]) for book in books
+                  if book["book_name"] == walrus) == [("English", 9), ("Spanish", 2)]
+
+    # Undecodable rows are reported like any other bad row; the rest imports.
+    heron = unique("Imported Heron Almanac")
+    response = client.post(
+        "/admin/books/import",
+        files={"file": ("feed.ndjson", b'{"book_name": "ok"}\n{"book_name": "\xff"}\n' + (
+            f'{{"book_name": "{heron}", "book_genre": "Travel", "book_year": 2021, '
+            '"book_author": "Ima Porter", "book_language": "English", "number_available_volumes": 1}\n'
+        ).encode(), "application/x-ndjson")},
+        headers=headers
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["processed"], result["inserted"], result["error_count"]) == (3, 1, 2)
+    assert result["errors"][1] == {"row": 2, "errors": ["Row is not valid UTF-8"]}
+
+    # A CSV saved with a byte order mark, and a bad byte inside a quoted multi-line value.
+    bom_title = unique("Imported Ibex Atlas")
+    csv_body = (
+        "\ufeffbook_name,book_genre,book_year,book_author,book_language,book_description,number_available_volumes\n"
+        f"Imported Bad Byte,Travel,2020,Ima Porter,English,\"Two\nlines \udcff\",1\n"
+        f"{bom_title},Travel,2020,Ima Porter,English,,1\n"
+    ).encode("utf-8", "surrogateescape")
+    response = client.post("/admin/books/import", files={"file": ("feed.csv", csv_body, "text/csv")}, headers=headers)
+    result = response.json()
+    assert (result["processed"], result["inserted"]) == (2, 1)
+    assert result["errors"] == [{"row": 1, "errors": ["Row is not valid UTF-8"]}]
+    assert any(book["book_name"] == bom_title for book in client.get(f"/books/{bom_title}").json())
+
+
+def test_catalog_conditional_get(monkeypatch, make_user, make_book):
+    from app import crud
+    headers = make_user("admin_etag", admin=True).headers
+    book = make_book("ETag Book")
+
+    first = client.get("/books/", params={"fields": "book_name"})
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag.startswith('"')
+    assert "no-cache" in first.headers["Cache-Control"]
+    assert client.get("/books/", params={"fields": "book_author"}).headers["ETag"] != etag
+
+    # A matching If-None-Match is answered without running the query.
+    def fail(*args, **kwargs):
+        raise AssertionError("catalog was queried")
+    monkeypatch.setattr(crud, "get_books", fail)
+    cached = client.get("/books/", params={"fields": "book_name"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag and cached.content == b""
+    monkeypatch.undo()
+
+    client.patch(f"/books/{book['book_id']}", json={"number_available_volumes": 5}, headers=headers)
+    changed = client.get("/books/", params={"fields": "book_name"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+    by_name = client.get(f"/books/{book['book_name']}")
+    assert client.get(f"/books/{book['book_name']}", headers={"If-None-Match": by_name.headers["ETag"]}).status_code == 304
+
+
+def test_reimport_keeps_copies_on_loan_unavailable(make_user, unique):
+    admin = make_user("admin_reimport", admin=True)
+    borrower = make_user("reimport_borrower")
+    titles = [unique("Reimported Tapir Primer"), unique("Reimported Quokka Primer")]
+    feed = "".join(
+        f'{{"book_name": "{title}", "book_genre": "Travel", "book_year": 2020, '
+        '"book_author": "Ima Porter", "book_language": "English", "number_available_volumes": 2}\n'
+        for title in titles
+    )
+
+    def reimport():
+        response = client.post("/admin/books/import", files={"file": ("feed.ndjson", feed, "application/x-ndjson")},
+                               headers=admin.headers)
+        assert response.status_code == 200
+
+    def book(title):
+        return next(book for book in client.get(f"/books/{title}").json() if book["book_name"] == title)
+
+    reimport()
+    # Two copies held of each title, one of each on loan.
+    loans = [
+        client.post("/loans/", json={"user_id": borrower.user_id, "book_id": book(title)["book_id"]},
+                    headers=borrower.headers)
+        for title in titles
+    ]
+    assert all(loan.status_code == 200 for loan in loans)
+
+    reimport()
+    assert [book(title)["number_available_volumes"] for title in titles] == [1, 1]
+    client.post(f"/loans/{loans[0].json()['loan_id']}/return", json={}, headers=borrower.headers)
+    assert [book(title)["number_available_volumes"] for title in titles] == [2, 1]
+
+
+def test_search_index_picks_up_other_workers_writes(monkeypatch, make_book, unique):
+    from app import database, models, search
+
+    if database.engine.dialect.name == "postgresql":
+        pytest.skip("PostgreSQL searches the table directly")
+
+    def found(term):
+        response = client.get(f"/books/{term}")
+        return [] if response.status_code == 404 else [b["book_id"] for b in response.json()]
+
+    book = make_book("Marmoset Almanac")
+    assert book["book_id"] in found(book["book_name"])
+    # Written by another worker process: this one's index never heard of it.
+    title = unique("Zyzzyva Quarterly")
+    session = database.SessionLocal()
+    session.query(models.Book).filter(models.Book.book_id == book["book_id"]).update({"book_name": title})
+    session.commit()
+    session.close()
+    assert book["book_id"] not in found(title)
+
+    monkeypatch.setattr(search, "SEARCH_INDEX_REFRESH_SECONDS", 0)
+    assert book["book_id"] in found(title)
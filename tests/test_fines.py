@@ -0,0 +1,107 @@
+import sys
+import os
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def setup_overdue_loans(make_user, make_book, count, days_overdue, as_of=None):
+    admin = make_user("fines_admin", admin=True)
+    book = make_book("Fines Test Book", book_author="Ledger Author", book_genre="Finance",
+                     book_year=2001, number_available_volumes=10)
+
+    borrower = make_user("fines_borrower")
+    due = ((as_of or date.today()) - timedelta(days=days_overdue)).isoformat()
+    loans = [
+        client.post("/loans/", json={"user_id": borrower.user_id, "book_id": book["book_id"], "loan_due_date": due},
+                    headers=borrower.headers).json()
+        for _ in range(count)
+    ]
+    return admin.headers, borrower.headers, borrower.user_id, loans
+
+
+def unused_run_date():
+    """A day after every recorded accrual run, so each test run gets fresh checkpoints."""
+    from app import database as db, models
+    from sqlalchemy import func
+
+    session = db.SessionLocal()
+    latest = session.query(func.max(models.FineAccrualRun.run_date)).scalar()
+    session.close()
+    return max(date.today(), latest + timedelta(days=2)) if latest else date.today()
+
+
+def test_accrual_is_resumable_and_idempotent_and_settles_on_return(make_user, make_book):
+    from app import database as db, fines
+
+    as_of = unused_run_date()
+    admin_headers, headers, user_id, loans = setup_overdue_loans(make_user, make_book, 2, days_overdue=10, as_of=as_of)
+    day_before = as_of - timedelta(days=1)
+
+    session = db.SessionLocal()
+    first = fines.accrue_fines(session, day_before, batch_size=1, max_batches=1)
+    assert first["status"] == "partial"
+    resumed = fines.accrue_fines(session, day_before, batch_size=1)
+    assert resumed["status"] == "completed"
+    assert resumed["resumed_from"] == first["last_loan_id"] > 0
+    assert fines.accrue_fines(session, day_before)["status"] == "already_completed"
+
+    # The next day's run charges only the one extra day per loan.
+    fines.accrue_fines(session, as_of)
+    fines.accrue_fines(session, as_of)
+    session.close()
+
+    response = client.get(f"/users/{user_id}/fines", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert Decimal(data["balance"]) == Decimal("30.00")
+    mine = [entry for entry in data["entries"] if entry["loan_id"] == loans[0]["loan_id"]]
+    assert sorted(Decimal(entry["amount"]) for entry in mine) == [Decimal("1.50"), Decimal("13.50")]
+
+    # Returning on the last accrual day settles exactly what was accrued, leaving the
+    # balance unchanged; a backdated return credits back what was accrued past the return date.
+    client.post(f"/loans/{loans[0]['loan_id']}/return", json={"return_date": as_of.isoformat()}, headers=headers)
+    backdated = (as_of - timedelta(days=6)).isoformat()
+    returned = client.post("/loans/batch/return", json={
+        "loan_ids": [loans[1]["loan_id"]], "return_date": backdated
+    }, headers=headers).json()
+    assert Decimal(returned[0]["loan"]["loan_fine"]) == Decimal("6.00")
+
+    data = client.get(f"/users/{user_id}/fines", headers=headers).json()
+    assert Decimal(data["balance"]) == Decimal("21.00")
+    assert Decimal(data["entries"][0]["amount"]) == Decimal("-9.00")
+    assert data["entries"][0]["entry_type"] == "settlement"
+
+    liability = client.get("/admin/fines/liability", headers=admin_headers)
+    assert liability.status_code == 200
+    assert Decimal(liability.json()["total_liability"]) >= Decimal("21.00")
+
+
+def test_accrual_racing_another_job_reports_in_progress(monkeypatch, make_user, make_book):
+    from app import database as db, fines, models
+
+    as_of = unused_run_date()
+    setup_overdue_loans(make_user, make_book, 1, days_overdue=3, as_of=as_of)
+
+    session = db.SessionLocal()
+    assert fines.accrue_fines(session, as_of)["status"] == "completed"
+    # A job that read its checkpoint and the accrued amounts before the first one
+    # committed meets the ledger rows the first one wrote.
+    session.delete(session.get(models.FineAccrualRun, as_of))
+    session.commit()
+    monkeypatch.setattr(fines, "_accrued_by_loan", lambda db, loan_ids: {})
+    assert fines.accrue_fines(session, as_of)["status"] == "in_progress"
+    session.close()
+
+
+def test_fines_are_private(make_user):
+    headers = make_user("fines_snoop").headers
+    user_id = make_user("fines_borrower").user_id
+
+    assert client.get(f"/users/{user_id}/fines", headers=headers).status_code == 403
+    assert client.get("/admin/fines/liability", headers=headers).status_code == 403
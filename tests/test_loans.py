@@ -1,11 +1,15 @@
 import sys
 import os
+import uuid
+
+import pytest
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from fastapi.testclient import TestClient
 from main import app
 
 client = TestClient(app)
+PYTEST_BOOK = f"Unique Pytest Book {uuid.uuid4().hex[:8]}"
 
 
 def test_get_loans_me_unauthenticated():
@@ -115,9 +119,9 @@ def test_borrow_book_success():
     session.commit()
     session.close()
 
-    # Create book
+    # Create book; the name is unique per run since POST /books/ rejects an existing edition
     book_data = {
-        "book_name": "Unique Pytest Book",
+        "book_name": PYTEST_BOOK,
         "book_genre": "Tech",
         "book_year": 2024,
         "book_author": "Test Author",
@@ -152,9 +156,9 @@ def test_borrow_book_unavailable():
     user_id = user_resp.json()["user_id"]
 
     # Get book_id
-    books = client.get("/books/").json()
+    books = client.get(f"/books/{PYTEST_BOOK}").json()
     print("Books:", books)
-    book_id = next(book["book_id"] for book in books if book["book_name"] == "Unique Pytest Book")
+    book_id = next(book["book_id"] for book in books if book["book_name"] == PYTEST_BOOK)
 
     # Try to borrow again (no copies left)
     response = client.post("/loans/", json={
@@ -222,3 +226,344 @@ def test_get_admin_stats():
     assert response.status_code == 200
     data = response.json()
     assert all(key in data for key in ["total_users", "total_books", "active_loans", "overdue_loans"])
+
+
+def test_admin_export_all_loans_csv():
+    token = client.post("/token", data={
+        "username": "admin_stats",
+        "password": "adminpass"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/admin/loans/export", headers=headers)
+    assert response.status_code == 200
+    assert "text/csv" in response.headers["content-type"]
+    lines = response.text.splitlines()
+    assert lines[0] == "Loan ID,User ID,Username,Book Title,Due Date,Return Date,Fine"
+    assert any("Unique Pytest Book" in line for line in lines[1:])
+
+    response = client.get("/admin/loans/export", params={"start_date": "1900-01-01", "end_date": "1900-01-31"}, headers=headers)
+    assert response.text.splitlines() == lines[:1]
+
+    response = client.get("/admin/loans/export", params={"start_date": "2000-01-02", "end_date": "2000-01-01"}, headers=headers)
+    assert response.status_code == 400
+
+    borrower_token = client.post("/token", data={
+        "username": "borrower",
+        "password": "testpass"
+    }).json()["access_token"]
+    response = client.get("/admin/loans/export", headers={"Authorization": f"Bearer {borrower_token}"})
+    assert response.status_code == 403
+
+
+def test_export_loans_pdf_job():
+    import time
+
+    token = client.post("/token", data={
+        "username": "borrower",
+        "password": "testpass"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post("/loans/me/export/pdf/jobs", headers=headers)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(100):
+        status = client.get(f"/loans/me/export/pdf/jobs/{job_id}", headers=headers).json()["status"]
+        if status == "done":
+            break
+        time.sleep(0.1)
+    assert status == "done"
+
+    response = client.get(f"/loans/me/export/pdf/jobs/{job_id}/download", headers=headers)
+    assert response.status_code == 200
+    assert response.content.startswith(b"%PDF")
+
+    other_token = client.post("/token", data={
+        "username": "admin_stats",
+        "password": "adminpass"
+    }).json()["access_token"]
+    response = client.get(f"/loans/me/export/pdf/jobs/{job_id}", headers={"Authorization": f"Bearer {other_token}"})
+    assert response.status_code == 404
+
+
+def test_pdf_export_jobs_are_shared_and_bounded(monkeypatch, make_user, make_book, unique):
+    import threading
+    from datetime import datetime
+    from app import database as db, models, pdf_export
+
+    borrower = make_user("pdf_job_borrower")
+    book = make_book("PDF Job Book")
+    client.post("/loans/", json={
+        "user_id": borrower.user_id, "book_id": book["book_id"], "loan_due_date": "2030-01-01"
+    }, headers=borrower.headers)
+
+    # A full render queue turns new (uncached) renders away.
+    monkeypatch.setattr(pdf_export, "_slots", threading.BoundedSemaphore(1))
+    pdf_export._slots.acquire()
+    response = client.post("/loans/me/export/pdf/jobs", headers=borrower.headers)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/loans/me/export/pdf", headers=borrower.headers).status_code == 503
+
+    # Job state is read from the database, not from this worker's memory.
+    job_id = unique("other-worker-job")
+    session = db.SessionLocal()
+    session.add(models.PdfExportJob(job_id=job_id, user_id=borrower.user_id, status="done",
+                                    created_at=datetime.utcnow(), pdf=b"%PDF-from-another-worker"))
+    session.commit()
+    session.close()
+    assert client.get(f"/loans/me/export/pdf/jobs/{job_id}", headers=borrower.headers).json()["status"] == "done"
+    response = client.get(f"/loans/me/export/pdf/jobs/{job_id}/download", headers=borrower.headers)
+    assert response.content == b"%PDF-from-another-worker"
+
+
+def test_pdf_export_job_fails_when_its_result_cannot_be_stored(monkeypatch, make_user, unique):
+    from concurrent.futures import Future
+    from datetime import datetime
+    from app import database as db, models, pdf_export
+
+    borrower = make_user("pdf_store_failure")
+    job_id = unique("unstorable-job")
+    session = db.SessionLocal()
+    session.add(models.PdfExportJob(job_id=job_id, user_id=borrower.user_id, status="pending",
+                                    created_at=datetime.utcnow()))
+    session.commit()
+    session.close()
+
+    record_job = pdf_export._record_job
+
+    def record_job_once_failing(job_id, **values):
+        if values["status"] == "done":
+            raise RuntimeError("document too large for the database")
+        record_job(job_id, **values)
+
+    monkeypatch.setattr(pdf_export, "_record_job", record_job_once_failing)
+    rendered = Future()
+    rendered.set_result(b"%PDF-unstorable")
+    pdf_export._job_writer.submit(pdf_export._finish_job, job_id, rendered).result()
+
+    response = client.get(f"/loans/me/export/pdf/jobs/{job_id}", headers=borrower.headers)
+    assert response.json()["status"] == "failed"
+
+
+def test_return_book_restocks_once(make_user, make_book):
+    borrower = make_user("restock_borrower")
+    book = make_book("Restock Book")
+    headers = borrower.headers
+
+    loan = client.post("/loans/", json={
+        "user_id": borrower.user_id, "book_id": book["book_id"], "loan_due_date": "2030-01-01"
+    }, headers=headers).json()
+
+    response = client.post(f"/loans/{loan['loan_id']}/return", json={}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["return_date"] is not None
+
+    response = client.post(f"/loans/{loan['loan_id']}/return", json={}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Book already returned"
+
+    book = next(item for item in client.get(f"/books/{book['book_name']}").json() if item["book_id"] == book["book_id"])
+    assert book["number_available_volumes"] == 1
+
+
+def test_admin_stats_counters_match_query(monkeypatch, make_user, make_book):
+    from app import crud, database as db
+
+    borrower = make_user("stats_borrower")
+    book = make_book("Stats Counter Book")
+
+    session = db.SessionLocal()
+    monkeypatch.setattr(crud, "STATS_MODE", "counters")
+    # Writes made in "query" mode (earlier runs against this database) are not counted.
+    crud.reconcile_stat_counters(session)
+    crud.stats_cache.clear()
+
+    headers = borrower.headers
+    loan = client.post("/loans/", json={
+        "user_id": borrower.user_id, "book_id": book["book_id"], "loan_due_date": "2000-01-01"
+    }, headers=headers)
+    assert loan.status_code == 200
+
+    crud.stats_cache.clear()
+    counted = crud.get_admin_dashboard_stats(session)
+    assert counted == crud.compute_dashboard_stats(session)
+
+    client.post(f"/loans/{loan.json()['loan_id']}/return", json={}, headers=headers)
+    crud.stats_cache.clear()
+    assert crud.get_admin_dashboard_stats(session) == crud.compute_dashboard_stats(session)
+    session.close()
+
+
+def test_batch_borrow_and_return(make_user, make_book):
+    borrower = make_user("batch_borrower")
+    headers, user_id = borrower.headers, borrower.user_id
+    books = [make_book("Batch Cart Book", book_author="Batch Author", number_available_volumes=copies)
+             for copies in (2, 0)]
+    book_ids = [book["book_id"] for book in books]
+
+    response = client.post("/loans/batch", json={
+        "user_id": user_id,
+        "book_ids": [book_ids[0], book_ids[1], 99999999, book_ids[0]],
+        "loan_due_date": "2000-01-01"
+    }, headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [item["status"] for item in results] == ["ok", "error", "error", "error"]
+    assert [item["detail"] for item in results[1:]] == [
+        "No available copies to borrow", "Book not found", "Duplicate book in batch"
+    ]
+    loan_id = results[0]["loan"]["loan_id"]
+
+    response = client.post("/loans/batch/return", json={"loan_ids": [loan_id, loan_id, 99999999]}, headers=headers)
+    results = response.json()
+    assert [item["status"] for item in results] == ["ok", "error", "error"]
+    assert results[0]["loan"]["return_date"] is not None
+    assert float(results[0]["loan"]["loan_fine"]) > 0
+
+    book = next(book for book in client.get(f"/books/{books[0]['book_name']}").json() if book["book_id"] == book_ids[0])
+    assert book["number_available_volumes"] == 2
+
+    response = client.post("/loans/batch/return", json={"loan_ids": [loan_id]}, headers=headers)
+    assert response.json()[0]["detail"] == "Book already returned"
+
+
+def test_loan_history_fast_path_matches_schema_and_streams_ndjson():
+    import gzip
+    import json
+    from app import crud, database as db
+    from app.routes import LOAN_HISTORY_PAGE_SIZE
+    from app.schemas import LoanWithBookUser
+
+    token = client.post("/token", data={
+        "username": "admin_stats",
+        "password": "adminpass"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/loans/history", headers=headers)
+    assert response.status_code == 200
+
+    # Same page through crud (live and archived loans) and the response schema.
+    session = db.SessionLocal()
+    expected = [
+        LoanWithBookUser.model_validate(loan).model_dump(mode="json")
+        for loan in crud.get_loan_history(session, LOAN_HISTORY_PAGE_SIZE)
+    ]
+    session.close()
+    assert response.json() == expected
+
+    streamed = client.get("/loans/history", params={"limit": LOAN_HISTORY_PAGE_SIZE}, headers={
+        **headers, "Accept": "application/x-ndjson", "Accept-Encoding": "identity"
+    })
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line) for line in streamed.text.splitlines()] == response.json()
+
+    # The gzip body is decoded by the client; check the raw stream is gzip too.
+    with client.stream("GET", "/books/", params={"limit": 1000},
+                       headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}) as raw:
+        assert raw.headers["content-encoding"] == "gzip"
+        books = [json.loads(line) for line in gzip.decompress(b"".join(raw.iter_raw())).splitlines()]
+    assert books == client.get("/books/", params={"limit": 1000}).json()
+
+
+def test_archived_loans_stay_in_history_and_exports(make_user, make_book):
+    from datetime import date
+    from app import archive, database as db, models
+
+    borrower = make_user("archive_borrower")
+    headers = borrower.headers
+    admin_headers = make_user("archive_admin", admin=True).headers
+    user_id = borrower.user_id
+    book_id = make_book("Archive Book")["book_id"]
+
+    loan_id = client.post("/loans/", json={
+        "user_id": user_id, "book_id": book_id, "loan_due_date": "1999-12-01"
+    }, headers=headers).json()["loan_id"]
+    client.post(f"/loans/{loan_id}/return", json={"return_date": "1999-12-11"}, headers=headers)
+    before = client.get("/loans/me", headers=headers).json()
+
+    session = db.SessionLocal()
+    summary = archive.archive_loans(session, older_than_days=0, batch_size=1, today=date(2000, 1, 1))
+    assert summary["status"] == "completed" and summary["archived"] == 1
+    assert session.get(models.Loan, loan_id) is None
+    assert session.get(models.LoanArchive, (loan_id, date(1999, 12, 11))) is not None
+    session.close()
+
+    assert client.get("/loans/me", headers=headers).json() == before
+    # The archived id is never handed out again.
+    assert client.post("/loans/", json={
+        "user_id": user_id, "book_id": book_id, "loan_due_date": "2030-01-01"
+    }, headers=headers).json()["loan_id"] > loan_id
+    history = client.get("/loans/history", params={"user_id": user_id, "returned": True}, headers=admin_headers).json()
+    archived = next(loan for loan in history if loan["loan_id"] == loan_id)
+    assert archived["return_date"] == "1999-12-11" and float(archived["loan_fine"]) == 15
+    assert f"\n{loan_id}," in client.get("/loans/me/export", headers=headers).text
+    assert f"\n{loan_id},{user_id},{borrower.username}," in client.get("/admin/loans/export", headers=admin_headers).text
+    assert not any(loan["loan_id"] == loan_id for loan in client.get(
+        "/loans/history", params={"user_id": user_id, "returned": False}, headers=admin_headers
+    ).json())
+
+
+def test_loan_history_filters_keyset_pages_and_count_estimate():
+    import json
+    from datetime import date
+
+    token = client.post("/token", data={
+        "username": "admin_stats",
+        "password": "adminpass"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    everything = [json.loads(line) for line in client.get("/loans/history", headers={
+        **headers, "Accept": "application/x-ndjson"
+    }).text.splitlines()]
+    assert [(loan["loan_due_date"], loan["loan_id"]) for loan in everything] == sorted(
+        ((loan["loan_due_date"], loan["loan_id"]) for loan in everything), reverse=True
+    )
+
+    pages, cursor = [], None
+    while True:
+        response = client.get("/loans/history", params={"limit": 3, **({"cursor": cursor} if cursor else {})},
+                              headers=headers)
+        assert response.status_code == 200 and len(response.json()) <= 3
+        pages.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert pages == everything
+
+    book_id = everything[0]["book_id"]
+    response = client.get("/loans/history", params={"book_id": book_id, "estimate_count": True}, headers=headers)
+    assert response.json() == [loan for loan in everything if loan["book_id"] == book_id]
+    assert int(response.headers["X-Total-Count-Estimate"]) == len(response.json())
+
+    today = date.today().isoformat()
+    overdue = client.get("/loans/history", params={"overdue": True}, headers=headers).json()
+    assert overdue == [loan for loan in everything if loan["return_date"] is None and loan["loan_due_date"] < today]
+    ranged = client.get("/loans/history", params={"start_date": "2000-01-01", "end_date": "2000-12-31"},
+                        headers=headers).json()
+    assert ranged == [loan for loan in everything if "2000-01-01" <= loan["loan_due_date"] <= "2000-12-31"]
+
+    assert client.get("/loans/history", params={"cursor": "bm9wZQ"}, headers=headers).status_code == 400
+    assert client.get("/loans/history", params={"limit": 5000}, headers=headers).status_code == 422
+
+
+def test_admin_stats_reconcile_with_read_only_replica(monkeypatch, make_user):
+    from app import crud, database as db
+
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("uses a read-only SQLite URI as the replica")
+    admin = make_user("stats_replica_admin", admin=True)
+    monkeypatch.setattr(crud, "STATS_MODE", "counters")
+    monkeypatch.setattr(crud, "STATS_RECONCILE_SECONDS", -1)
+    crud.stats_cache.clear()
+    db.configure_read_replicas([f"sqlite:///file:{db.engine.url.database}?mode=ro&uri=true"])
+    try:
+        response = client.get("/admin/stats", headers=admin.headers)
+    finally:
+        db.configure_read_replicas([])
+        crud.stats_cache.clear()
+    assert response.status_code == 200
@@ -0,0 +1,160 @@
+import sys
+import os
+import uuid
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sqlalchemy import event
+import main  # noqa: F401
+from datetime import date, timedelta
+from app import crud, migrations, schemas
+from app.database import SessionLocal, engine
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="EXPLAIN QUERY PLAN checks are SQLite-specific")
+
+
+def test_migrations_are_applied_and_idempotent():
+    assert migrations.applied_versions(engine) == {version for version, _, _ in migrations.MIGRATIONS}
+    assert migrations.upgrade(engine) == []
+
+
+def test_fresh_database_matches_models(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from app.database import Base
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migrations.upgrade(fresh)
+    inspector = inspect(fresh)
+    for table in Base.metadata.sorted_tables:
+        assert {column["name"] for column in inspector.get_columns(table.name)} == set(table.columns.keys())
+        # Trigram indexes only exist on PostgreSQL.
+        expected = {index.name for index in table.indexes if not index.name.endswith("_trgm")}
+        assert {index["name"] for index in inspector.get_indexes(table.name)} == expected, table.name
+    fresh.dispose()
+
+
+def test_stale_upgrade_does_not_rebuild_loans_again(monkeypatch, tmp_path):
+    from sqlalchemy import create_engine, text
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'stale.db'}")
+    migrations.upgrade(fresh)
+    with fresh.begin() as connection:
+        connection.execute(text("INSERT INTO users (user_id, username, user_email, hashed_password, is_admin) "
+                                "VALUES (1, 'u', 'u@example.com', 'x', 0)"))
+        connection.execute(text("INSERT INTO books (book_id, book_name, book_genre, book_year, book_author, "
+                                "book_language, number_available_volumes) "
+                                "VALUES (1, 'b', 'g', 2000, 'a', 'English', 1)"))
+        connection.execute(text("INSERT INTO loans (user_id, book_id, loan_due_date) VALUES (1, 1, '2030-01-01')"))
+
+    # A worker that read schema_migrations before version 8 was recorded.
+    all_versions = {version for version, _, _ in migrations.MIGRATIONS}
+    monkeypatch.setattr(migrations, "applied_versions", lambda engine: all_versions - {8})
+    assert migrations.upgrade(fresh) == []
+    # Running the rebuild itself again is a no-op too.
+    with fresh.begin() as connection:
+        migrations._loan_ids_autoincrement(connection)
+
+    with fresh.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM loans")).scalar() == 1
+        assert not connection.execute(
+            text("SELECT name FROM sqlite_master WHERE name = 'loans_before_autoincrement'")
+        ).first()
+    fresh.dispose()
+
+
+def test_natural_key_migration_names_duplicate_editions(monkeypatch, tmp_path):
+    from sqlalchemy import create_engine, text
+
+    fresh = create_engine(f"sqlite:///{tmp_path / 'duplicates.db'}")
+    monkeypatch.setattr(migrations, "MIGRATIONS", [entry for entry in migrations.MIGRATIONS if entry[0] < 7])
+    migrations.upgrade(fresh)
+    with fresh.begin() as connection:
+        for book_id in (1, 2):
+            connection.execute(text(
+                "INSERT INTO books (book_id, book_name, book_genre, book_year, book_author, book_language, "
+                "number_available_volumes) VALUES (:book_id, 'Twice Told', 'g', 2000, 'a', 'English', 1)"
+            ), {"book_id": book_id})
+    monkeypatch.undo()
+
+    with pytest.raises(RuntimeError, match="Twice Told.*2 rows"):
+        migrations.upgrade(fresh)
+    assert 7 not in migrations.applied_versions(fresh)
+
+    with fresh.begin() as connection:
+        connection.execute(text("DELETE FROM books WHERE book_id = 2"))
+    assert 7 in migrations.upgrade(fresh)
+    fresh.dispose()
+
+
+def test_importing_main_skips_schema_work_and_reportlab(tmp_path):
+    import subprocess
+
+    database = tmp_path / "cold.db"
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}"}
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, main; print('reportlab' in sys.modules)"],
+        cwd=os.path.join(os.path.dirname(__file__), '..'), env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"
+    assert not database.exists()
+
+
+def query_plans(call):
+    """Run call(db) and return the EXPLAIN QUERY PLAN of every SELECT it issued."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        call(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    plans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plans.append(" | ".join(row[-1] for row in rows))
+    db.close()
+    return plans
+
+
+@pytest.fixture(scope="module")
+def open_loans():
+    db = SessionLocal()
+    user = crud.get_user_by_username(db, "plan_borrower") or crud.create_user(
+        db, schemas.UserCreate(username="plan_borrower", user_email="plan_borrower@example.com", password="x"),
+        hashed_pw="x"
+    )
+    book = crud.create_book(db, schemas.BookCreate(
+        book_name=f"Query Plan Book {uuid.uuid4().hex[:8]}", book_genre="Test", book_year=2000,
+        book_author="Plan Author", book_language="English", number_available_volumes=2
+    ))
+    for due_date in (date.today() - timedelta(days=2), date.today() + timedelta(days=2)):
+        crud.create_loan(db, schemas.LoanCreate(user_id=user.user_id, book_id=book.book_id, loan_due_date=due_date))
+    db.close()
+
+
+@pytest.mark.usefixtures("open_loans")
+@pytest.mark.parametrize("call, index", [
+    (lambda db: crud.get_loans_by_user(db, 1), "ix_loans_user_id_due_date"),
+    (lambda db: crud.get_loans_by_user(db, 1), "ix_loans_archive_user_id_due_date"),
+    # Unfiltered history pages walk the keyset index on both tables.
+    (lambda db: crud.get_loan_history(db, 10), "ix_loans_due_date_loan_id"),
+    (lambda db: crud.get_loan_history(db, 10), "ix_loans_archive_due_date_loan_id"),
+    # Served from the in-process due-date index; only the matching rows are fetched.
+    (lambda db: crud.get_overdue_loans(db), "INTEGER PRIMARY KEY"),
+    (lambda db: crud.get_loans_due_soon(db), "INTEGER PRIMARY KEY"),
+    (lambda db: crud.get_user_by_username(db, "borrower"), "uq_users_username"),
+])
+def test_hot_queries_use_indexes(call, index):
+    query_plans(call)  # let in-process indexes load first
+    plans = query_plans(call)
+    assert plans
+    assert all(index in plan for plan in plans), plans
@@ -0,0 +1,111 @@
+import sys
+import os
+from datetime import date, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def test_due_date_index_range_queries():
+    from app.notifications import DueDateIndex
+
+    today = date.today()
+    index = DueDateIndex()
+    index.add(1, 10, today - timedelta(days=3))
+    index.add(2, 10, today + timedelta(days=1))
+    index.add(3, 11, today)
+    index.add(2, 10, today + timedelta(days=9))
+    index.remove(4)
+
+    assert [loan_id for loan_id, _, _ in index.between(None, today)] == [1]
+    assert [loan_id for loan_id, _, _ in index.between(today, today + timedelta(days=4))] == [3]
+    assert len(index) == 3
+    index.remove(1)
+    assert index.between(None, today) == []
+
+
+def test_overdue_endpoint_follows_borrow_and_return_and_outbox_is_deduplicated(make_user, make_book):
+    from app import database as db, models, notifications
+
+    admin_headers = make_user("notify_admin", admin=True).headers
+    borrower = make_user("notify_borrower")
+    headers, user_id = borrower.headers, borrower.user_id
+    book = make_book("Notification Test Book", book_author="Outbox Author", book_genre="Test",
+                     book_year=2003, number_available_volumes=5)
+
+    due_dates = [date.today() - timedelta(days=2), date.today() + timedelta(days=1)]
+    overdue, due_soon = [
+        client.post("/loans/", json={"user_id": user_id, "book_id": book["book_id"], "loan_due_date": str(due)},
+                    headers=headers).json()["loan_id"]
+        for due in due_dates
+    ]
+
+    overdue_ids = [loan["loan_id"] for loan in client.get("/loans/overdue", headers=admin_headers).json()]
+    assert overdue in overdue_ids and due_soon not in overdue_ids
+    due_soon_ids = [loan["loan_id"] for loan in client.get("/notifications/due-soon", headers=admin_headers).json()]
+    assert due_soon in due_soon_ids and overdue not in due_soon_ids
+
+    # Emitting twice must leave exactly one event per loan; other tests' loans are ignored.
+    session = db.SessionLocal()
+    notifications.emit_due_notifications(session)
+    notifications.emit_due_notifications(session)
+    outbox = models.NotificationOutbox
+    events = sorted(
+        (row.loan_id, row.event_type)
+        for row in session.query(outbox).filter(outbox.loan_id.in_([overdue, due_soon]))
+    )
+    assert events == sorted([(overdue, notifications.OVERDUE), (due_soon, notifications.DUE_SOON)])
+    session.close()
+
+    client.post(f"/loans/{overdue}/return", json={}, headers=headers)
+    overdue_ids = [loan["loan_id"] for loan in client.get("/loans/overdue", headers=admin_headers).json()]
+    assert overdue not in overdue_ids
+
+
+def test_availability_long_poll_and_stream_follow_borrow_return_and_other_workers(monkeypatch, make_user, make_book):
+    import threading
+    import time
+    from app import availability, database as db, models
+
+    borrower = make_user("availability_borrower")
+    headers, user_id = borrower.headers, borrower.user_id
+    book_id = make_book("Availability Push Book", book_author="Push Author", book_genre="Test",
+                        book_year=2004)["book_id"]
+    poll = "/books/availability/poll"
+
+    assert client.get(poll, params={"book_id": book_id}).json() == [{"book_id": book_id, "number_available_volumes": 1}]
+    assert client.get(poll, params={"book_id": 99999999}).status_code == 404
+    assert client.get(poll, params={"book_id": book_id, "known": "nope"}).status_code == 400
+
+    result = {}
+
+    def wait_for_change():
+        started = time.perf_counter()
+        result["body"] = client.get(poll, params={"book_id": book_id, "known": f"{book_id}:1", "timeout": 20}).json()
+        result["seconds"] = time.perf_counter() - started
+
+    waiter = threading.Thread(target=wait_for_change)
+    waiter.start()
+    time.sleep(0.5)
+    loan = client.post("/loans/", json={"user_id": user_id, "book_id": book_id}, headers=headers).json()
+    waiter.join(timeout=20)
+    assert result["body"] == [{"book_id": book_id, "number_available_volumes": 0}]
+    assert result["seconds"] < 3  # woken by the publish, not the 5s refresh
+    assert not availability._watchers
+
+    client.post(f"/loans/{loan['loan_id']}/return", json={}, headers=headers)
+    stream = client.get("/books/availability/stream", params={"book_id": book_id, "timeout": 0.5})
+    assert stream.headers["content-type"].startswith("text/event-stream")
+    assert f'data: {{"book_id":{book_id},"number_available_volumes":1}}' in stream.text
+
+    # A change committed by another worker process is found by the periodic refresh.
+    monkeypatch.setattr(availability, "AVAILABILITY_REFRESH_SECONDS", 0.1)
+    session = db.SessionLocal()
+    session.get(models.Book, book_id).number_available_volumes = 4
+    session.commit()
+    session.close()
+    body = client.get(poll, params={"book_id": book_id, "known": f"{book_id}:1", "timeout": 5}).json()
+    assert body == [{"book_id": book_id, "number_available_volumes": 4}]
@@ -0,0 +1,183 @@
+import sys
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from main import app
+from app.database import engine
+
+client = TestClient(app)
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def borrow_books(make_book, count, user_id, headers, due_date):
+    for _ in range(count):
+        book = make_book("Query Count Book", book_author="Query Author")
+        response = client.post("/loans/", json={
+            "user_id": user_id,
+            "book_id": book["book_id"],
+            "loan_due_date": str(due_date)
+        }, headers=headers)
+        assert response.status_code == 200
+
+
+def query_count(url, headers):
+    # Warm up first so one-off work (principal lookups, caches) is not counted.
+    client.get(url, headers=headers)
+    with count_queries() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(statements), len(response.json())
+
+
+def test_loan_endpoints_query_count_does_not_grow_with_results(make_user, make_book):
+    user = make_user("query_counter")
+    user_id, headers = user.user_id, user.headers
+    admin_headers = make_user("query_counter_admin", admin=True).headers
+    urls = {
+        "/loans/me": headers,
+        "/loans/overdue": admin_headers,
+        "/notifications/due-soon": admin_headers,
+        # Unfiltered history is a fixed-size page; this user's loans fit on one.
+        f"/loans/history?user_id={user_id}": admin_headers,
+    }
+
+    overdue, due_soon = date.today() - timedelta(days=5), date.today() + timedelta(days=1)
+    borrow_books(make_book, 1, user_id, headers, overdue)
+    borrow_books(make_book, 1, user_id, headers, due_soon)
+    before = {url: query_count(url, h) for url, h in urls.items()}
+
+    borrow_books(make_book, 3, user_id, headers, overdue)
+    borrow_books(make_book, 3, user_id, headers, due_soon)
+    after = {url: query_count(url, h) for url, h in urls.items()}
+
+    for url in urls:
+        assert after[url][1] > before[url][1], url
+        assert after[url][0] == before[url][0], f"{url} issued {after[url][0]} queries, was {before[url][0]}"
+
+
+def test_pool_stats_and_long_session_warning(monkeypatch, caplog, make_user):
+    from app import database
+
+    admin_headers = make_user("pool_stats_admin", admin=True).headers
+    monkeypatch.setattr(database, "DB_SESSION_WARN_SECONDS", 0)
+
+    with caplog.at_level("WARNING", logger="app.database"):
+        response = client.get("/admin/pool", headers=admin_headers)
+
+    assert response.status_code == 200
+    primary = response.json()["primary"]
+    assert primary["hold_seconds"]["count"] > 0
+    assert "checkout_wait_seconds" in primary
+    assert any("held for" in record.getMessage() for record in caplog.records)
+
+    # One family per pool metric, told apart by the pool label.
+    text = client.get("/metrics").text
+    assert metric_value(text, 'db_pool_hold_seconds_count{pool="primary"}') > 0
+    assert metric_value(text, 'db_pool_timeouts_total{pool="primary"}') is not None
+    assert "db_pool_primary_" not in text
+
+
+def metric_value(text, sample):
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_attribute_requests_and_sql_per_route(monkeypatch, caplog, make_user):
+    from app import instrumentation
+
+    headers = make_user("metrics_user").headers
+    client.get("/loans/me", headers=headers)
+    client.get("/no/such/path")
+
+    text = client.get("/metrics").text
+    route = 'method="GET",route="/loans/me"'
+    assert metric_value(text, f'http_requests_total{{{route},status="200"}}') >= 1
+    assert metric_value(text, f"http_request_db_queries_sum{{{route}}}") >= 1
+    assert metric_value(text, f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}') >= 1
+    assert metric_value(text, 'http_requests_total{method="GET",route="unmatched",status="404"}') >= 1
+    assert "# TYPE http_requests_in_flight gauge" in text
+    assert "principal_cache_hits_total" in text
+    assert "password_hash_seconds_count" in text
+
+    monkeypatch.setattr(instrumentation, "SLOW_REQUEST_SECONDS", 1e-9)
+    with caplog.at_level("WARNING", logger="app.instrumentation"):
+        client.get("/loans/me", headers=headers)
+    slow = [record.getMessage() for record in caplog.records if "Slow request" in record.getMessage()]
+    assert slow and "/loans/me" in slow[0] and "SELECT" in slow[0]
+
+
+def test_read_routes_share_the_auth_session_without_replicas(monkeypatch, make_user):
+    import pytest
+    from app import database
+
+    if database.DB_ASYNC:
+        pytest.skip("async routes use get_async_db")
+
+    headers = make_user("shared_session_user").headers
+    opened = []
+    session_factory = database.SessionLocal
+    monkeypatch.setattr(database, "SessionLocal", lambda **kw: opened.append(kw) or session_factory(**kw))
+
+    assert client.get("/loans/me", headers=headers).status_code == 200
+    assert client.get("/books/", params={"limit": 1}).status_code == 200
+    assert len(opened) == 2
+
+
+def test_reads_use_replica_until_caller_writes(monkeypatch, tmp_path, make_user, make_book):
+    import pytest
+    from sqlalchemy import create_engine
+    from app import database, dependencies, migrations, models
+
+    if database.DB_ASYNC:
+        pytest.skip("async routes always read from the primary")
+
+    replica_url = f"sqlite:///{tmp_path}/replica.db"
+    replica = create_engine(replica_url)
+    migrations.upgrade(replica)
+    with replica.begin() as connection:
+        connection.execute(models.Book.__table__.insert(), [{
+            "book_name": "Replica Only Book", "book_genre": "Tech", "book_year": 2024,
+            "book_author": "Replica Author", "book_language": "English", "number_available_volumes": 1
+        }])
+    replica.dispose()
+
+    reader = make_user("replica_reader")
+    user_id, headers = reader.user_id, reader.headers
+    database.configure_read_replicas([replica_url])
+    monkeypatch.setattr(database, "DB_REPLICA_MAX_LAG_SECONDS", 60)
+    monkeypatch.setattr(dependencies, "_primary_pins", {})
+    try:
+        borrow_books(make_book, 1, user_id, headers, date.today() + timedelta(days=7))
+        # Just wrote: the cookie and the per-user pin both keep reads on the primary.
+        assert len(client.get("/loans/me", headers=headers).json()) == 1
+        client.cookies.clear()
+        assert len(client.get("/loans/me", headers=headers).json()) == 1
+
+        # Once the window has passed, reads go to the (lagging) replica.
+        monkeypatch.setattr(database, "DB_REPLICA_MAX_LAG_SECONDS", 0)
+        dependencies._primary_pins.clear()
+        assert client.get("/loans/me", headers=headers).json() == []
+        names = [book["book_name"] for book in client.get("/books/").json()]
+        assert names == ["Replica Only Book"]
+    finally:
+        database.configure_read_replicas([])
+        client.cookies.clear()